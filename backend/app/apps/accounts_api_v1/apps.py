@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class AccountsApiV1Config(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.accounts_api_v1'
+
+    def ready(self):
+        # The signals that invalidate the cached credentials must be connected in every process.
+        from . import authentication  # noqa: F401
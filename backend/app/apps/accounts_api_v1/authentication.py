@@ -0,0 +1,177 @@
+"""
+The cached authentication of the API.
+
+The token and the Basic authentication of DRF read the token and its user from the database and hash
+the password on every request. Here the authenticated user is cached by the digest of the credentials:
+in the shared cache for settings.AUTH_TOKEN_CACHE_TIMEOUT (tokens) or settings.AUTH_BASIC_CACHE_TIMEOUT
+(Basic credentials, the failed ones are never cached) and in the process for settings.AUTH_LOCAL_CACHE_TIMEOUT.
+
+A cached user carries the generation of the user, which is changed whenever the user is saved
+(a password change, a deactivation) or deleted, so all its cached credentials stop working at once.
+The generation is read before the user is, so a change committed in between makes the cached user invalid.
+The token is dropped from the cache when it is deleted on logout. The other processes may still
+accept the revoked credentials from their in-process cache for settings.AUTH_LOCAL_CACHE_TIMEOUT.
+"""
+
+import copy
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.utils.crypto import salted_hmac
+from rest_framework.authentication import BasicAuthentication, TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+CACHE_KEY_PREFIX = 'auth'
+
+# The maximum number of the credentials cached in the process
+LOCAL_CACHE_MAX_SIZE = 10000
+
+_local_cache = {}
+_local_cache_lock = threading.Lock()
+
+
+def get_credentials_key(kind: str, *credentials: str) -> str:
+    """Returns the cache key of the credentials, a digest salted with the secret key instead of the credentials."""
+
+    digest = salted_hmac(f'{CACHE_KEY_PREFIX}.{kind}', '\x1f'.join(credentials), algorithm='sha256').hexdigest()
+    return f'{CACHE_KEY_PREFIX}:{kind}:{digest}'
+
+
+def get_generation_key(user_pk) -> str:
+    return f'{CACHE_KEY_PREFIX}:generation:{user_pk}'
+
+
+def get_cached_credentials(key: str):
+    """Returns the cached result of the authentication, or None if it is not cached or the user has changed since."""
+
+    with _local_cache_lock:
+        entry = _local_cache.get(key)
+    if entry is not None and entry[0] > time.monotonic():
+        return entry[1]
+
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    result, user_pk, generation = entry
+    if cache.get(get_generation_key(user_pk)) != generation:
+        return None
+
+    if settings.AUTH_LOCAL_CACHE_TIMEOUT > 0:
+        with _local_cache_lock:
+            if len(_local_cache) >= LOCAL_CACHE_MAX_SIZE:
+                _local_cache.clear()
+            _local_cache[key] = (time.monotonic() + settings.AUTH_LOCAL_CACHE_TIMEOUT, result)
+    return result
+
+
+def get_generation(user_pk) -> str | None:
+    """Returns the current generation of the user, a new one is started if the user has none."""
+
+    generation_key = get_generation_key(user_pk)
+    cache.add(generation_key, uuid.uuid4().hex, timeout=None)
+    return cache.get(generation_key)
+
+
+def cache_credentials(key: str, result, user, user_pk, generation: str | None, timeout: float) -> None:
+    """
+    Caches the result of the authentication of the user with the generation read before the user was.
+
+    Parameters:
+        key (str): The cache key of the credentials.
+        result: The result of the authentication.
+        user: The authenticated user.
+        user_pk: The primary key of the user the generation has been read for, None if there is none.
+        generation (str | None): The generation of the user read before the user.
+        timeout (float): The time in seconds the credentials are cached for.
+    """
+
+    # The credentials have been changed to another user in the meantime, the generation is not its one.
+    if generation is None or user.pk != user_pk:
+        return
+    cache.set(key, (result, user.pk, generation), timeout=timeout)
+
+
+def invalidate_credentials(key: str) -> None:
+    cache.delete(key)
+    with _local_cache_lock:
+        _local_cache.pop(key, None)
+
+
+def invalidate_user(user_pk) -> None:
+    """Makes all the cached credentials of the user invalid."""
+
+    cache.set(get_generation_key(user_pk), uuid.uuid4().hex, timeout=None)
+    with _local_cache_lock:
+        _local_cache.clear()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    The token authentication that caches the token and its user.
+    """
+
+    def authenticate_credentials(self, key):
+        cache_key = get_credentials_key('token', key)
+        if (cached := get_cached_credentials(cache_key)) is not None:
+            user, token = cached
+            # The cached objects are shared by the requests of the process, every request gets its own copy.
+            return copy.copy(user), token
+
+        # The generation is read before the user, so a change committed in between makes the cached user invalid.
+        user_pk = self.get_model().objects.filter(key=key).values_list('user_id', flat=True).first()
+        generation = get_generation(user_pk) if user_pk is not None else None
+        user, token = super().authenticate_credentials(key)
+        cache_credentials(
+            cache_key, (user, token), user, user_pk, generation, timeout=settings.AUTH_TOKEN_CACHE_TIMEOUT,
+        )
+        return user, token
+
+
+class CachedBasicAuthentication(BasicAuthentication):
+    """
+    The Basic authentication that remembers the verified credentials for a short time,
+    so the password is not hashed on every request.
+    """
+
+    def authenticate_credentials(self, userid, password, request=None):
+        cache_key = get_credentials_key('basic', userid, password)
+        if (cached := get_cached_credentials(cache_key)) is not None:
+            return copy.copy(cached), None
+
+        user_model = get_user_model()
+        user_pk = user_model._default_manager.filter(
+            **{user_model.USERNAME_FIELD: userid}
+        ).values_list('pk', flat=True).first()
+        generation = get_generation(user_pk) if user_pk is not None else None
+        user, auth = super().authenticate_credentials(userid, password, request)
+        cache_credentials(cache_key, user, user, user_pk, generation, timeout=settings.AUTH_BASIC_CACHE_TIMEOUT)
+        return user, auth
+
+
+def invalidate_token(sender, instance, **kwargs):
+    """Drops the deleted token (e.g. on logout) from the cache."""
+
+    invalidate_credentials(get_credentials_key('token', instance.key))
+
+
+def invalidate_changed_user(sender, instance, update_fields=None, **kwargs):
+    """
+    Makes the cached credentials of the changed or deleted user invalid. It is done after the commit,
+    when the other requests can read the changed user, so they do not cache the old one with the new generation.
+    """
+
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        # The login time is saved on every login, it does not affect the credentials.
+        return
+    transaction.on_commit(lambda: invalidate_user(instance.pk))
+
+
+post_delete.connect(invalidate_token, sender=Token)
+post_save.connect(invalidate_changed_user, sender=settings.AUTH_USER_MODEL)
+post_delete.connect(invalidate_changed_user, sender=settings.AUTH_USER_MODEL)
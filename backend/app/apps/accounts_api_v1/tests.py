@@ -1,3 +1,91 @@
-from django.test import TestCase
+from base64 import b64encode
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from .authentication import _local_cache, invalidate_user
+
+LOCAL_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=LOCAL_CACHES, AUTH_LOCAL_CACHE_TIMEOUT=0)
+class CachedAuthenticationTests(TestCase):
+    """
+    Checks that the cached credentials skip the database and stop working when they are revoked.
+    """
+
+    def setUp(self):
+        cache.clear()
+        _local_cache.clear()
+        self.user = get_user_model().objects.create_user('trader', 'trader@example.com', 'correct-horse')
+        self.user.is_active = True
+        self.user.save()
+        self.token = Token.objects.create(user=self.user)
+
+    def get_me(self, authorization):
+        return self.client.get('/api/v1/auth/users/me/', HTTP_AUTHORIZATION=authorization)
+
+    def save_user(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+
+    def test_token(self):
+        authorization = f'Token {self.token.key}'
+        self.assertEqual(self.get_me(authorization).status_code, 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_me(authorization).json()['username'], 'trader')
+
+        response = self.client.post('/api/v1/auth/token/logout/', HTTP_AUTHORIZATION=authorization)
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.get_me(authorization).status_code, 401)
+
+    def test_token_of_deactivated_user(self):
+        authorization = f'Token {self.token.key}'
+        self.assertEqual(self.get_me(authorization).status_code, 200)
+        self.user.is_active = False
+        self.save_user()
+        self.assertEqual(self.get_me(authorization).status_code, 401)
+
+    def test_change_during_lookup(self):
+        # The user is deactivated after it has been read, before its credentials are cached.
+        authorization = f'Token {self.token.key}'
+        authenticate = TokenAuthentication.authenticate_credentials
+
+        def authenticate_and_deactivate(authentication, key):
+            result = authenticate(authentication, key)
+            get_user_model().objects.filter(pk=self.user.pk).update(is_active=False)
+            invalidate_user(self.user.pk)
+            return result
+
+        with mock.patch.object(TokenAuthentication, 'authenticate_credentials', authenticate_and_deactivate):
+            self.assertEqual(self.get_me(authorization).status_code, 200)
+        self.assertEqual(self.get_me(authorization).status_code, 401)
+
+    def test_basic(self):
+        authorization = 'Basic ' + b64encode(b'trader:correct-horse').decode()
+        self.assertEqual(self.get_me(authorization).status_code, 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_me(authorization).status_code, 200)
+        wrong = 'Basic ' + b64encode(b'trader:wrong').decode()
+        self.assertEqual(self.get_me(wrong).status_code, 401)
+
+        self.user.set_password('battery-staple')
+        self.save_user()
+        self.assertEqual(self.get_me(authorization).status_code, 401)
+
+    @override_settings(AUTH_LOCAL_CACHE_TIMEOUT=60)
+    def test_local_cache(self):
+        authorization = f'Token {self.token.key}'
+        self.assertEqual(self.get_me(authorization).status_code, 200)
+        self.assertEqual(self.get_me(authorization).status_code, 200)
+        cache.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_me(authorization).status_code, 200)
+        # The process that saves the user drops its own cached credentials at once.
+        self.user.is_active = False
+        self.save_user()
+        self.assertEqual(self.get_me(authorization).status_code, 401)
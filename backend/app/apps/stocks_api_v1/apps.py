@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class StocksApiV1Config(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.stocks_api_v1'
+
+    def ready(self):
+        from . import metrics, signals  # noqa: F401
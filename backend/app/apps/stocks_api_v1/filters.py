@@ -0,0 +1,35 @@
+from rest_framework.filters import BaseFilterBackend
+
+from .serializers import StockFilterSerializer
+
+# The lookups of the validated filters, every filter is backed by an index of the Stock table.
+STOCK_FILTER_LOOKUPS = {
+    'status': 'status__in',
+    'sectype': 'sectype__in',
+    'listlevel': 'listlevel__in',
+    'currencyid': 'currencyid__in',
+    'faceunit': 'faceunit__in',
+    'prevprice_min': 'prevprice__gte',
+    'prevprice_max': 'prevprice__lte',
+    'issuesize_min': 'issuesize__gte',
+    'issuesize_max': 'issuesize__lte',
+}
+
+
+class StockFilterBackend(BaseFilterBackend):
+    """
+    Filters the stocks by the query parameters validated with StockFilterSerializer.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        query = StockFilterSerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+
+        lookups = {}
+        for name, value in query.validated_data.items():
+            if isinstance(value, (set, list)):
+                if not value:
+                    continue
+                value = sorted(value)
+            lookups[STOCK_FILTER_LOOKUPS[name]] = value
+        return queryset.filter(**lookups)
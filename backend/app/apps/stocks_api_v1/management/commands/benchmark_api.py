@@ -0,0 +1,263 @@
+import json
+import random
+import socket
+import statistics
+import subprocess
+import threading
+
+from datetime import datetime, timezone
+from socketserver import ThreadingMixIn
+from time import perf_counter
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+import httpx
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.authtoken.models import Token
+
+from ...models import Stock
+from ...utils.caching import bump_dataset_version
+from ...utils.ingestion import STOCK_FIELD_MAP
+from ...utils.synthetic import generate_stocks
+
+BENCHMARK_USERNAME = 'benchmark'
+BENCHMARK_PASSWORD = 'benchmark-password-1'
+
+# The name, the method, the path and whether the token is sent. {ticker} is replaced with a random ticker.
+ENDPOINTS = [
+    ('stock-list', 'GET', '/api/v1/stocks/', False),
+    ('stock-list-page', 'GET', '/api/v1/stocks/?page_size=100', False),
+    ('stock-list-fields', 'GET', '/api/v1/stocks/?fields=ticker,prevprice', False),
+    ('stock-detail', 'GET', '/api/v1/stocks/{ticker}/', False),
+    ('auth-token-login', 'POST', '/api/v1/auth/token/login/', False),
+    ('auth-users-me', 'GET', '/api/v1/auth/users/me/', True),
+]
+
+CACHES = {
+    'dummy': {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+    'locmem': {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+}
+
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = ('Measures the latency, the queries and the response size of the stocks and auth endpoints '
+            'on synthetic data in a test database, through the test client and a real WSGI server.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[1000, 10000],
+                            help='The numbers of synthetic stocks.')
+        parser.add_argument('--requests', type=int, default=200, help='The number of requests per endpoint.')
+        parser.add_argument('--endpoints', nargs='+', choices=[endpoint[0] for endpoint in ENDPOINTS],
+                            help='The endpoints to measure. Defaults to all.')
+        parser.add_argument('--transports', nargs='+', choices=('client', 'wsgi'), default=['client', 'wsgi'],
+                            help='The Django test client and/or a threaded WSGI server on localhost.')
+        parser.add_argument('--concurrency', type=int, default=1,
+                            help='The number of concurrent clients of the WSGI server.')
+        parser.add_argument('--caches', nargs='+', choices=tuple(CACHES), default=list(CACHES),
+                            help='The cache backends: dummy measures the uncached responses.')
+        parser.add_argument('--output', default='benchmark_api.json', help='The JSON file of the results.')
+        parser.add_argument('--baseline', help='The results of a previous run to compare p95 with.')
+        parser.add_argument('--seed', type=int, default=0, help='The seed of the synthetic data and the tickers.')
+
+    def handle(self, *args, **options):
+        endpoints = [endpoint for endpoint in ENDPOINTS
+                     if not options['endpoints'] or endpoint[0] in options['endpoints']]
+        baseline = self._load_baseline(options['baseline'])
+
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        results = []
+        try:
+            token = self._create_user()
+            for size in options['sizes']:
+                tickers = self._seed(size, options['seed'])
+                for cache_name in options['caches']:
+                    # The benchmark makes more requests than the rates allow, the throttling is not measured.
+                    with override_settings(CACHES=CACHES[cache_name], ALLOWED_HOSTS=['*'], THROTTLE_ENABLED=False):
+                        bump_dataset_version()
+                        for transport in options['transports']:
+                            for endpoint in endpoints:
+                                result = self._measure(endpoint, transport, tickers, token, options)
+                                result.update(size=size, cache=cache_name, transport=transport)
+                                results.append(result)
+                                self._report(result, baseline)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        with open(options['output'], 'w') as file:
+            json.dump({'meta': self._get_meta(options), 'results': results}, file, indent=2)
+        self.stdout.write(f'The results have been written to {options["output"]}')
+
+    @staticmethod
+    def _create_user() -> str:
+        user = get_user_model().objects.create_user(
+            BENCHMARK_USERNAME, f'{BENCHMARK_USERNAME}@example.com', BENCHMARK_PASSWORD,
+        )
+        user.is_active = True
+        user.save()
+        return Token.objects.create(user=user).key
+
+    @staticmethod
+    def _seed(size: int, seed: int) -> list[str]:
+        Stock.objects.all().delete()
+        Stock.objects.bulk_create(
+            (Stock(**{field: stock[key] for field, key in STOCK_FIELD_MAP.items()})
+             for stock in generate_stocks(size, seed=seed)),
+            batch_size=1000,
+        )
+        return list(Stock.objects.values_list('ticker', flat=True))
+
+    def _measure(self, endpoint: tuple, transport: str, tickers: list[str], token: str, options: dict) -> dict:
+        name, method, path, authorized = endpoint
+        rnd = random.Random(options['seed'])
+        data = {'username': BENCHMARK_USERNAME, 'password': BENCHMARK_PASSWORD} if method == 'POST' else None
+        headers = {'Authorization': f'Token {token}'} if authorized else {}
+
+        def get_path():
+            return path.format(ticker=rnd.choice(tickers))
+
+        if transport == 'client':
+            samples, sizes, queries, errors = self._run_client(method, get_path, data, headers, options['requests'])
+        else:
+            samples, sizes, errors = self._run_server(
+                method, get_path, data, headers, options['requests'], options['concurrency'],
+            )
+            queries = None
+
+        result = {'endpoint': name, 'requests': len(samples), 'errors': errors}
+        if samples:
+            quantiles = statistics.quantiles(samples, n=100, method='inclusive') if len(samples) > 1 else samples * 99
+            result.update(
+                p50_ms=round(quantiles[49] * 1000, 3),
+                p95_ms=round(quantiles[94] * 1000, 3),
+                p99_ms=round(quantiles[98] * 1000, 3),
+                mean_ms=round(statistics.fmean(samples) * 1000, 3),
+                bytes=round(statistics.fmean(sizes)),
+                queries=round(statistics.fmean(queries), 2) if queries else None,
+            )
+        return result
+
+    @staticmethod
+    def _run_client(method, get_path, data, headers, count):
+        client = Client(headers=headers)
+        samples, sizes, queries, errors = [], [], [], 0
+        # The first request warms up the caches and the lazy imports, it is not measured.
+        for number in range(count + 1):
+            with CaptureQueriesContext(connection) as context:
+                start = perf_counter()
+                if method == 'POST':
+                    response = client.post(get_path(), data, content_type='application/json')
+                else:
+                    response = client.get(get_path())
+                content = b''.join(response) if response.streaming else response.content
+                duration = perf_counter() - start
+            if number == 0:
+                continue
+            if response.status_code >= 400:
+                errors += 1
+                continue
+            samples.append(duration)
+            sizes.append(len(content))
+            queries.append(len(context.captured_queries))
+        return samples, sizes, queries, errors
+
+    @staticmethod
+    def _run_server(method, get_path, data, headers, count, concurrency):
+        server = make_server('127.0.0.1', 0, get_wsgi_application(),
+                             server_class=_ThreadingWSGIServer, handler_class=_QuietHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+
+        samples, sizes, lock = [], [], threading.Lock()
+        errors = 0
+        paths = [get_path() for _ in range(count)]
+
+        def worker(worker_paths):
+            nonlocal errors
+            with httpx.Client(base_url=f'http://127.0.0.1:{server.server_port}', headers=headers) as client:
+                client.request(method, worker_paths[0] if worker_paths else paths[0], json=data)
+                for worker_path in worker_paths:
+                    start = perf_counter()
+                    try:
+                        response = client.request(method, worker_path, json=data)
+                    except (httpx.HTTPError, socket.error):
+                        with lock:
+                            errors += 1
+                        continue
+                    duration = perf_counter() - start
+                    with lock:
+                        if response.status_code >= 400:
+                            errors += 1
+                        else:
+                            samples.append(duration)
+                            sizes.append(len(response.content))
+
+        try:
+            workers = [threading.Thread(target=worker, args=(paths[number::concurrency],))
+                       for number in range(concurrency)]
+            for worker_thread in workers:
+                worker_thread.start()
+            for worker_thread in workers:
+                worker_thread.join()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        return samples, sizes, errors
+
+    def _report(self, result: dict, baseline: dict) -> None:
+        line = (f'{result["size"]:>7} {result["cache"]:>6} {result["transport"]:>6} {result["endpoint"]:<18}')
+        if 'p50_ms' not in result:
+            self.stdout.write(f'{line} all {result["errors"]} requests failed')
+            return
+
+        queries = '-' if result['queries'] is None else f'{result["queries"]:g}'
+        line += (f' p50 {result["p50_ms"]:>9.3f} p95 {result["p95_ms"]:>9.3f} p99 {result["p99_ms"]:>9.3f} ms'
+                 f' {queries:>5} queries {result["bytes"]:>10} bytes')
+        if result['errors']:
+            line += f' {result["errors"]} errors'
+        key = (result['size'], result['cache'], result['transport'], result['endpoint'])
+        if (previous := baseline.get(key)) and previous.get('p95_ms'):
+            line += f' p95 x{result["p95_ms"] / previous["p95_ms"]:.2f} of the baseline'
+        self.stdout.write(line)
+
+    @staticmethod
+    def _load_baseline(path: str | None) -> dict:
+        if not path:
+            return {}
+        try:
+            with open(path) as file:
+                results = json.load(file)['results']
+        except (OSError, ValueError, KeyError) as error:
+            raise CommandError(f'Failed to read the baseline {path}: {error}')
+        return {(result['size'], result['cache'], result['transport'], result['endpoint']): result
+                for result in results}
+
+    @staticmethod
+    def _get_meta(options: dict) -> dict:
+        try:
+            commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                    check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            'created': datetime.now(timezone.utc).isoformat(),
+            'commit': commit,
+            'database': connection.vendor,
+            'requests': options['requests'],
+            'concurrency': options['concurrency'],
+            'seed': options['seed'],
+        }
@@ -0,0 +1,50 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from ...tasks import _load_all_stocks, _copy_stocks
+from ...utils.ingestion import get_fingerprint
+from ...utils.synthetic import generate_stocks
+
+
+class Rollback(Exception):
+    """Raised to roll back the data written by a benchmark run."""
+
+
+class Command(BaseCommand):
+    help = 'Compares the ORM and the COPY stock ingestion engines on synthetic data. No data is kept.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[1000, 10000, 100000],
+                            help='The numbers of stocks to load.')
+        parser.add_argument('--repeat', type=int, default=3, help='The number of runs per engine and size.')
+
+    def handle(self, *args, **options):
+        engines = {'orm': _load_all_stocks}
+        if connection.vendor == 'postgresql':
+            engines['copy'] = _copy_stocks
+        else:
+            self.stderr.write(f'The copy engine is not supported by {connection.vendor}, only the ORM is measured.')
+
+        self.stdout.write(f'{"rows":>8} {"engine":>6} {"best, s":>10} {"rows/s":>10}')
+        for size in options['sizes']:
+            stocks = generate_stocks(size)
+            fingerprints = {stock['SECID']: get_fingerprint(stock) for stock in stocks}
+
+            for name, engine in engines.items():
+                best = min(self._measure(engine, stocks, fingerprints) for _ in range(options['repeat']))
+                self.stdout.write(f'{size:>8} {name:>6} {best:>10.3f} {size / best:>10.0f}')
+
+    @staticmethod
+    def _measure(engine, stocks: list[dict], fingerprints: dict[str, str]) -> float:
+        """Runs the engine in a transaction that is rolled back and returns its duration in seconds."""
+
+        try:
+            with transaction.atomic():
+                start = perf_counter()
+                engine(stocks, fingerprints)
+                duration = perf_counter() - start
+                raise Rollback
+        except Rollback:
+            return duration
@@ -0,0 +1,89 @@
+from time import perf_counter
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+
+from ...models import Stock
+from ...tasks import INGESTION_MODES, load_available_stocks
+
+LOCAL_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+class Rollback(Exception):
+    """Raised to roll back the data written by a benchmark run."""
+
+
+class Command(BaseCommand):
+    help = ('Measures load_available_stocks against the offline ISS replay, without the network. '
+            'The first run of a size loads an empty table, the second one gets the same snapshot. '
+            'The timings include the pacing of the moexalgo requests (0.2s per request). No data is kept.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[1000, 10000, 100000],
+                            help='The numbers of the securities served by the replay.')
+        parser.add_argument('--modes', nargs='+', choices=INGESTION_MODES, default=['diff'],
+                            help='The ingestion modes to measure.')
+        parser.add_argument('--repeat', type=int, default=3, help='The number of runs per mode and size.')
+        parser.add_argument('--latency', type=float, default=0, help='The delay of every ISS response in seconds.')
+        parser.add_argument('--error-rate', type=float, default=0,
+                            help='The share of the ISS responses that fail with 503.')
+        parser.add_argument('--fixtures', help='The recorded fixtures. Defaults to settings.ISS_REPLAY_DIR.')
+
+    def handle(self, *args, **options):
+        replay = {
+            'ISS_REPLAY': True,
+            'ISS_REPLAY_LATENCY': options['latency'],
+            'ISS_REPLAY_ERROR_RATE': options['error_rate'],
+            'CACHES': LOCAL_CACHES,
+            # The runs are sequential, the in-process lock does not need Redis
+            'STOCKS_LOCK_REDIS_URL': '',
+            'STOCKS_STREAM_REDIS_URL': '',
+        }
+        if options['fixtures']:
+            replay['ISS_REPLAY_DIR'] = options['fixtures']
+
+        self.stdout.write(f'{"rows":>8} {"mode":>5} {"cold, s":>9} {"rows/s":>9} {"warm, s":>9} {"errors":>7}')
+        for size in options['sizes']:
+            with override_settings(ISS_REPLAY_SCALE=size, **replay):
+                for mode in options['modes']:
+                    cold, warm, errors = [], [], 0
+                    for _ in range(options['repeat']):
+                        try:
+                            cold_run, warm_run = self._measure(mode)
+                        except Exception as error:
+                            self.stderr.write(f'The {mode} run of {size} rows failed: {error}')
+                            errors += 1
+                            continue
+                        cold.append(cold_run)
+                        warm.append(warm_run)
+
+                    if not cold:
+                        self.stdout.write(f'{size:>8} {mode:>5} {"-":>9} {"-":>9} {"-":>9} {errors:>7}')
+                        continue
+                    self.stdout.write(f'{size:>8} {mode:>5} {min(cold):>9.3f} {size / min(cold):>9.0f} '
+                                      f'{min(warm):>9.3f} {errors:>7}')
+
+    @staticmethod
+    def _measure(mode: str) -> tuple[float, float]:
+        """
+        Loads the stocks into the empty table and then loads the same snapshot again,
+        in a transaction that is rolled back. Returns the durations of both runs in seconds.
+        """
+
+        cache.clear()
+        try:
+            with transaction.atomic():
+                Stock.objects.all().delete()
+
+                start = perf_counter()
+                load_available_stocks.run(mode=mode)
+                cold = perf_counter() - start
+
+                start = perf_counter()
+                load_available_stocks.run(mode=mode)
+                warm = perf_counter() - start
+                raise Rollback
+        except Rollback:
+            return cold, warm
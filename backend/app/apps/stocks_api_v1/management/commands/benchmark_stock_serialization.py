@@ -0,0 +1,66 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from ...models import Stock
+from ...serializers import StockSerializer
+from ...utils.encoding import build_row_encoder, encode_rows
+from ...utils.ingestion import STOCK_FIELD_MAP
+from ...utils.synthetic import generate_stocks
+
+
+class Rollback(Exception):
+    """Raised to roll back the synthetic stocks."""
+
+
+class Command(BaseCommand):
+    help = 'Compares the serializer and the row encoder rendering of the stock list on synthetic data. No data is kept.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[1000, 10000],
+                            help='The numbers of stocks to render.')
+        parser.add_argument('--repeat', type=int, default=5, help='The number of runs per path and size.')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{"rows":>8} {"serializer, s":>14} {"encoder, s":>11} {"speedup":>8}')
+        for size in options['sizes']:
+            try:
+                with transaction.atomic():
+                    Stock.objects.all().delete()
+                    Stock.objects.bulk_create(
+                        Stock(**{field: stock[key] for field, key in STOCK_FIELD_MAP.items()})
+                        for stock in generate_stocks(size)
+                    )
+                    self._compare(size, options['repeat'])
+                    raise Rollback
+            except Rollback:
+                pass
+
+    def _compare(self, size: int, repeat: int) -> None:
+        renderer = JSONRenderer()
+
+        def serializer_path():
+            return renderer.render(StockSerializer(Stock.objects.all(), many=True).data)
+
+        def encoder_path():
+            serializer_fields = StockSerializer().fields
+            columns = list(serializer_fields)
+            encoder = build_row_encoder(serializer_fields, columns)
+            return renderer.render(encode_rows(Stock.objects.values_list(*columns), encoder))
+
+        if serializer_path() != encoder_path():
+            raise CommandError('The outputs of the serializer and the encoder differ.')
+
+        timings = []
+        for path in (serializer_path, encoder_path):
+            best = float('inf')
+            for _ in range(repeat):
+                start = perf_counter()
+                path()
+                best = min(best, perf_counter() - start)
+            timings.append(best)
+
+        serializer_time, encoder_time = timings
+        self.stdout.write(f'{size:>8} {serializer_time:>14.3f} {encoder_time:>11.3f} {serializer_time / encoder_time:>7.1f}x')
@@ -0,0 +1,40 @@
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ...models import Stock
+from ...serializers import StockSerializer
+from ...utils.export import get_export_formats, iter_export
+
+
+class Command(BaseCommand):
+    help = 'Exports all the stocks as a CSV, NDJSON or Parquet file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', dest='export_format', choices=get_export_formats(), default='csv',
+                            help='The file format. Parquet needs the pyarrow package.')
+        parser.add_argument('--gzip', action='store_true', help='Compress the output with gzip.')
+        parser.add_argument('--output', help='The file to write. Defaults to stdout.')
+        parser.add_argument('--chunk-size', type=int, default=settings.STOCKS_EXPORT_CHUNK_SIZE,
+                            help='The number of rows read from the database at once.')
+
+    def handle(self, *args, **options):
+        chunks = iter_export(
+            Stock.objects.all(),
+            StockSerializer().fields,
+            options['export_format'],
+            chunk_size=options['chunk_size'],
+            compress=options['gzip'],
+        )
+
+        if options['output'] is None:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+            return
+
+        with open(options['output'], 'wb') as file:
+            for chunk in chunks:
+                file.write(chunk)
+        self.stderr.write(f'The stocks have been exported to {options["output"]}')
@@ -1,10 +1,17 @@
 from django.core.management.base import BaseCommand
 
-from ...tasks import load_available_stocks
+from ...tasks import load_available_stocks, INGESTION_MODES
 
 
 class Command(BaseCommand):
     help = 'Loads stock data into the database from an external API.'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--mode',
+            choices=INGESTION_MODES,
+            help='The ingestion mode. Defaults to settings.STOCKS_INGESTION_MODE.',
+        )
+
     def handle(self, *args, **options):
-        load_available_stocks.delay()
+        load_available_stocks.delay(mode=options['mode'])
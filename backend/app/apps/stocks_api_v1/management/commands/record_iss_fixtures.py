@@ -0,0 +1,29 @@
+import httpx
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ...utils.iss_standin import RecordingTransport
+from ...utils.markets import MarketBoard, get_boards
+
+
+class Command(BaseCommand):
+    help = 'Records the ISS responses of the securities of the boards as fixtures for the offline replay.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=str(settings.ISS_REPLAY_DIR), help='The fixtures directory.')
+        parser.add_argument('--boards', nargs='+',
+                            help="The 'engine/market/board' strings. Defaults to settings.STOCKS_MARKETS.")
+
+    def handle(self, *args, **options):
+        boards = [MarketBoard.parse(board) for board in options['boards']] if options['boards'] else get_boards()
+
+        transport = RecordingTransport(options['output'])
+        with httpx.Client(base_url=settings.ISS_BASE_URL, transport=transport, timeout=60,
+                          follow_redirects=True) as client:
+            for board in boards:
+                # The same requests as Market(...).tickers() of moexalgo makes.
+                for path in (board.path.removesuffix('.json') + '/columns.json', board.path):
+                    response = client.get(path)
+                    response.raise_for_status()
+                self.stdout.write(f'{board}: {len(response.json()["securities"]["data"])} securities recorded')
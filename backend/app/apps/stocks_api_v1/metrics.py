@@ -0,0 +1,80 @@
+import sys
+
+from core.metrics import Counter, Gauge, Histogram
+
+from .utils.ingestion import IngestionReport
+
+try:
+    import resource
+except ImportError:
+    # The module is Unix-only, the peak memory of the process is not reported on Windows.
+    resource = None
+
+# ru_maxrss is in bytes on macOS and in kilobytes on the other Unix systems.
+MAXRSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+# The stages are 'fetch' (the ISS request and the decoding of the response), 'parse' (the fingerprints,
+# the coercion and the building of the rows) and 'write' (the database queries).
+INGESTION_STAGE_DURATION = Histogram(
+    'stocks_ingestion_stage_seconds', 'The time spent in the stages of the stock loader.',
+    ('task', 'board', 'stage'),
+)
+INGESTION_LAST_STAGE_DURATION = Gauge(
+    'stocks_ingestion_last_stage_seconds', 'The time spent in the stages of the last run of the stock loader.',
+    ('task', 'board', 'stage'),
+)
+INGESTION_ROWS = Counter(
+    'stocks_ingestion_rows_total', 'The number of the stocks processed by the loader by their outcome.',
+    ('task', 'board', 'result'),
+)
+INGESTION_PAYLOAD_BYTES = Gauge(
+    'stocks_ingestion_payload_bytes', 'The size of the ISS response of the last run of the stock loader.',
+    ('task', 'board'),
+)
+INGESTION_TRIGGERS = Counter(
+    'stocks_ingestion_triggers_total',
+    'The runs of the stock loader coalesced during another run and the follow-up runs enqueued for them.',
+    ('task', 'outcome'),
+)
+INGESTION_RETRIES = Gauge(
+    'stocks_ingestion_retries', 'The number of the retries before the last run of the stock loader.', ('task',),
+)
+INGESTION_PEAK_MEMORY = Gauge(
+    'stocks_ingestion_peak_memory_bytes',
+    'The peak memory allocated in the stages of the last run of the stock loader, if traced.',
+    ('task', 'board', 'stage'),
+)
+INGESTION_PROCESS_PEAK_MEMORY = Gauge(
+    'stocks_ingestion_process_peak_memory_bytes',
+    'The peak resident memory of the worker process after the last run of the stock loader.', ('task',),
+)
+
+
+def record_ingestion(task: str, board: str, report: IngestionReport, payload_bytes: int) -> None:
+    """
+    Reports the stage timings, the row counters, the payload size and the traced peak memory of a loaded board.
+
+    Parameters:
+        task (str): The name of the loader task.
+        board (str): The 'engine/market/board' string.
+        report (IngestionReport): The report of the board with the measured stages.
+        payload_bytes (int): The size of the ISS response.
+    """
+
+    for stage, seconds in report.stages.items():
+        INGESTION_STAGE_DURATION.observe(seconds, task=task, board=board, stage=stage)
+        INGESTION_LAST_STAGE_DURATION.set(seconds, task=task, board=board, stage=stage)
+    for result in ('inserted', 'changed', 'unchanged', 'removed'):
+        if count := getattr(report, result):
+            INGESTION_ROWS.inc(count, task=task, board=board, result=result)
+    INGESTION_PAYLOAD_BYTES.set(payload_bytes, task=task, board=board)
+    for stage, peak in report.peak_memory.items():
+        INGESTION_PEAK_MEMORY.set(peak, task=task, board=board, stage=stage)
+
+
+def record_ingestion_run(task: str, retries: int) -> None:
+    """Reports the retries of the run and the peak resident memory of the worker process."""
+
+    INGESTION_RETRIES.set(retries, task=task)
+    if resource is not None:
+        INGESTION_PROCESS_PEAK_MEMORY.set(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * MAXRSS_UNIT, task=task)
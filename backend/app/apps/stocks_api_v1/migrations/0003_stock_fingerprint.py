@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-17 03:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks_api_v1', '0002_remove_stock_id_alter_stock_currencyid_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stock',
+            name='fingerprint',
+            field=models.CharField(editable=False, help_text='The digest of the instrument data last received from the market.', max_length=32, null=True, verbose_name='fingerprint'),
+        ),
+    ]
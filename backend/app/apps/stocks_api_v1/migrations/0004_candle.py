@@ -0,0 +1,88 @@
+from django.db import migrations, models
+
+TABLE = 'stocks_api_v1_candle'
+MONTHLY_INTERVALS = (1, 10, 60)
+LONG_INTERVALS = (24, 7, 31, 4)
+
+
+def create_candle_table(apps, schema_editor):
+    """
+    Creates the candle table. On PostgreSQL it is partitioned by the interval, the intraday
+    intervals are range-partitioned by `begin` (the monthly partitions are created on demand).
+    """
+
+    if schema_editor.connection.vendor != 'postgresql':
+        schema_editor.create_model(apps.get_model('stocks_api_v1', 'Candle'))
+        return
+
+    schema_editor.execute(f'''
+        CREATE TABLE "{TABLE}" (
+            "id" bigserial NOT NULL,
+            "begin" timestamp with time zone NOT NULL,
+            "open" double precision NOT NULL,
+            "high" double precision NOT NULL,
+            "low" double precision NOT NULL,
+            "close" double precision NOT NULL,
+            "value" double precision NOT NULL,
+            "volume" bigint NOT NULL,
+            "interval" smallint NOT NULL CHECK ("interval" >= 0),
+            "ticker" varchar(10) NOT NULL,
+            CONSTRAINT "stocks_api_v1_candle_key" PRIMARY KEY ("ticker", "interval", "begin")
+        ) PARTITION BY LIST ("interval")
+    ''')
+    for interval in MONTHLY_INTERVALS:
+        schema_editor.execute(
+            f'CREATE TABLE "{TABLE}_i{interval}" PARTITION OF "{TABLE}" '
+            f'FOR VALUES IN ({interval}) PARTITION BY RANGE ("begin")'
+        )
+    schema_editor.execute(
+        f'CREATE TABLE "{TABLE}_long" PARTITION OF "{TABLE}" '
+        f'FOR VALUES IN ({", ".join(map(str, LONG_INTERVALS))})'
+    )
+    schema_editor.execute(
+        f'CREATE INDEX "stocks_api_v1_candle_begin_brin" ON "{TABLE}" USING brin ("begin") '
+        f'WITH (pages_per_range = 32)'
+    )
+
+
+def drop_candle_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        schema_editor.delete_model(apps.get_model('stocks_api_v1', 'Candle'))
+        return
+
+    schema_editor.execute(f'DROP TABLE "{TABLE}" CASCADE')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks_api_v1', '0003_stock_fingerprint'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='Candle',
+                    fields=[
+                        ('id', models.BigAutoField(primary_key=True, serialize=False, verbose_name='ID')),
+                        ('begin', models.DateTimeField(help_text='The time the candle opens.', verbose_name='begin')),
+                        ('open', models.FloatField(help_text='The price of the first trade.', verbose_name='open')),
+                        ('high', models.FloatField(help_text='The maximum price.', verbose_name='high')),
+                        ('low', models.FloatField(help_text='The minimum price.', verbose_name='low')),
+                        ('close', models.FloatField(help_text='The price of the last trade.', verbose_name='close')),
+                        ('value', models.FloatField(help_text='The turnover in the currency of the instrument.', verbose_name='value')),
+                        ('volume', models.BigIntegerField(help_text='The number of traded securities.', verbose_name='volume')),
+                        ('interval', models.PositiveSmallIntegerField(choices=[(1, '1 minute'), (10, '10 minutes'), (60, '1 hour'), (24, '1 day'), (7, '1 week'), (31, '1 month'), (4, '1 quarter')], help_text='The interval of the candle.', verbose_name='interval')),
+                        ('ticker', models.CharField(help_text='The ticker of the stock.', max_length=10, verbose_name='ticker')),
+                    ],
+                    options={
+                        'verbose_name': 'candle',
+                        'verbose_name_plural': 'candles',
+                        'constraints': [models.UniqueConstraint(fields=('ticker', 'interval', 'begin'), name='stocks_api_v1_candle_key')],
+                    },
+                ),
+            ],
+        ),
+        migrations.RunPython(create_candle_table, drop_candle_table),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-17 03:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks_api_v1', '0004_candle'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stock',
+            name='isin',
+            field=models.CharField(db_index=True, help_text='The international identification code of the security.', max_length=20, null=True, verbose_name='isin'),
+        ),
+    ]
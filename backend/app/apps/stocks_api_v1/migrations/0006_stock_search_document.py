@@ -0,0 +1,49 @@
+from django.db import migrations, models
+
+from apps.stocks_api_v1.utils.transliteration import SEARCH_FIELDS, build_search_document
+
+INDEX = 'stocks_api_v1_stock_search_trgm'
+
+
+def fill_search_documents(apps, schema_editor):
+    """Builds the search documents of the existing stocks."""
+
+    Stock = apps.get_model('stocks_api_v1', 'Stock')
+    stocks = list(Stock.objects.only('ticker', *SEARCH_FIELDS))
+    for stock in stocks:
+        stock.search_document = build_search_document({field: getattr(stock, field) for field in SEARCH_FIELDS})
+    Stock.objects.bulk_update(stocks, ['search_document'], batch_size=1000)
+
+
+def create_search_index(apps, schema_editor):
+    """Creates the GIN trigram index of the search documents, other databases use the in-memory index."""
+
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(
+        f'CREATE INDEX "{INDEX}" ON "stocks_api_v1_stock" USING gin ("search_document" gin_trgm_ops)'
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f'DROP INDEX IF EXISTS "{INDEX}"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks_api_v1', '0005_stock_isin_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stock',
+            name='search_document',
+            field=models.TextField(editable=False, help_text='The normalized names and codes of the instrument used by the search.', null=True, verbose_name='search document'),
+        ),
+        migrations.RunPython(fill_search_documents, migrations.RunPython.noop),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.0.2 on 2026-10-17 03:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks_api_v1', '0006_stock_search_document'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='stock',
+            index=models.Index(condition=models.Q(('status', 'A')), fields=['listlevel', 'prevprice'], name='stock_tradable_level_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stock',
+            index=models.Index(fields=['status', 'sectype', 'listlevel'], name='stock_status_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stock',
+            index=models.Index(fields=['sectype', 'listlevel'], name='stock_type_level_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stock',
+            index=models.Index(fields=['currencyid', 'faceunit'], name='stock_currency_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stock',
+            index=models.Index(fields=['faceunit'], name='stock_faceunit_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stock',
+            index=models.Index(fields=['prevprice'], name='stock_prevprice_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stock',
+            index=models.Index(fields=['issuesize'], name='stock_issuesize_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-17 03:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks_api_v1', '0007_stock_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stock',
+            name='ticker',
+            field=models.CharField(help_text='The ticker of the stock.', max_length=36, primary_key=True, serialize=False, verbose_name='ticker'),
+        ),
+    ]
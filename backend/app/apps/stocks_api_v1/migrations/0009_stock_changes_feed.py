@@ -0,0 +1,33 @@
+# Generated by Django 5.0.2 on 2026-10-17 04:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks_api_v1', '0008_widen_stock_ticker'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockTombstone',
+            fields=[
+                ('ticker', models.CharField(help_text='The ticker of the stock.', max_length=36, primary_key=True, serialize=False, verbose_name='ticker')),
+                ('removed', models.DateTimeField(help_text='The time the stock was removed.', verbose_name='removed')),
+            ],
+            options={
+                'verbose_name': 'stock tombstone',
+                'verbose_name_plural': 'stock tombstones',
+                'ordering': ('removed', 'ticker'),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='stock',
+            index=models.Index(fields=['updated', 'ticker'], name='stock_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stocktombstone',
+            index=models.Index(fields=['removed', 'ticker'], name='stock_tombstone_removed_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+from django.db import migrations, models
+
+TABLE = 'stocks_api_v1_candle'
+
+
+def widen_candle_ticker(apps, schema_editor):
+    """
+    Widens the ticker of the candles to the length of the ticker of the stocks. On PostgreSQL the column
+    of the partitioned table is altered, which alters it in all the partitions.
+    """
+
+    if schema_editor.connection.vendor != 'postgresql':
+        model = apps.get_model('stocks_api_v1', 'Candle')
+        old_field = model._meta.get_field('ticker')
+        new_field = models.CharField(max_length=36, verbose_name='ticker', help_text='The ticker of the stock.')
+        new_field.set_attributes_from_name('ticker')
+        schema_editor.alter_field(model, old_field, new_field)
+        return
+
+    schema_editor.execute(f'ALTER TABLE "{TABLE}" ALTER COLUMN "ticker" TYPE varchar(36)')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks_api_v1', '0009_stock_changes_feed'),
+    ]
+
+    operations = [
+        migrations.RunPython(widen_candle_ticker, migrations.RunPython.noop),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='candle',
+                    name='ticker',
+                    field=models.CharField(help_text='The ticker of the stock.', max_length=36, verbose_name='ticker'),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-17 04:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks_api_v1', '0010_widen_candle_ticker'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stock',
+            name='board',
+            field=models.CharField(db_index=True, editable=False, help_text='The market or the board the stock has last been loaded from, e.g. stock/shares/TQBR.', max_length=40, null=True, verbose_name='board'),
+        ),
+    ]
@@ -0,0 +1,73 @@
+from django.db import migrations, models
+
+TABLE = 'stocks_api_v1_candle'
+COLUMNS = '"begin", "open", "high", "low", "close", "value", "volume", "interval", "ticker"'
+
+
+def _remake_sqlite_table(schema_editor, id_column: str, columns: str) -> None:
+    """Copies the candles into a new table with or without the id column, SQLite cannot drop a primary key."""
+
+    schema_editor.execute(f'''
+        CREATE TABLE "new__{TABLE}" (
+            {id_column}
+            "begin" datetime NOT NULL,
+            "open" real NOT NULL,
+            "high" real NOT NULL,
+            "low" real NOT NULL,
+            "close" real NOT NULL,
+            "value" real NOT NULL,
+            "volume" bigint NOT NULL,
+            "interval" smallint unsigned NOT NULL CHECK ("interval" >= 0),
+            "ticker" varchar(36) NOT NULL
+        )
+    ''')
+    schema_editor.execute(f'INSERT INTO "new__{TABLE}" ({columns}) SELECT {columns} FROM "{TABLE}"')
+    schema_editor.execute(f'DROP TABLE "{TABLE}"')
+    schema_editor.execute(f'ALTER TABLE "new__{TABLE}" RENAME TO "{TABLE}"')
+    schema_editor.execute(
+        f'CREATE UNIQUE INDEX "stocks_api_v1_candle_key" ON "{TABLE}" ("ticker", "interval", "begin")'
+    )
+
+
+def drop_candle_id(apps, schema_editor):
+    """
+    Drops the surrogate id of the candles, which was neither unique nor indexed on PostgreSQL:
+    the primary key of the table is (ticker, interval, begin).
+    """
+
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f'ALTER TABLE "{TABLE}" DROP COLUMN "id"')
+    else:
+        _remake_sqlite_table(schema_editor, '', COLUMNS)
+
+
+def add_candle_id(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f'ALTER TABLE "{TABLE}" ADD COLUMN "id" bigserial NOT NULL')
+    else:
+        _remake_sqlite_table(schema_editor, '"id" integer NOT NULL PRIMARY KEY AUTOINCREMENT,', COLUMNS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks_api_v1', '0011_stock_board'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_candle_id, add_candle_id),
+        # Django has no composite primary keys, `begin` stands for the key in the ORM (see the Candle model).
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.RemoveField(
+                    model_name='candle',
+                    name='id',
+                ),
+                migrations.AlterField(
+                    model_name='candle',
+                    name='begin',
+                    field=models.DateTimeField(help_text='The time the candle opens.', primary_key=True, serialize=False, verbose_name='begin'),
+                ),
+            ],
+        ),
+    ]
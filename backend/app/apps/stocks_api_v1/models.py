@@ -1,5 +1,7 @@
 from django.db import models
 
+from .utils.transliteration import SEARCH_FIELDS, build_search_document
+
 
 class Stock(models.Model):
     """
@@ -57,7 +59,7 @@ class Stock(models.Model):
         SECOND = 2, 'Second'
         THIRD = 3, 'Third'
 
-    ticker = models.CharField(primary_key=True, max_length=10, verbose_name='ticker', help_text='The ticker of the stock.')
+    ticker = models.CharField(primary_key=True, max_length=36, verbose_name='ticker', help_text='The ticker of the stock.')
     shortname = models.CharField(
         max_length=50,
         verbose_name='short name',
@@ -133,6 +135,7 @@ class Stock(models.Model):
     )
     isin = models.CharField(
         max_length=20,
+        db_index=True,
         verbose_name='isin',
         help_text='The international identification code of the security.',
         null=True,
@@ -181,6 +184,27 @@ class Stock(models.Model):
         null=True,
     )
 
+    board = models.CharField(
+        max_length=40,
+        db_index=True,
+        editable=False,
+        verbose_name='board',
+        help_text='The market or the board the stock has last been loaded from, e.g. stock/shares/TQBR.',
+        null=True,
+    )
+    fingerprint = models.CharField(
+        max_length=32,
+        editable=False,
+        verbose_name='fingerprint',
+        help_text='The digest of the instrument data last received from the market.',
+        null=True,
+    )
+    search_document = models.TextField(
+        editable=False,
+        verbose_name='search document',
+        help_text='The normalized names and codes of the instrument used by the search.',
+        null=True,
+    )
     updated = models.DateTimeField(auto_now=True, verbose_name='updated')
 
     def __str__(self):
@@ -190,8 +214,106 @@ class Stock(models.Model):
         ordering = ('ticker',)
         verbose_name = 'stock'
         verbose_name_plural = 'stocks'
+        indexes = [
+            # The tradable instruments of a listing level, optionally within a price range.
+            models.Index(
+                fields=['listlevel', 'prevprice'], condition=models.Q(status='A'), name='stock_tradable_level_idx',
+            ),
+            models.Index(fields=['status', 'sectype', 'listlevel'], name='stock_status_type_idx'),
+            models.Index(fields=['sectype', 'listlevel'], name='stock_type_level_idx'),
+            models.Index(fields=['currencyid', 'faceunit'], name='stock_currency_idx'),
+            models.Index(fields=['faceunit'], name='stock_faceunit_idx'),
+            models.Index(fields=['prevprice'], name='stock_prevprice_idx'),
+            models.Index(fields=['issuesize'], name='stock_issuesize_idx'),
+            # The keyset of the changes feed (see utils.changes).
+            models.Index(fields=['updated', 'ticker'], name='stock_updated_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         if self.ticker:
             self.ticker = self.ticker.upper()
+        self.search_document = build_search_document({field: getattr(self, field) for field in SEARCH_FIELDS})
         super().save(*args, **kwargs)
+
+
+class StockTombstone(models.Model):
+    """
+    Records a removed stock, so the clients of the changes feed learn about the removal.
+    """
+
+    ticker = models.CharField(primary_key=True, max_length=36, verbose_name='ticker', help_text='The ticker of the stock.')
+    removed = models.DateTimeField(verbose_name='removed', help_text='The time the stock was removed.')
+
+    def __str__(self):
+        return f'{self.ticker} removed at {self.removed}'
+
+    class Meta:
+        ordering = ('removed', 'ticker')
+        verbose_name = 'stock tombstone'
+        verbose_name_plural = 'stock tombstones'
+        indexes = [
+            models.Index(fields=['removed', 'ticker'], name='stock_tombstone_removed_idx'),
+        ]
+
+
+class Candle(models.Model):
+    """
+    Represents an OHLCV candle of a financial instrument.
+
+    On PostgreSQL the table is partitioned by interval, and the intraday intervals
+    are partitioned further by the month of the candle (see utils.candles).
+
+    A candle is identified by its ticker, interval and begin, the primary key of the table.
+    Django has no composite primary keys, so `begin` stands for the key in the ORM and is not unique:
+    a candle is saved and deleted by the whole key, the lookups by `pk` alone are not supported.
+    """
+
+    class IntervalChoices(models.IntegerChoices):
+        """
+        The candle intervals. The values are the interval codes of the MOEX ISS API.
+        """
+
+        MINUTE = 1, '1 minute'
+        TEN_MINUTES = 10, '10 minutes'
+        HOUR = 60, '1 hour'
+        DAY = 24, '1 day'
+        WEEK = 7, '1 week'
+        MONTH = 31, '1 month'
+        QUARTER = 4, '1 quarter'
+
+    begin = models.DateTimeField(primary_key=True, verbose_name='begin', help_text='The time the candle opens.')
+    open = models.FloatField(verbose_name='open', help_text='The price of the first trade.')
+    high = models.FloatField(verbose_name='high', help_text='The maximum price.')
+    low = models.FloatField(verbose_name='low', help_text='The minimum price.')
+    close = models.FloatField(verbose_name='close', help_text='The price of the last trade.')
+    value = models.FloatField(verbose_name='value', help_text='The turnover in the currency of the instrument.')
+    volume = models.BigIntegerField(verbose_name='volume', help_text='The number of traded securities.')
+    interval = models.PositiveSmallIntegerField(
+        choices=IntervalChoices,
+        verbose_name='interval',
+        help_text='The interval of the candle.',
+    )
+    ticker = models.CharField(max_length=36, verbose_name='ticker', help_text='The ticker of the stock.')
+
+    def __str__(self):
+        return f'{self.ticker} {self.get_interval_display()} {self.begin}'
+
+    def save(self, *args, **kwargs):
+        """Inserts the candle or updates the stored candle with the same key."""
+
+        # Imported here, the module imports the models.
+        from .utils.candles import write_candles
+
+        write_candles([self])
+
+    def delete(self, *args, **kwargs):
+        """Deletes the stored candle with the same key."""
+
+        return Candle.objects.filter(ticker=self.ticker, interval=self.interval, begin=self.begin).delete()
+
+    class Meta:
+        verbose_name = 'candle'
+        verbose_name_plural = 'candles'
+        constraints = [
+            models.UniqueConstraint(fields=('ticker', 'interval', 'begin'), name='stocks_api_v1_candle_key'),
+        ]
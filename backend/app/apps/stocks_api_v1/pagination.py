@@ -0,0 +1,15 @@
+from rest_framework.pagination import CursorPagination
+
+
+class StockCursorPagination(CursorPagination):
+    """
+    The keyset pagination of the stocks over the ticker primary key.
+
+    The pagination is enabled by the `page_size` query parameter,
+    without it the whole list is returned as before.
+    """
+
+    ordering = 'ticker'
+    page_size = None
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
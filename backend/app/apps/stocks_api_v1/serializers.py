@@ -1,9 +1,114 @@
+from django.conf import settings
 from rest_framework import serializers
 
-from .models import Stock
+from .models import Candle, Stock
+from .utils.changes import InvalidToken, decode_token
+from .utils.export import get_export_formats
 
 
 class StockSerializer(serializers.ModelSerializer):
+    """
+    Takes an optional `fields` argument that limits the serialized fields.
+    """
+
     class Meta:
         model = Stock
-        fields = '__all__'
+        exclude = ('board', 'fingerprint', 'search_document')
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        if fields is not None:
+            for field_name in set(self.fields) - set(fields):
+                self.fields.pop(field_name)
+
+
+class StockBatchSerializer(serializers.Serializer):
+    """
+    Validates the tickers or ISINs of the batch lookup of stocks.
+    """
+
+    tickers = serializers.ListField(
+        child=serializers.CharField(max_length=Stock._meta.get_field('ticker').max_length),
+        allow_empty=False,
+        max_length=settings.STOCKS_BATCH_MAX_SIZE,
+    )
+
+
+class StockFilterSerializer(serializers.Serializer):
+    """
+    Validates the filters of the stocks. The choices and the codes take several values
+    as repeated query parameters, the ranges are inclusive.
+    """
+
+    status = serializers.MultipleChoiceField(choices=Stock.StatusChoices.choices, required=False)
+    sectype = serializers.MultipleChoiceField(choices=Stock.SecTypeChoices.choices, required=False)
+    listlevel = serializers.MultipleChoiceField(choices=Stock.ListLevelChoices.choices, required=False)
+    currencyid = serializers.ListField(child=serializers.CharField(max_length=10), required=False)
+    faceunit = serializers.ListField(child=serializers.CharField(max_length=10), required=False)
+    prevprice_min = serializers.DecimalField(max_digits=20, decimal_places=10, required=False)
+    prevprice_max = serializers.DecimalField(max_digits=20, decimal_places=10, required=False)
+    issuesize_min = serializers.IntegerField(min_value=0, required=False)
+    issuesize_max = serializers.IntegerField(min_value=0, required=False)
+
+    def validate(self, attrs):
+        for name in ('prevprice', 'issuesize'):
+            low, high = attrs.get(f'{name}_min'), attrs.get(f'{name}_max')
+            if low is not None and high is not None and low > high:
+                raise serializers.ValidationError({f'{name}_max': [f'Must not be less than {name}_min.']})
+        return attrs
+
+
+class StockExportSerializer(serializers.Serializer):
+    """
+    Validates the parameters of the stock export.
+    """
+
+    file_format = serializers.ChoiceField(choices=get_export_formats(), default='csv')
+    gzip = serializers.BooleanField(default=False)
+
+
+class StockSearchSerializer(serializers.Serializer):
+    """
+    Validates the query parameters of the stock search.
+    """
+
+    q = serializers.CharField(max_length=100, help_text='The ticker, the name, the ISIN or their beginning.')
+    limit = serializers.IntegerField(
+        min_value=1, max_value=settings.STOCKS_SEARCH_MAX_LIMIT, default=settings.STOCKS_SEARCH_LIMIT,
+    )
+
+
+class StockChangesSerializer(serializers.Serializer):
+    """
+    Validates the query parameters of the changes feed, the token is decoded into the positions of the client.
+    """
+
+    since = serializers.CharField(
+        max_length=500, default='', allow_blank=True, help_text='The token returned by the previous request.',
+    )
+    limit = serializers.IntegerField(
+        min_value=1, max_value=settings.STOCKS_CHANGES_MAX_LIMIT, default=settings.STOCKS_CHANGES_LIMIT,
+    )
+
+    def validate_since(self, value):
+        try:
+            return decode_token(value)
+        except InvalidToken:
+            raise serializers.ValidationError('Invalid token.')
+
+
+class CandleSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Candle
+        fields = ('begin', 'open', 'high', 'low', 'close', 'value', 'volume')
+
+
+class CandleQuerySerializer(serializers.Serializer):
+    """
+    Validates the query parameters of the candles of a stock.
+    """
+
+    interval = serializers.ChoiceField(choices=Candle.IntervalChoices.choices, default=Candle.IntervalChoices.DAY)
+    start = serializers.DateTimeField(required=False, help_text='The earliest begin of the candles.')
+    end = serializers.DateTimeField(required=False, help_text='The candles that begin at or after it are excluded.')
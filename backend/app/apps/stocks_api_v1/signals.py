@@ -0,0 +1,21 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Stock, StockTombstone
+from .utils.caching import bump_dataset_version
+
+
+@receiver(post_save, sender=Stock)
+@receiver(post_delete, sender=Stock)
+def invalidate_stock_responses(sender, **kwargs):
+    """Invalidates the cached stock responses when a stock is changed outside the loader (e.g. in the admin)."""
+
+    bump_dataset_version()
+
+
+@receiver(post_delete, sender=Stock)
+def add_stock_tombstone(sender, instance, **kwargs):
+    """Records the removal of the stock for the changes feed."""
+
+    StockTombstone.objects.update_or_create(ticker=instance.ticker, defaults={'removed': timezone.now()})
@@ -1,90 +1,453 @@
-from django.db import IntegrityError
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connection
+from django.utils import timezone
 from django.core.exceptions import ValidationError
 from celery.utils.log import get_task_logger
+import httpx
 from moexalgo import Market
+from datetime import date, datetime, timedelta
 from requests.exceptions import RequestException
 from time import perf_counter
 
 from core.celery import app, add_file_logger
-from .models import Stock
+from .metrics import record_ingestion, record_ingestion_run
+from .models import Candle, Stock
+from .utils.ingestion import (
+    SNAPSHOT_CACHE_KEY, STOCK_FIELD_MAP, UPDATE_FIELDS, IngestionReport, StageTimer,
+    clean_stock, get_fingerprint, get_snapshot_digest, get_previous_snapshot, set_previous_snapshot, trace_memory,
+)
+from .utils.caching import bump_dataset_version
+from .utils.changes import writing_stocks
+from .utils.copy_ingestion import copy_stocks
+from .utils.candles import (
+    MONTHLY_INTERVALS, drop_candle_partitions, fetch_candles, get_last_candle_begin, write_candles,
+)
+from .utils.iss_standin import get_iss_session
+from .utils.markets import SHARES_MARKET, MarketBoard, get_boards, load_boards
+from .utils.price_stream import publish_stock_changes
+from .utils.resampling import resample_ticker
+from .utils.single_flight import single_flight
+from .utils.transliteration import build_search_document
 
 logger = add_file_logger(get_task_logger(__name__))
 
+INGESTION_MODES = ('diff', 'full', 'copy')
+
+# The lock shared by the stock loaders, which write the same rows
+INGESTION_LOCK = 'stocks-ingestion'
+
+# The board label of the metrics of load_available_stocks, which loads the shares market as a whole
+ALL_BOARDS = 'all'
+
 
 @app.task(autoretry_for=(Exception,), retry_backoff=5, retry_kwargs={'max_retries': 10})
-def load_available_stocks() -> int:
+@single_flight(INGESTION_LOCK)
+def load_available_stocks(mode: str | None = None) -> dict:
     """
     Loads available stocks from the market and creates or updates Stock objects in the database.
 
+    In the 'diff' mode only the stocks whose fingerprint differs from the stored one are written,
+    and the database is not queried at all if the whole snapshot matches the previous one.
+    In the 'full' mode every stock is rewritten. The 'copy' mode streams the stocks into
+    a staging table with COPY and merges the changed ones with a single query (PostgreSQL only).
+
+    The time of the fetch, parse and write stages, the row counters, the payload size, the retries
+    and the peak memory are reported to the metrics (see the metrics module).
+    Only one stock loader runs at a time, the triggers that arrive during a run are coalesced
+    into a single follow-up run (see utils.single_flight).
+
+    Parameters:
+        mode (str | None): The ingestion mode. Defaults to settings.STOCKS_INGESTION_MODE.
+
     Returns:
-         int: The number of Stock objects created in case of success.
+         dict: The counters of inserted, changed, unchanged and removed Stock objects and the stage timings.
 
     Raises:
+        ValueError: If the ingestion mode is unknown.
         RequestException: If there is an issue with the request to the market API.
         ValidationError: If there is a validation error while creating a Stock instance.
         IntegrityError: If there is an integrity error during bulk creation of Stock instances.
         Exception: For any unexpected errors.
     """
 
-    logger.info('The start of load available stocks')
+    mode = mode or settings.STOCKS_INGESTION_MODE
+    if mode not in INGESTION_MODES:
+        raise ValueError(f'Unknown ingestion mode: {mode!r}. Expected one of {INGESTION_MODES}')
+
+    logger.info(f'The start of load available stocks in the {mode} mode')
+    _start_time = perf_counter()
+    timer = StageTimer()
+
+    with trace_memory(settings.STOCKS_INGESTION_TRACE_MEMORY):
+        try:
+            with timer.measure('fetch'):
+                stocks, payload_bytes = _fetch_stocks()
+        except (RequestException, httpx.HTTPError) as error:
+            logger.error(f'RequestException occurred: {error}', exc_info=True)
+            raise
+        except Exception as error:
+            logger.error(f'An unexpected error occurred: {error}', exc_info=True)
+            raise
+        else:
+            # Only the size of the payload is logged, the payload itself may take megabytes.
+            logger.debug('Information about %d stocks was received successfully (%d bytes)', len(stocks), payload_bytes)
+
+        report = _ingest_stocks(stocks, mode, timer=timer)
+
+    if report.written or report.removed:
+        bump_dataset_version()
+
+    record_ingestion(load_available_stocks.name, ALL_BOARDS, report, payload_bytes)
+    record_ingestion_run(load_available_stocks.name, load_available_stocks.request.retries or 0)
+
+    stages = ', '.join(f'{stage} {seconds:.3f}s' for stage, seconds in report.stages.items())
+    logger.info(f'Stock records have been successfully loaded in {perf_counter() - _start_time}s ({stages}, '
+                f'{payload_bytes} bytes received): '
+                f'{report.inserted} inserted, {report.changed} changed, {report.unchanged} unchanged, '
+                f'{report.removed} removed{" (snapshot is unchanged)" if report.skipped else ""}')
+    return report.as_dict()
+
+
+@app.task(autoretry_for=(Exception,), retry_backoff=5, retry_kwargs={'max_retries': 10})
+@single_flight(INGESTION_LOCK)
+def load_markets(mode: str | None = None, boards: list[str] | None = None) -> dict:
+    """
+    Loads the securities of several markets and boards (settings.STOCKS_MARKETS) concurrently.
+
+    The boards are fetched from ISS asynchronously with bounded concurrency, and every board
+    is written as soon as it is received, so a refresh takes about as long as the slowest board.
+    Each board keeps its own snapshot digest, so an unchanged board is not written in the diff mode.
+    The stocks of a board that are missing from its securities are removed, the other boards are kept.
+    The failed boards are retried with the whole task after the other boards are written.
+    The stage timings and the counters of every board are reported to the metrics.
+    Only one stock loader runs at a time, the triggers that arrive during a run are coalesced.
+
+    Parameters:
+        mode (str | None): The ingestion mode. Defaults to settings.STOCKS_INGESTION_MODE.
+        boards (list[str] | None): The 'engine/market/board' strings. Defaults to settings.STOCKS_MARKETS.
+
+    Returns:
+        dict: The counters and the timings of every board and the duration of the whole refresh.
+
+    Raises:
+        ValueError: If the ingestion mode is unknown.
+        Exception: The error of the first failed board.
+    """
+
+    mode = mode or settings.STOCKS_INGESTION_MODE
+    if mode not in INGESTION_MODES:
+        raise ValueError(f'Unknown ingestion mode: {mode!r}. Expected one of {INGESTION_MODES}')
+
+    boards = [MarketBoard.parse(board) for board in boards] if boards else get_boards()
+    logger.info(f'The start of load markets {", ".join(map(str, boards))} in the {mode} mode')
     _start_time = perf_counter()
 
+    reports = {}
+
+    def write(board: MarketBoard, stocks: list[dict]) -> dict:
+        timer = StageTimer()
+        try:
+            with timer.measure('parse'):
+                stocks = [clean_stock(stock) for stock in stocks]
+            reports[board] = _ingest_stocks(
+                stocks, mode, snapshot_key=f'{SNAPSHOT_CACHE_KEY}:{board}', board=str(board), timer=timer,
+            )
+        finally:
+            # The writes run in a worker thread, which must not keep its own database connection.
+            connection.close()
+        return reports[board].as_dict()
+
+    with trace_memory(settings.STOCKS_INGESTION_TRACE_MEMORY):
+        results = load_boards(boards, write)
+    duration = perf_counter() - _start_time
+
+    if any(
+        result.result and (result.result['inserted'] or result.result['changed'] or result.result['removed'])
+        for result in results
+    ):
+        bump_dataset_version()
+
+    for result in results:
+        if result.board in reports:
+            reports[result.board].stages['fetch'] = result.fetch_seconds
+            record_ingestion(load_markets.name, str(result.board), reports[result.board], result.payload_bytes)
+    record_ingestion_run(load_markets.name, load_markets.request.retries or 0)
+
+    for result in results:
+        if result.error is None:
+            logger.info(f'The {result.board} board has been loaded: {result.rows} rows fetched in '
+                        f'{result.fetch_seconds:.3f}s and written in {result.write_seconds:.3f}s, {result.result}',
+                        extra={'board': str(result.board), 'rows': result.rows, 'payload_bytes': result.payload_bytes})
+    logger.info(f'The markets have been loaded in {duration:.3f}s')
+
+    if errors := [result.error for result in results if result.error is not None]:
+        raise errors[0]
+
+    return {
+        'duration': duration,
+        'boards': {
+            str(result.board): {
+                'rows': result.rows,
+                'fetch_seconds': result.fetch_seconds,
+                'write_seconds': result.write_seconds,
+                **result.result,
+            }
+            for result in results
+        },
+    }
+
+
+def _fetch_stocks() -> tuple[list[dict], int]:
+    """Returns the current securities of the shares market from ISS and the size of the received responses."""
+
+    received = []
+
+    def count_bytes(response: httpx.Response) -> None:
+        response.read()
+        received.append(len(response.content))
+
+    market = Market('stocks')
+    # The market is a process-wide singleton that caches the securities once loaded, drop them to get fresh data.
+    market._values = None
+    stocks = market.tickers(cs=get_iss_session(event_hooks={'response': [count_bytes]}))
+    return stocks, sum(received)
+
+
+def _ingest_stocks(stocks: list[dict], mode: str, snapshot_key: str = SNAPSHOT_CACHE_KEY,
+                   board: str = SHARES_MARKET, timer: StageTimer | None = None) -> IngestionReport:
+    """
+    Writes the stocks received from the market in the ingestion mode and remembers the snapshot.
+
+    Parameters:
+        stocks (list[dict]): The stocks received from the market.
+        mode (str): The ingestion mode.
+        snapshot_key (str): The cache key of the snapshot digest.
+        board (str): The market or the board the stocks have been loaded from. Only the stored stocks
+            of this board that are missing from the stocks are removed.
+        timer (StageTimer | None): Measures the 'parse' and the 'write' stages, its timings are added to the report.
+
+    Returns:
+        IngestionReport: The counters and the stage timings of the run.
+    """
+
+    timer = timer or StageTimer()
+    with timer.measure('parse'):
+        fingerprints = {stock.get('SECID'): get_fingerprint(stock) for stock in stocks}
+
+    if mode == 'copy' and connection.vendor != 'postgresql':
+        logger.warning(f'The copy mode is not supported by {connection.vendor}, the diff mode is used instead')
+        mode = 'diff'
+
+    # The changes feed does not move past the start of the write until it has committed.
+    with writing_stocks():
+        if mode == 'full':
+            report = _load_all_stocks(stocks, fingerprints, board, timer)
+        elif mode == 'copy':
+            report = _copy_stocks(stocks, fingerprints, board, timer)
+        else:
+            report = _load_changed_stocks(stocks, fingerprints, snapshot_key, board, timer)
+
+    if not report.skipped:
+        try:
+            set_previous_snapshot(get_snapshot_digest(fingerprints), report, key=snapshot_key)
+        except Exception as error:
+            logger.warning(f'Failed to save the snapshot digest: {error}')
+
+    if report.written:
+        # Only the written stocks are pushed, the subscribers get the fields that have changed since the previous push.
+        publish_stock_changes([stock for stock in stocks if stock.get('SECID') in report.written_tickers])
+
+    return timer.apply(report)
+
+
+def _load_all_stocks(stocks: list[dict], fingerprints: dict[str, str], board: str = SHARES_MARKET,
+                     timer: StageTimer | None = None) -> IngestionReport:
+    """
+    Rewrites all the stocks in the database.
+
+    Parameters:
+        stocks (list[dict]): The stocks received from the market.
+        fingerprints (dict[str, str]): The content fingerprints of the stocks keyed by ticker.
+        board (str): The market or the board of the stocks, its stored stocks missing from them are removed.
+        timer (StageTimer | None): Measures the 'parse' and the 'write' stages.
+
+    Returns:
+        IngestionReport: The counters of the run.
+    """
+
+    timer = timer or StageTimer()
+    report = IngestionReport(mode='full', changed=len(stocks), written_tickers=set(fingerprints))
+    with timer.measure('parse'):
+        stock_objects = [_build_stock(stock, fingerprints[stock.get('SECID')], board) for stock in stocks]
+    with timer.measure('write'):
+        stored = set(Stock.objects.filter(board=board).values_list('ticker', flat=True))
+        _write_stocks(stock_objects)
+        report.removed = _remove_stocks(board, stored, fingerprints.keys())
+    return report
+
+
+def _copy_stocks(stocks: list[dict], fingerprints: dict[str, str], board: str = SHARES_MARKET,
+                 timer: StageTimer | None = None) -> IngestionReport:
+    """
+    Writes the stocks to the database through COPY and a staging table.
+
+    Parameters:
+        stocks (list[dict]): The stocks received from the market.
+        fingerprints (dict[str, str]): The content fingerprints of the stocks keyed by ticker.
+        board (str): The market or the board of the stocks, its stored stocks missing from them are removed.
+        timer (StageTimer | None): Measures the 'parse' and the 'write' stages.
+
+    Returns:
+        IngestionReport: The counters of the run.
+    """
+
     try:
-        stocks: list[dict] = Market('stocks').tickers()
-    except RequestException as error:
-        logger.error(f'RequestException occurred: {error}', exc_info=True)
+        return copy_stocks(stocks, fingerprints, board, remove_missing=bool(stocks), timer=timer)
+    except DatabaseError as error:
+        logger.error(f'Database error occurred during copying the stocks: {error}', exc_info=True)
         raise
     except Exception as error:
-        logger.error(f'An unexpected error occurred: {error}', exc_info=True)
+        logger.error(f'An error occurred during copying the stocks: {error}', exc_info=True)
+        raise
+
+
+def _load_changed_stocks(stocks: list[dict], fingerprints: dict[str, str], snapshot_key: str = SNAPSHOT_CACHE_KEY,
+                         board: str = SHARES_MARKET, timer: StageTimer | None = None) -> IngestionReport:
+    """
+    Writes only the new and the changed stocks to the database.
+
+    Parameters:
+        stocks (list[dict]): The stocks received from the market.
+        fingerprints (dict[str, str]): The content fingerprints of the stocks keyed by ticker.
+        snapshot_key (str): The cache key of the snapshot digest.
+        board (str): The market or the board of the stocks, its stored stocks missing from them are removed.
+        timer (StageTimer | None): Measures the 'parse' and the 'write' stages.
+
+    Returns:
+        IngestionReport: The counters of the run.
+    """
+
+    timer = timer or StageTimer()
+    report = IngestionReport(mode='diff')
+    digest = get_snapshot_digest(fingerprints)
+
+    try:
+        previous = get_previous_snapshot(snapshot_key)
+    except Exception as error:
+        logger.warning(f'Failed to get the previous snapshot digest: {error}')
+        previous = None
+
+    if previous and previous.get('digest') == digest:
+        # The stocks missing from the snapshot have been removed when it was applied.
+        report.unchanged = len(fingerprints)
+        report.skipped = True
+        return report
+
+    with timer.measure('write'):
+        stored = {ticker: (fingerprint, stored_board) for ticker, fingerprint, stored_board
+                  in Stock.objects.values_list('ticker', 'fingerprint', 'board')}
+
+    with timer.measure('parse'):
+        stock_objects = []
+        for stock in stocks:
+            ticker = stock.get('SECID')
+            fingerprint = fingerprints[ticker]
+            if ticker not in stored:
+                report.inserted += 1
+            # A stock that has moved from another board is written to be removed with this one.
+            elif stored[ticker] != (fingerprint, board):
+                report.changed += 1
+            else:
+                report.unchanged += 1
+                continue
+            stock_objects.append(_build_stock(stock, fingerprint, board))
+
+    with timer.measure('write'):
+        if stock_objects:
+            _write_stocks(stock_objects)
+            report.written_tickers = {stock.ticker for stock in stock_objects}
+        board_tickers = {ticker for ticker, (_, stored_board) in stored.items() if stored_board == board}
+        report.removed = _remove_stocks(board, board_tickers, fingerprints.keys())
+
+    return report
+
+
+def _remove_stocks(board: str, stored: set[str], received: set[str]) -> int:
+    """
+    Deletes the stored stocks of the board that are no longer listed, their tombstones are recorded
+    by the signals for the changes feed. The stocks of the other boards are kept. Nothing is deleted
+    if none of the stored stocks has been received, which is rather a failure of the market API
+    than the delisting of every stock.
+
+    Parameters:
+        board (str): The market or the board that has been loaded.
+        stored (set[str]): The tickers of the board stored before the run.
+        received (set[str]): The tickers received from the market.
+
+    Returns:
+        int: The number of the deleted stocks.
+    """
+
+    if not (tickers := stored - received):
+        return 0
+    if tickers == stored:
+        logger.warning(f'None of the {len(stored)} stored stocks of {board} has been received, nothing is removed')
+        return 0
+    try:
+        Stock.objects.filter(ticker__in=tickers).delete()
+    except Exception as error:
+        logger.error(f'An error occurred during removing the delisted stocks: {error}', exc_info=True)
+        raise
+    logger.info(f'{len(tickers)} delisted stocks of {board} have been removed: {", ".join(sorted(tickers)[:20])}')
+    return len(tickers)
+
+
+def _build_stock(stock: dict, fingerprint: str, board: str) -> Stock:
+    """
+    Creates a Stock instance from the data received from the market.
+
+    Parameters:
+        stock (dict): The stock data as returned by the market API.
+        fingerprint (str): The content fingerprint of the stock data.
+        board (str): The market or the board the stock has been loaded from.
+
+    Returns:
+        Stock: The unsaved Stock instance.
+    """
+
+    try:
+        values = {field: stock.get(key) for field, key in STOCK_FIELD_MAP.items()}
+        stock_object = Stock(
+            **values, board=board, fingerprint=fingerprint, search_document=build_search_document(values),
+        )
+    except ValidationError as error:
+        logger.error(f'ValidationError occurred for {stock=}: {error}', exc_info=True)
+        raise
+    except Exception as error:
+        logger.error(f'An error occurred while creating a Stock instance with {stock=}: {error}',
+                     exc_info=True)
         raise
     else:
-        logger.debug(f'Information about the stocks was received successfully. {stocks=}')
+        # The message is formatted lazily, it costs nothing in the ingestion loop unless the debug level is on.
+        logger.debug('A Stock instance has been successfully created: stock=%s', stock_object)
 
-    stock_objects = []
-    for stock in stocks:
-        try:
-            stock_objects.append(Stock(
-                ticker=stock.get('SECID'),
-                shortname=stock.get('SHORTNAME'),
-                secname=stock.get('SECNAME'),
-                latname=stock.get('LATNAME'),
-                prevprice=stock.get('PREVPRICE'),
-                lotsize=stock.get('LOTSIZE'),
-                facevalue=stock.get('FACEVALUE'),
-                faceunit=stock.get('FACEUNIT'),
-                status=stock.get('STATUS'),
-                decimals=stock.get('DECIMALS'),
-                minstep=stock.get('MINSTEP'),
-                prevdate=stock.get('PREVDATE'),
-                issuesize=stock.get('ISSUESIZE'),
-                isin=stock.get('ISIN'),
-                regnumber=stock.get('REGNUMBER'),
-                prevlegalcloseprice=stock.get('PREVLEGALCLOSEPRICE'),
-                currencyid=stock.get('CURRENCYID'),
-                sectype=stock.get('SECTYPE'),
-                listlevel=stock.get('LISTLEVEL'),
-                settledate=stock.get('SETTLEDATE'),
-            ))
-        except ValidationError as error:
-            logger.error(f'ValidationError occurred for {stock=}: {error}', exc_info=True)
-            raise
-        except Exception as error:
-            logger.error(f'An error occurred while creating a Stock instance with {stock=}: {error}',
-                         exc_info=True)
-            raise
-        else:
-            logger.debug(f'A Stock instance has been successfully created: stock={stock_objects[-1]}')
+    return stock_object
+
+
+def _write_stocks(stock_objects: list[Stock]) -> None:
+    """
+    Creates or updates the given Stock objects with a single bulk query.
+
+    Parameters:
+        stock_objects (list[Stock]): The Stock instances to write.
+    """
 
     try:
         Stock.objects.bulk_create(
             stock_objects,
             update_conflicts=True,
             unique_fields=['ticker'],
-            update_fields=[
-                'shortname', 'secname', 'latname', 'prevprice', 'lotsize', 'facevalue', 'faceunit',
-                'status', 'decimals', 'minstep', 'prevdate', 'issuesize', 'isin', 'regnumber',
-                'prevlegalcloseprice', 'currencyid', 'sectype', 'listlevel', 'settledate', 'updated',
-            ],
+            update_fields=UPDATE_FIELDS,
         )
     except IntegrityError as error:
         logger.error(f'Integrity error occurred during bulk creation: {error}', exc_info=True)
@@ -93,6 +456,114 @@ def load_available_stocks() -> int:
         logger.error(f'An error occurred during bulk creation: {error}', exc_info=True)
         raise
 
-    loaded = len(stock_objects)
-    logger.info(f'{loaded} stock records have been successfully loaded in {perf_counter() - _start_time}s')
+
+@app.task(autoretry_for=(Exception,), retry_backoff=5, retry_kwargs={'max_retries': 10})
+def load_candles(interval: int = Candle.IntervalChoices.MINUTE, tickers: list[str] | None = None) -> int:
+    """
+    Loads the candles of the stocks from the market and appends them to the database.
+
+    For each ticker the candles are requested starting from the day of the latest stored candle,
+    or settings.CANDLES_HISTORY_DAYS ago if there are none. The already stored candles are updated,
+    so the task can be safely repeated. New minute candles are resampled by the resample_candles task.
+
+    Parameters:
+        interval (int): The candle interval, one of Candle.IntervalChoices.
+        tickers (list[str] | None): The tickers to load. Defaults to all the stocks.
+
+    Returns:
+        int: The number of written candles.
+
+    Raises:
+        RequestException: If there is an issue with the request to the market API.
+        Exception: For any unexpected errors.
+    """
+
+    logger.info(f'The start of load candles with the interval {interval}')
+    _start_time = perf_counter()
+
+    if tickers is None:
+        tickers = list(Stock.objects.values_list('ticker', flat=True))
+
+    today = timezone.localdate()
+    batch, loaded = [], 0
+    # The begin of the earliest new candle of each ticker
+    arrived: dict[str, datetime] = {}
+    for ticker in tickers:
+        last_begin = get_last_candle_begin(ticker, interval)
+        start = last_begin.date() if last_begin else today - timedelta(days=settings.CANDLES_HISTORY_DAYS)
+
+        try:
+            for candle in fetch_candles(ticker, interval, start, today, settings.CANDLES_PAGE_SIZE):
+                batch.append(candle)
+                if (last_begin is None or candle.begin >= last_begin) and ticker not in arrived:
+                    arrived[ticker] = candle.begin
+                if len(batch) >= settings.CANDLES_BATCH_SIZE:
+                    loaded += write_candles(batch)
+                    batch = []
+        except LookupError as error:
+            logger.warning(f'The candles of {ticker} are not available: {error}')
+        except RequestException as error:
+            logger.error(f'RequestException occurred while loading the candles of {ticker}: {error}', exc_info=True)
+            raise
+        except Exception as error:
+            logger.error(f'An error occurred while loading the candles of {ticker}: {error}', exc_info=True)
+            raise
+
+    loaded += write_candles(batch)
+
+    logger.info(f'{loaded} candles of {len(tickers)} stocks have been loaded in {perf_counter() - _start_time}s')
+
+    if interval == Candle.IntervalChoices.MINUTE and arrived:
+        resample_candles.delay({ticker: begin.isoformat() for ticker, begin in arrived.items()})
+
     return loaded
+
+
+@app.task(autoretry_for=(Exception,), retry_backoff=5, retry_kwargs={'max_retries': 10})
+def resample_candles(arrived: dict[str, str]) -> int:
+    """
+    Materializes the 10 minute, hour, day and week candles from the minute candles.
+    Only the buckets that contain the newly arrived minute candles are recalculated.
+
+    Parameters:
+        arrived (dict[str, str]): The ISO begin of the earliest new minute candle keyed by ticker.
+
+    Returns:
+        int: The number of written candles.
+    """
+
+    logger.info(f'The start of resample candles of {len(arrived)} stocks')
+    _start_time = perf_counter()
+
+    written = 0
+    for ticker, since in arrived.items():
+        try:
+            written += write_candles(resample_ticker(ticker, datetime.fromisoformat(since)))
+        except Exception as error:
+            logger.error(f'An error occurred while resampling the candles of {ticker}: {error}', exc_info=True)
+            raise
+
+    logger.info(f'{written} candles have been resampled in {perf_counter() - _start_time}s')
+    return written
+
+
+@app.task
+def drop_expired_candles() -> int:
+    """
+    Removes the intraday candles older than settings.CANDLES_RETENTION_MONTHS months.
+    The candles of a day and longer intervals are kept forever.
+
+    Returns:
+        int: The number of dropped partitions (PostgreSQL) or deleted candles.
+    """
+
+    if not settings.CANDLES_RETENTION_MONTHS:
+        return 0
+
+    today = timezone.localdate()
+    months = today.year * 12 + today.month - 1 - settings.CANDLES_RETENTION_MONTHS
+    before = date(months // 12, months % 12 + 1, 1)
+
+    dropped = sum(drop_candle_partitions(interval, before) for interval in MONTHLY_INTERVALS)
+    logger.info(f'{dropped} expired candle partitions or rows older than {before} have been dropped')
+    return dropped
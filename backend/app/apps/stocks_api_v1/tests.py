@@ -1,3 +1,1698 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import io
+import json
+import logging
+import socket
+import tempfile
+import threading
+import time
 
-# Create your tests here.
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+from zoneinfo import ZoneInfo
+
+import httpx
+import numpy as np
+import pandas as pd
+import redis
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from asgiref.sync import sync_to_async
+from django.core import mail
+from django.core.management import call_command
+from django.core.exceptions import ValidationError
+from django.core.cache import cache
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+
+from core import db
+from core.celery import add_file_logger, handle_task_failure
+from core.logs import QueuedRotatingFileHandler
+from core.metrics import RedisMetricsStore, get_metrics_store
+from core.notifications import RedisFailureQueue, get_admin_emails, get_failure_queue, send_failure_digest
+from core.profiling import QueryBudgetExceeded
+from core.throttling import LocalBucketStore
+from .metrics import record_ingestion_run
+from .models import Candle, Stock, StockTombstone
+from .serializers import StockSerializer
+from .tasks import (
+    INGESTION_LOCK, _ingest_stocks, _load_changed_stocks, drop_expired_candles, load_available_stocks, load_candles,
+    load_markets,
+)
+from .utils.caching import bump_dataset_version
+from .utils.changes import writing_stocks
+from .utils.candles import write_candles
+from .utils.copy_ingestion import copy_stocks, normalize_frame
+from .utils.encoding import build_row_encoder, encode_rows
+from .utils.export import pyarrow
+from .utils.ingestion import get_fingerprint
+from .utils.iss_standin import ReplayTransport, build_securities_response, get_fixture_path
+from .utils.markets import MarketBoard, load_boards
+from .utils.price_stream import PriceBroadcaster, publish_stock_changes, stocks_websocket
+from .utils.market_calendar import MarketCalendar, MarketSchedule, get_market_calendar, parse_sessions
+from .utils.resampling import aggregate_candles, floor_to_bucket, resample_ticker
+from .utils.search import SearchIndex, SearchTrie
+from .utils.single_flight import LOCK_KEY_PREFIX, RedisLockBackend, get_lock_backend, single_flight
+from .utils.synthetic import generate_stocks
+from .utils.transliteration import build_search_document, normalize_search_text
+
+LOCAL_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class StockFilterQueryPlanTests(TestCase):
+    """
+    Checks that the common stock filters are answered with the indexes of the Stock table.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        Stock.objects.bulk_create(
+            Stock(
+                ticker=f'S{number}',
+                status='AS'[number % 2],
+                sectype='123'[number % 3],
+                listlevel=number % 3 + 1,
+                currencyid=('SUR', 'USD')[number % 2],
+                faceunit=('SUR', 'USD', 'EUR')[number % 3],
+                prevprice=number,
+                issuesize=number * 1000,
+            )
+            for number in range(200)
+        )
+
+    def assertUsesIndex(self, queryset, index_name):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # The test table is tiny, so make the planner prefer the indexes over the sequential scan.
+                cursor.execute('SET LOCAL enable_seqscan = off')
+            plan = queryset.order_by().explain()
+        self.assertIn(index_name, plan)
+
+    def test_tradable_by_listlevel(self):
+        self.assertUsesIndex(Stock.objects.filter(status='A', listlevel=1), 'stock_tradable_level_idx')
+        self.assertUsesIndex(
+            Stock.objects.filter(status='A', listlevel=2, prevprice__gte=10, prevprice__lte=100),
+            'stock_tradable_level_idx',
+        )
+
+    def test_status_and_sectype(self):
+        self.assertUsesIndex(Stock.objects.filter(status='S', sectype__in=['1', '2']), 'stock_status_type_idx')
+
+    def test_sectype(self):
+        self.assertUsesIndex(Stock.objects.filter(sectype='2', listlevel__in=[1, 2]), 'stock_type_level_idx')
+
+    def test_currency(self):
+        self.assertUsesIndex(Stock.objects.filter(currencyid='USD'), 'stock_currency_idx')
+        self.assertUsesIndex(Stock.objects.filter(faceunit__in=['EUR', 'USD']), 'stock_faceunit_idx')
+
+    def test_ranges(self):
+        self.assertUsesIndex(Stock.objects.filter(prevprice__gte=150), 'stock_prevprice_idx')
+        self.assertUsesIndex(Stock.objects.filter(issuesize__lte=5000), 'stock_issuesize_idx')
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class StockFilterTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        StockFilterQueryPlanTests.setUpTestData()
+
+    def get_tickers(self, query):
+        response = self.client.get(f'/api/v1/stocks/?fields=ticker&{query}')
+        self.assertEqual(response.status_code, 200, response.content)
+        return {stock['ticker'] for stock in response.json()}
+
+    def test_filters(self):
+        expected = set(
+            Stock.objects.filter(status='A', listlevel__in=[1, 3], prevprice__gte=20, prevprice__lte=120)
+            .values_list('ticker', flat=True)
+        )
+        self.assertTrue(expected)
+        self.assertEqual(
+            self.get_tickers('status=A&listlevel=1&listlevel=3&prevprice_min=20&prevprice_max=120'), expected,
+        )
+        self.assertEqual(self.get_tickers('faceunit=EUR&issuesize_max=9000'), {'S2', 'S5', 'S8'})
+
+    def test_invalid_filters(self):
+        self.assertEqual(self.client.get('/api/v1/stocks/?status=X').status_code, 400)
+        self.assertEqual(self.client.get('/api/v1/stocks/?prevprice_min=10&prevprice_max=1').status_code, 400)
+
+
+@override_settings(CACHES=LOCAL_CACHES, STOCKS_STREAM_REDIS_URL='')
+class ChangeDetectionTests(TestCase):
+    """
+    Checks that the diff mode writes only the new and the changed stocks and skips an unchanged snapshot.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.stocks = generate_stocks(5)
+
+    @staticmethod
+    def get_fingerprints(stocks):
+        return {stock['SECID']: get_fingerprint(stock) for stock in stocks}
+
+    def test_fingerprints(self):
+        changed = dict(self.stocks[0], PREVPRICE=self.stocks[0]['PREVPRICE'] + 1)
+        self.assertEqual(get_fingerprint(self.stocks[0]), get_fingerprint(dict(self.stocks[0])))
+        self.assertNotEqual(get_fingerprint(self.stocks[0]), get_fingerprint(changed))
+        # The keys that are not stored do not change the fingerprint.
+        self.assertEqual(get_fingerprint(self.stocks[0]), get_fingerprint(dict(self.stocks[0], BOARDID='TQTF')))
+
+    def test_counters(self):
+        report = _load_changed_stocks(self.stocks, self.get_fingerprints(self.stocks))
+        self.assertEqual((report.inserted, report.changed, report.unchanged, report.removed), (5, 0, 0, 0))
+
+        stocks = [dict(self.stocks[0], PREVPRICE=1.5), *self.stocks[1:4], generate_stocks(1, prefix='NEW')[0]]
+        report = _load_changed_stocks(stocks, self.get_fingerprints(stocks))
+        self.assertEqual((report.inserted, report.changed, report.unchanged, report.removed), (1, 1, 3, 1))
+        self.assertEqual(Stock.objects.get(ticker=self.stocks[0]['SECID']).prevprice, Decimal('1.5'))
+        # The delisted stock is removed and its tombstone is recorded for the changes feed.
+        self.assertEqual(Stock.objects.count(), 5)
+        self.assertEqual(list(StockTombstone.objects.values_list('ticker', flat=True)), [self.stocks[4]['SECID']])
+
+
+    def test_removal_is_scoped_to_board(self):
+        bonds = generate_stocks(3, prefix='B')
+        _ingest_stocks(bonds, 'diff', snapshot_key='stocks:snapshot:bonds', board='stock/bonds/TQCB')
+        _ingest_stocks(self.stocks, 'diff')
+        self.assertEqual(set(Stock.objects.values_list('board', flat=True)), {'stock/shares', 'stock/bonds/TQCB'})
+
+        # The shares do not know the bonds, only the missing share is removed.
+        report = _ingest_stocks(self.stocks[:4], 'full')
+        self.assertEqual(report.removed, 1)
+        report = _ingest_stocks(bonds[:2], 'diff', snapshot_key='stocks:snapshot:bonds', board='stock/bonds/TQCB')
+        self.assertEqual((report.unchanged, report.removed), (2, 1))
+        self.assertEqual(
+            set(Stock.objects.values_list('ticker', flat=True)), {'S0', 'S1', 'S2', 'S3', 'B0', 'B1'},
+        )
+        self.assertEqual(set(StockTombstone.objects.values_list('ticker', flat=True)), {'S4', 'B2'})
+
+        # A stock moved to another board is removed with its new board only.
+        report = _ingest_stocks([self.stocks[0], *bonds[:2]], 'diff', snapshot_key='stocks:snapshot:bonds',
+                                board='stock/bonds/TQCB')
+        self.assertEqual((report.changed, report.unchanged, report.removed), (1, 2, 0))
+        report = _ingest_stocks(self.stocks[1:4], 'diff')
+        self.assertEqual(report.removed, 0)
+        self.assertEqual(Stock.objects.get(ticker='S0').board, 'stock/bonds/TQCB')
+
+    def test_removal_in_full_mode(self):
+        _ingest_stocks(self.stocks, 'full')
+        report = _ingest_stocks(self.stocks[1:], 'full')
+        self.assertEqual((report.changed, report.removed), (4, 1))
+        self.assertFalse(Stock.objects.filter(ticker=self.stocks[0]['SECID']).exists())
+        self.assertTrue(StockTombstone.objects.filter(ticker=self.stocks[0]['SECID']).exists())
+
+        # An empty or a disjoint payload is a failure of the market rather than the delisting of every stock.
+        with mock.patch('apps.stocks_api_v1.tasks.logger') as logger:
+            report = _ingest_stocks(generate_stocks(2, prefix='OTHER'), 'diff')
+        logger.warning.assert_called_once_with(
+            'None of the 4 stored stocks of stock/shares has been received, nothing is removed',
+        )
+        self.assertEqual(report.removed, 0)
+        self.assertEqual(Stock.objects.count(), 6)
+
+    def test_unchanged_snapshot_is_skipped(self):
+        report = _ingest_stocks(self.stocks, 'diff')
+        self.assertEqual((report.inserted, report.skipped), (5, False))
+
+        with self.assertNumQueries(0):
+            report = _ingest_stocks([dict(stock) for stock in reversed(self.stocks)], 'diff')
+        self.assertEqual((report.unchanged, report.written, report.skipped), (5, 0, True))
+
+        # Any change of the snapshot makes the loader compare the fingerprints again.
+        report = _ingest_stocks([dict(self.stocks[0], STATUS='S'), *self.stocks[1:]], 'diff')
+        self.assertEqual((report.changed, report.unchanged, report.skipped), (1, 4, False))
+
+
+    def test_only_written_stocks_are_published(self):
+        _ingest_stocks(self.stocks, 'diff')
+        changed = dict(self.stocks[0], STATUS='S')
+        with mock.patch('apps.stocks_api_v1.tasks.publish_stock_changes') as publish:
+            report = _ingest_stocks([changed, *self.stocks[1:]], 'diff')
+        self.assertNotIn('written_tickers', report.as_dict())
+        publish.assert_called_once_with([changed])
+
+@override_settings(CACHES=LOCAL_CACHES, STOCKS_STREAM_REDIS_URL='')
+class CopyIngestionTests(TestCase):
+    """
+    Checks that the COPY engine writes the same rows and counts the same changes as the ORM diff path.
+    """
+
+    def setUp(self):
+        self.stocks = generate_stocks(6)
+        self.stocks[0].update(FACEVALUE=0.1, PREVDATE=None)
+        self.stocks[1].update(PREVPRICE='12.34567', LOTSIZE=None)
+
+    @staticmethod
+    def get_fingerprints(stocks):
+        return {stock['SECID']: get_fingerprint(stock) for stock in stocks}
+
+    def test_normalize_frame(self):
+        self.stocks[0]['STATUS'] = 'X'
+        frame = normalize_frame(self.stocks, self.get_fingerprints(self.stocks)).set_index('ticker')
+        # The decimals are saved as the ORM saves them, not rounded through float64.
+        self.assertEqual(frame.loc['S0', 'facevalue'], Decimal('0.10000000000000001'))
+        self.assertEqual(frame.loc['S1', 'prevprice'], Decimal('12.3456700000'))
+        # The unknown choices become nulls.
+        self.assertTrue(pd.isna(frame.loc['S0', 'status']))
+        self.assertTrue(pd.isna(frame.loc['S0', 'prevdate']))
+        self.assertTrue(pd.isna(frame.loc['S1', 'lotsize']))
+        self.assertEqual(frame.loc['S2', 'prevdate'], '2024-03-15')
+
+    def test_invalid_values(self):
+        for key, value in (('FACEVALUE', 'n/a'), ('LOTSIZE', 'many'), ('PREVDATE', 'yesterday')):
+            stocks = [dict(self.stocks[2], **{key: value})]
+            with self.subTest(key=key), self.assertRaisesMessage(ValidationError, f"S2={value!r}"):
+                normalize_frame(stocks, self.get_fingerprints(stocks))
+
+    def load(self, loader):
+        """Loads the stocks, then the changed, the new and without a removed stock, returns the counters and rows."""
+
+        changed = [dict(self.stocks[0], PREVPRICE=1.5), *self.stocks[1:5], *generate_stocks(1, prefix='NEW')]
+        counters = []
+        for stocks in (self.stocks, changed):
+            report = loader(stocks, self.get_fingerprints(stocks))
+            counters.append((report.inserted, report.changed, report.unchanged, report.removed))
+        fields = [field.name for field in Stock._meta.fields if field.name != 'updated']
+        return counters, list(Stock.objects.order_by('ticker').values_list(*fields))
+
+    @skipUnless(connection.vendor == 'postgresql', 'COPY requires PostgreSQL')
+    def test_same_rows_as_orm(self):
+        orm_counters, orm_rows = self.load(_load_changed_stocks)
+        self.assertEqual(orm_counters, [(6, 0, 0, 0), (1, 1, 4, 1)])
+        Stock.objects.all().delete()
+        StockTombstone.objects.all().delete()
+
+        copy_counters, copy_rows = self.load(copy_stocks)
+        self.assertEqual(copy_counters, orm_counters)
+        self.assertEqual(copy_rows, orm_rows)
+
+
+@override_settings(CANDLES_HISTORY_DAYS=2, CANDLES_PAGE_SIZE=3, CANDLES_BATCH_SIZE=2, CANDLES_RETENTION_MONTHS=2)
+class CandleTests(TestCase):
+    """
+    Checks that the candles are appended idempotently and that the expired intraday candles are dropped.
+    """
+
+    today = date(2024, 6, 14)
+
+    def setUp(self):
+        days = [self.today - timedelta(days=2), self.today - timedelta(days=1), self.today]
+        self.market = [
+            SimpleNamespace(begin=datetime.combine(day, datetime.min.time()).replace(hour=10, minute=minute),
+                            open=100 + number, high=101 + number, low=99 + number, close=100.5 + number,
+                            value=1000.0 * number, volume=10 * number)
+            for number, (day, minute) in enumerate([(days[0], 0), (days[0], 1), (days[1], 0), (days[2], 0),
+                                                    (days[2], 1)])
+        ]
+        for patcher in (
+            mock.patch('apps.stocks_api_v1.utils.candles.Share', side_effect=self.get_share),
+            mock.patch('django.utils.timezone.localdate', return_value=self.today),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def get_share(self, ticker):
+        def candles(date, till_date, period, limit):
+            return [candle for candle in self.market if date <= candle.begin.date() <= till_date][:limit]
+        return SimpleNamespace(candles=candles)
+
+    def test_load_candles_is_idempotent(self):
+        with mock.patch('apps.stocks_api_v1.tasks.resample_candles') as resample_candles:
+            # The pages overlap by a day, the candles of the overlapping days are written again.
+            self.assertGreaterEqual(load_candles.run(tickers=['SBER']), 5)
+            first_load = list(Candle.objects.order_by('begin').values_list('begin', 'close', 'volume'))
+            self.assertEqual(len(first_load), 5)
+
+            # Only the last stored day is requested again, its changed candle is updated in place.
+            self.market[-1].close = 200
+            self.assertEqual(load_candles.run(tickers=['SBER']), 2)
+
+        candles = list(Candle.objects.order_by('begin').values_list('begin', 'close', 'volume'))
+        self.assertEqual(candles[:-1], first_load[:-1])
+        self.assertEqual(candles[-1][1], 200)
+        # The minute candles are resampled from the earliest new one.
+        begins = [datetime.fromisoformat(call.args[0]['SBER']) for call in resample_candles.delay.call_args_list]
+        self.assertEqual(begins, [first_load[0][0], first_load[-1][0]])
+
+    def test_drop_expired_candles(self):
+        def candle(interval, day):
+            begin = timezone.make_aware(datetime.combine(day, datetime.min.time()))
+            return Candle(ticker='SBER', interval=interval, begin=begin, open=1, high=1, low=1, close=1, value=1,
+                          volume=1)
+
+        write_candles([
+            candle(Candle.IntervalChoices.MINUTE, date(2024, 3, 31)),
+            candle(Candle.IntervalChoices.HOUR, date(2024, 3, 1)),
+            candle(Candle.IntervalChoices.MINUTE, date(2024, 4, 1)),
+            candle(Candle.IntervalChoices.DAY, date(2023, 1, 1)),
+        ])
+
+        # The candles before April are older than 2 months (the rows or the monthly partitions),
+        # the daily ones are kept forever.
+        self.assertEqual(drop_expired_candles.run(), 2)
+        self.assertEqual(
+            sorted(Candle.objects.values_list('interval', 'begin__date')),
+            [(Candle.IntervalChoices.MINUTE, date(2024, 4, 1)), (Candle.IntervalChoices.DAY, date(2023, 1, 1))],
+        )
+
+
+    def test_candle_key(self):
+        # The candles of the tickers at the same time are saved and deleted by the whole key.
+        begin = timezone.make_aware(datetime(2024, 6, 14, 10))
+        sber, gazp = (Candle(ticker=ticker, interval=Candle.IntervalChoices.MINUTE, begin=begin, open=1, high=1,
+                             low=1, close=1, value=1, volume=1) for ticker in ('SBER', 'GAZP'))
+        sber.save()
+        gazp.save()
+        sber.close = 2
+        sber.save()
+        self.assertEqual(sorted(Candle.objects.values_list('ticker', 'close')), [('GAZP', 1), ('SBER', 2)])
+        gazp.delete()
+        self.assertEqual(list(Candle.objects.values_list('ticker', flat=True)), ['SBER'])
+
+class ResamplingTests(TestCase):
+    """
+    Checks the aggregation of the minute candles against the candles calculated by hand.
+    """
+
+    moscow = ZoneInfo('Europe/Moscow')
+
+    @staticmethod
+    def minutes(*minutes):
+        """The local nanoseconds of the minutes after 2024-06-10 10:00 (Monday)."""
+
+        start = np.datetime64('2024-06-10T10:00', 'ns').astype(np.int64)
+        return np.array([start + minute * 60 * 10 ** 9 for minute in minutes], dtype=np.int64)
+
+    def test_bucket_edges(self):
+        sunday, monday = np.datetime64('2024-06-09T23:59', 'ns'), np.datetime64('2024-06-10T00:00', 'ns')
+        values = np.array([sunday, monday]).astype(np.int64)
+        weeks = floor_to_bucket(values, Candle.IntervalChoices.WEEK).astype('datetime64[ns]')
+        self.assertEqual(weeks.tolist(), [np.datetime64('2024-06-03', 'ns').item(), monday.item()])
+        hours = floor_to_bucket(self.minutes(59, 60), Candle.IntervalChoices.HOUR)
+        self.assertEqual(hours.tolist(), self.minutes(0, 60).tolist())
+
+    def test_aggregate_candles(self):
+        # Two full 10 minute buckets with a gap, and a partial trailing bucket.
+        minutes = [0, 3, 9, 10, 15, 21]
+        columns = {
+            'begin': self.minutes(*minutes),
+            'open': np.array([10.0, 11, 12, 20, 21, 30]),
+            'high': np.array([11.0, 15, 13, 25, 22, 31]),
+            'low': np.array([9.0, 10, 8, 19, 18, 29]),
+            'close': np.array([11.0, 12, 12.5, 21, 20, 30.5]),
+            'value': np.array([100.0, 200, 300, 400, 500, 600]),
+            'volume': np.array([1, 2, 3, 4, 5, 6], dtype=np.int64),
+        }
+        aggregated = aggregate_candles(columns, Candle.IntervalChoices.TEN_MINUTES)
+        self.assertEqual(aggregated['begin'].tolist(), self.minutes(0, 10, 20).tolist())
+        self.assertEqual(aggregated['open'].tolist(), [10, 20, 30])
+        self.assertEqual(aggregated['high'].tolist(), [15, 25, 31])
+        self.assertEqual(aggregated['low'].tolist(), [8, 18, 29])
+        self.assertEqual(aggregated['close'].tolist(), [12.5, 20, 30.5])
+        self.assertEqual(aggregated['value'].tolist(), [600, 900, 600])
+        self.assertEqual(aggregated['volume'].tolist(), [6, 9, 6])
+
+        empty = aggregate_candles({name: values[:0] for name, values in columns.items()}, Candle.IntervalChoices.HOUR)
+        self.assertEqual(empty['begin'].tolist(), [])
+
+    def test_incremental_resampling(self):
+        def minute_candle(minute, price, volume):
+            begin = datetime(2024, 6, 10, 10, tzinfo=self.moscow) + timedelta(minutes=minute)
+            return Candle(ticker='SBER', interval=Candle.IntervalChoices.MINUTE, begin=begin, open=price,
+                          high=price + 1, low=price - 1, close=price, value=price * volume, volume=volume)
+
+        write_candles([minute_candle(minute, 100 + minute, 10) for minute in range(0, 15)])
+        write_candles(resample_ticker('SBER', datetime(2024, 6, 10, 10, tzinfo=self.moscow)))
+
+        # The new minutes change only the buckets they fall into, which are recalculated from all their minutes.
+        write_candles([minute_candle(minute, 100 + minute, 20) for minute in (15, 16)])
+        since = datetime(2024, 6, 10, 10, 15, tzinfo=self.moscow)
+        candles = {candle.interval: candle for candle in resample_ticker('SBER', since)}
+        self.assertEqual(set(candles), {Candle.IntervalChoices.TEN_MINUTES, Candle.IntervalChoices.HOUR,
+                                        Candle.IntervalChoices.DAY, Candle.IntervalChoices.WEEK})
+
+        ten_minutes = candles[Candle.IntervalChoices.TEN_MINUTES]
+        self.assertEqual(ten_minutes.begin, datetime(2024, 6, 10, 10, 10, tzinfo=self.moscow))
+        self.assertEqual((ten_minutes.open, ten_minutes.high, ten_minutes.low, ten_minutes.close),
+                         (110, 117, 109, 116))
+        self.assertEqual(ten_minutes.volume, 5 * 10 + 2 * 20)
+        self.assertEqual(ten_minutes.value, 10 * sum(range(110, 115)) + 20 * (115 + 116))
+
+        week = candles[Candle.IntervalChoices.WEEK]
+        self.assertEqual(week.begin, datetime(2024, 6, 10, tzinfo=self.moscow))
+        self.assertEqual((week.open, week.high, week.low, week.close), (100, 117, 99, 116))
+        self.assertEqual(week.volume, 15 * 10 + 2 * 20)
+
+        write_candles(candles.values())
+        self.assertEqual(Candle.objects.filter(interval=Candle.IntervalChoices.TEN_MINUTES).count(), 2)
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class ResponseCacheTests(TestCase):
+    """
+    Checks the conditional requests and that the cached responses live until the dataset version changes.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        Stock.objects.create(ticker='SBER', prevprice=250)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_conditional_requests(self):
+        response = self.client.get('/api/v1/stocks/SBER/')
+        self.assertEqual(response.status_code, 200)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        self.assertRegex(etag, r'^"[0-9a-f]{32}-json-[0-9a-f]{16}"$')
+        self.assertIn('Accept', response['Vary'])
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/v1/stocks/SBER/', headers={'If-None-Match': etag})
+        self.assertEqual((response.status_code, response.content), (304, b''))
+        self.assertEqual(response['ETag'], etag)
+        response = self.client.get('/api/v1/stocks/SBER/', headers={'If-Modified-Since': last_modified})
+        self.assertEqual(response.status_code, 304)
+        # The browsable API has a validator of its own.
+        response = self.client.get('/api/v1/stocks/SBER/', headers={'If-None-Match': etag, 'Accept': 'text/html'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_etag_of_query(self):
+        etag = self.client.get('/api/v1/stocks/?fields=ticker&status=A')['ETag']
+        # The equivalent query has the same ETag, the other queries and paths do not match it.
+        response = self.client.get('/api/v1/stocks/?status=A&fields=ticker', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        for url in ('/api/v1/stocks/?fields=prevprice&status=A', '/api/v1/stocks/', '/api/v1/stocks/SBER/'):
+            response = self.client.get(url, headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 200, url)
+            self.assertNotEqual(response['ETag'], etag)
+
+        # The invalid queries are rejected before the validators are checked.
+        for url in ('/api/v1/stocks/?fields=unknown', '/api/v1/stocks/?status=X',
+                    '/api/v1/stocks/?page_size=2&cursor=x'):
+            response = self.client.get(url, headers={'If-None-Match': '*'})
+            self.assertIn(response.status_code, (400, 404), url)
+
+    def test_invalidation(self):
+        etag = self.client.get('/api/v1/stocks/SBER/')['ETag']
+        Stock.objects.filter(ticker='SBER').update(prevprice=300)
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/v1/stocks/SBER/')
+        self.assertEqual(response.json()['prevprice'], '250.0000000000')
+
+        bump_dataset_version()
+        response = self.client.get('/api/v1/stocks/SBER/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['prevprice'], '300.0000000000')
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class PaginationTests(TestCase):
+    """
+    Checks the cursor pagination over the tickers and the sparse fieldsets.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        tickers = ('LKOH', 'AFLT', 'SBER', 'GAZP', 'YNDX', 'MTSS', 'VTBR')
+        Stock.objects.bulk_create(Stock(ticker=ticker, prevprice=number) for number, ticker in enumerate(tickers))
+
+    def setUp(self):
+        cache.clear()
+
+    def get_page(self, url, params=None):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_pages(self):
+        page = self.get_page('/api/v1/stocks/', {'page_size': 3})
+        self.assertEqual(set(page), {'next', 'previous', 'results'})
+        tickers = [stock['ticker'] for stock in page['results']]
+
+        # The stocks inserted before the cursor do not move the next pages.
+        Stock.objects.create(ticker='ALRS')
+        cache.clear()
+        while page['next']:
+            page = self.get_page(page['next'])
+            tickers.extend(stock['ticker'] for stock in page['results'])
+        self.assertEqual(tickers, ['AFLT', 'GAZP', 'LKOH', 'MTSS', 'SBER', 'VTBR', 'YNDX'])
+
+        # Without page_size the whole list is returned.
+        self.assertEqual(len(self.get_page('/api/v1/stocks/')), 8)
+        self.assertEqual(len(self.get_page('/api/v1/stocks/', {'page_size': 5000})['results']), 8)
+
+    def test_fields(self):
+        for params in ({}, {'page_size': 2}):
+            stocks = self.get_page('/api/v1/stocks/', {'fields': 'prevprice, ticker', **params})
+            stocks = stocks['results'] if params else stocks
+            self.assertEqual(stocks[0], {'ticker': 'AFLT', 'prevprice': '1.0000000000'})
+        self.assertEqual(self.get_page('/api/v1/stocks/SBER/', {'fields': 'isin'}), {'isin': None})
+
+        response = self.client.get('/api/v1/stocks/', {'fields': 'ticker,fingerprint,price'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'fields': ['Unknown fields: fingerprint, price.']})
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class FastListTests(TestCase):
+    """
+    Checks that the row encoder renders the same bytes as the serializer.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        Stock.objects.bulk_create([
+            # All the nullable fields are null.
+            Stock(ticker='NULL', prevprice=None, prevlegalcloseprice=None, status=None, decimals=None, sectype=None,
+                  listlevel=None),
+            Stock(ticker='SBER', shortname='Сбербанк', prevprice=Decimal('250.1'), facevalue=Decimal('0.1'),
+                  minstep=Decimal('0.01'), lotsize=10, issuesize=21586948000, prevdate=date(2024, 3, 15),
+                  settledate=date(2024, 3, 19), isin='RU0009029540'),
+        ])
+        Stock.objects.filter(ticker='SBER').update(updated=datetime(2024, 3, 15, 19, 0, 1, 5, tzinfo=ZoneInfo('UTC')))
+
+    def setUp(self):
+        cache.clear()
+
+    def render_serializer(self, stocks, **kwargs):
+        return JSONRenderer().render(StockSerializer(stocks, many=True, **kwargs).data)
+
+    def test_encoder(self):
+        for fields in (None, ['ticker', 'facevalue', 'prevdate', 'updated']):
+            serializer_fields = StockSerializer(fields=fields).fields
+            encoder = build_row_encoder(serializer_fields, list(serializer_fields))
+            rendered = JSONRenderer().render(encode_rows(Stock.objects.values_list(*serializer_fields), encoder))
+            self.assertEqual(rendered, self.render_serializer(Stock.objects.all(), fields=fields))
+
+        self.assertIn(b'{"ticker":"NULL","facevalue":null,"prevdate":null,', rendered)
+        self.assertIn(b'"facevalue":"0.10000000000000000","prevdate":"2024-03-15",'
+                      b'"updated":"2024-03-15T22:00:01.000005+03:00"}', rendered)
+
+    def test_list(self):
+        fast = self.client.get('/api/v1/stocks/')
+        self.assertEqual(fast.content, self.render_serializer(Stock.objects.all()))
+        cache.clear()
+        with override_settings(STOCKS_FAST_LIST=False):
+            self.assertEqual(self.client.get('/api/v1/stocks/').content, fast.content)
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class BatchLookupTests(TestCase):
+    """
+    Checks the batch lookup of the stocks by the tickers and the ISINs.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        Stock.objects.bulk_create([
+            Stock(ticker='SBER', isin='RU0009029540'),
+            Stock(ticker='GAZP', isin='RU0007661625'),
+            Stock(ticker='LKOH', isin='RU0009024277'),
+            Stock(ticker='RU000A0JX0J2-SPBXM-LONG-TICKER', isin='RU000A0JX0J2'),
+        ])
+
+    def setUp(self):
+        cache.clear()
+
+    def test_query_parameters(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                '/api/v1/stocks/batch/', {'ticker': ['sber', ' RU0007661625 ', 'Missing', 'SBER'], 'fields': 'ticker'},
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            'results': [{'ticker': 'GAZP'}, {'ticker': 'SBER'}],
+            'not_found': ['MISSING'],
+        })
+
+        # The same keys in another order and case are answered from the cache.
+        with self.assertNumQueries(0):
+            cached = self.client.get('/api/v1/stocks/batch/',
+                                     {'ticker': ['missing', 'ru0007661625', 'sber'], 'fields': 'ticker'})
+        self.assertEqual(cached.content, response.content)
+
+    def test_post(self):
+        with self.assertNumQueries(1):
+            response = self.client.post('/api/v1/stocks/batch/', {'tickers': ['lkoh', 'RU0009029540']},
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([stock['ticker'] for stock in response.json()['results']], ['LKOH', 'SBER'])
+        self.assertEqual(response.json()['not_found'], [])
+
+    def test_long_ticker(self):
+        ticker = 'RU000A0JX0J2-SPBXM-LONG-TICKER'
+        response = self.client.post('/api/v1/stocks/batch/', {'tickers': [ticker.lower()]},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([stock['ticker'] for stock in response.json()['results']], [ticker])
+
+        too_long = 'X' * (Stock._meta.get_field('ticker').max_length + 1)
+        response = self.client.post('/api/v1/stocks/batch/', {'tickers': [too_long]}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_keys(self):
+        self.assertEqual(self.client.get('/api/v1/stocks/batch/').status_code, 400)
+        tickers = [f'S{number}' for number in range(settings.STOCKS_BATCH_MAX_SIZE + 1)]
+        response = self.client.post('/api/v1/stocks/batch/', {'tickers': tickers}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('tickers', response.json())
+
+
+class SearchTrieTests(SimpleTestCase):
+    """
+    Checks the matching of the query words by the trie of the search documents.
+    """
+
+    def setUp(self):
+        self.trie = SearchTrie()
+        for ticker, name in (('SBER', 'Сбербанк'), ('SBERP', 'Сбербанк-п'), ('GAZP', 'Газпром')):
+            self.trie.add(ticker, build_search_document({'ticker': ticker, 'shortname': name}))
+
+    def test_normalization(self):
+        self.assertEqual(normalize_search_text('  Сбербанк России-ПАО, ао '), 'sberbank rossii pao ao')
+        self.assertEqual(build_search_document({'ticker': 'GAZP', 'shortname': 'Газпром', 'isin': None}),
+                         'gazp gazprom')
+
+    def test_prefix(self):
+        self.assertEqual(self.trie.match('sber'), {'SBER': 3.0, 'SBERP': 2.0})
+        self.assertEqual(self.trie.match('sberbank'), {'SBER': 3.0, 'SBERP': 3.0})
+        self.assertEqual(self.trie.match('gaz'), {'GAZP': 2.0})
+
+    def test_typos(self):
+        # One typo in the words of 4 to 7 characters, two in the longer ones, none in the short ones.
+        self.assertEqual(self.trie.match('gazprim'), {'GAZP': 1.0})
+        self.assertEqual(self.trie.match('sbrebank'), {'SBER': 0.5, 'SBERP': 0.5})
+        self.assertEqual(self.trie.match('gzp'), {})
+
+    def test_update(self):
+        self.trie.add('GAZP', 'gazp gazprom neft')
+        self.assertEqual(self.trie.match('neft'), {'GAZP': 3.0})
+        self.trie.remove('GAZP')
+        self.assertEqual(self.trie.match('gazp'), {})
+        # The emptied branches are pruned.
+        self.assertNotIn('g', self.trie.root.children)
+        self.assertEqual(len(self.trie), 2)
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class SearchTests(TestCase):
+    """
+    Checks the search API, on the other databases than PostgreSQL with the in-memory index.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        for ticker, shortname, latname in (
+            ('SBER', 'Сбербанк', 'Sberbank'), ('SBERP', 'Сбербанк-п', 'Sberbank-p'), ('GAZP', 'Газпром', 'Gazprom'),
+        ):
+            Stock.objects.create(ticker=ticker, shortname=shortname, latname=latname, isin=f'RU000{ticker}')
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch('apps.stocks_api_v1.utils.search._index', SearchIndex())
+        self.index = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def search(self, query, **params):
+        response = self.client.get('/api/v1/stocks/search/', {'q': query, 'fields': 'ticker', **params})
+        self.assertEqual(response.status_code, 200, response.content)
+        return [stock['ticker'] for stock in response.json()]
+
+    def test_search(self):
+        self.assertEqual(self.search('сбер'), ['SBER', 'SBERP'])
+        self.assertEqual(self.search('sberp'), ['SBERP', 'SBER'])
+        # The exact ticker is the first, whichever spelling the query has.
+        self.assertEqual(self.search('СБЕРБАНК П'), ['SBERP'])
+        self.assertEqual(self.search('gazprom'), ['GAZP'])
+        self.assertEqual(self.search('Газпрм'), ['GAZP'])
+        self.assertEqual(self.search('ru000gazp'), ['GAZP'])
+        self.assertEqual(self.search('sber', limit=1), ['SBER'])
+        self.assertEqual(self.client.get('/api/v1/stocks/search/').status_code, 400)
+
+    @skipUnless(connection.vendor != 'postgresql', 'PostgreSQL searches with the trigram index')
+    def test_incremental_refresh(self):
+        self.assertEqual(self.search('gazprom'), ['GAZP'])
+        values = {'ticker': 'GAZPN', 'shortname': 'Газпром нефть'}
+        Stock.objects.bulk_create([Stock(**values, search_document=build_search_document(values))])
+
+        # The index follows the dataset version, which the loader bumps after writing the stocks.
+        self.assertEqual(self.search('gazpro'), ['GAZP'])
+        Stock.objects.filter(ticker='SBERP').delete()
+        with mock.patch.object(self.index.trie, 'add', wraps=self.index.trie.add) as add:
+            self.assertEqual(self.search('gazpr'), ['GAZP', 'GAZPN'])
+        # Only the stocks updated since the last refresh are reindexed.
+        added = {call.args[0] for call in add.call_args_list}
+        self.assertIn('GAZPN', added)
+        self.assertNotIn('SBER', added)
+        self.assertEqual(self.search('sber'), ['SBER'])
+
+
+@override_settings(CACHES=LOCAL_CACHES, STOCKS_EXPORT_CHUNK_SIZE=2)
+class ExportTests(TestCase):
+    """
+    Checks that the streamed exports have the rows of the API in every format.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        FastListTests.setUpTestData()
+        Stock.objects.create(ticker='GAZP', shortname='Газпром', status='S', prevprice=Decimal('150.5'))
+
+    def export(self, **params):
+        response = self.client.get('/api/v1/stocks/export/', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+
+    def get_api_rows(self, **params):
+        cache.clear()
+        return self.client.get('/api/v1/stocks/', params).json()
+
+    def test_csv(self):
+        response, content = self.export(fields='ticker,shortname,prevprice,prevdate', status='A')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="stocks.csv"')
+        rows = list(csv.reader(io.StringIO(content.decode())))
+        self.assertEqual(rows, [
+            ['ticker', 'shortname', 'prevprice', 'prevdate'],
+            ['SBER', 'Сбербанк', '250.1000000000', '2024-03-15'],
+        ])
+
+    def test_ndjson(self):
+        response, content = self.export(file_format='ndjson')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual([json.loads(line) for line in content.decode().splitlines()], self.get_api_rows())
+
+    def test_gzip(self):
+        response, content = self.export(file_format='ndjson', gzip='true', fields='ticker,status')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="stocks.ndjson.gz"')
+        lines = gzip.decompress(content).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], self.get_api_rows(fields='ticker,status'))
+
+    @skipUnless(pyarrow is not None, 'Parquet needs pyarrow')
+    def test_parquet(self):
+        response, content = self.export(file_format='parquet', fields='ticker,prevprice')
+        table = pyarrow.parquet.read_table(io.BytesIO(content))
+        self.assertEqual(table.column('ticker').to_pylist(), ['GAZP', 'NULL', 'SBER'])
+        self.assertEqual(table.column('prevprice').to_pylist(), [Decimal('150.5'), None, Decimal('250.1')])
+
+    def test_invalid_format(self):
+        self.assertEqual(self.client.get('/api/v1/stocks/export/', {'file_format': 'xml'}).status_code, 400)
+
+    def test_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            call_command('export_stocks', '--format', 'csv', '--gzip', '--chunk-size', '1',
+                         '--output', f'{directory}/stocks.csv.gz', stderr=io.StringIO())
+            with gzip.open(f'{directory}/stocks.csv.gz', 'rt') as file:
+                rows = list(csv.DictReader(file))
+        self.assertEqual([row['ticker'] for row in rows], ['GAZP', 'NULL', 'SBER'])
+        self.assertEqual(rows[2]['facevalue'], '0.10000000000000000')
+        self.assertEqual(rows[1]['prevprice'], '')
+
+
+@override_settings(CACHES=LOCAL_CACHES, STOCKS_STREAM_REDIS_URL='')
+class BenchmarkCommandTests(TransactionTestCase):
+    """
+    Runs the benchmarks on small synthetic datasets, so a change of the measured code does not break them.
+    The API benchmark creates its own test database.
+    """
+
+    def test_benchmark_api(self):
+        with tempfile.TemporaryDirectory() as directory:
+            call_command('benchmark_api', '--sizes', '10', '--requests', '2', '--transports', 'client',
+                         '--output', f'{directory}/benchmark.json', stdout=io.StringIO())
+            with open(f'{directory}/benchmark.json') as file:
+                report = json.load(file)
+
+        self.assertEqual((report['meta']['requests'], report['meta']['concurrency']), (2, 1))
+        endpoints = ['stock-list', 'stock-list-page', 'stock-list-fields', 'stock-detail', 'auth-token-login',
+                     'auth-users-me']
+        self.assertEqual(
+            [(result['size'], result['cache'], result['transport'], result['endpoint'])
+             for result in report['results']],
+            [(10, cache, 'client', endpoint) for cache in ('dummy', 'locmem') for endpoint in endpoints],
+        )
+        for result in report['results']:
+            self.assertEqual((result['requests'], result['errors']), (2, 0), result['endpoint'])
+            self.assertGreater(result['bytes'], 0)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+
+    def test_benchmark_stock_ingestion(self):
+        stdout = io.StringIO()
+        call_command('benchmark_stock_ingestion', '--sizes', '5', '--repeat', '1', stdout=stdout, stderr=io.StringIO())
+        rows = [line.split() for line in stdout.getvalue().splitlines()[1:]]
+        self.assertEqual(rows[0][:2], ['5', 'orm'])
+        self.assertTrue(all(row[0] == '5' and float(row[2]) > 0 for row in rows))
+        # The benchmark keeps no data.
+        self.assertFalse(Stock.objects.exists())
+
+
+class BoardReplayTransport(ReplayTransport):
+    """
+    The replay of ISS that delays every board by its own latency, fails the given boards
+    and records the number of the requests in flight.
+    """
+
+    def __init__(self, latencies: dict[str, float], failing: set[str] = frozenset(), **kwargs):
+        super().__init__(**kwargs)
+        self.latencies = latencies
+        self.failing = failing
+        self.in_flight = self.max_in_flight = 0
+        self.events = []
+
+    async def handle_async_request(self, request):
+        board = request.url.path.split('/')[-2]
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latencies.get(board, 0))
+        finally:
+            self.in_flight -= 1
+        self.events.append(('fetch', board))
+        if board in self.failing:
+            return httpx.Response(503, text='Service Unavailable', request=request)
+        return self._respond(request)
+
+
+@override_settings(STOCKS_MARKETS_CONCURRENCY=2)
+class MarketBoardsTests(SimpleTestCase):
+    """
+    Checks the concurrent fetch of the boards over the ISS replay.
+    """
+
+    boards = [MarketBoard.parse(f'stock/shares/{board}') for board in ('SLOW', 'FAST', 'BAD', 'NEXT')]
+
+    def load(self, transport):
+        written = {}
+
+        def write(board, stocks):
+            transport.events.append(('write', board.board))
+            written[board.board] = [stock['SECID'] for stock in stocks]
+            return {'inserted': len(stocks)}
+
+        with self.assertLogs('stocks', 'ERROR') as logs:
+            results = load_boards(self.boards, write, transport=transport)
+        return results, written, logs.output
+
+    def test_bounded_concurrency(self):
+        transport = BoardReplayTransport({'SLOW': 0.05, 'FAST': 0.05, 'BAD': 0.05, 'NEXT': 0.05}, failing={'BAD'},
+                                         scale=3)
+        results, written, _ = self.load(transport)
+
+        self.assertEqual(transport.max_in_flight, 2)
+        self.assertEqual([result.board for result in results], self.boards)
+        self.assertEqual(set(written), {'SLOW', 'FAST', 'NEXT'})
+        self.assertEqual(written['FAST'], ['FAST0', 'FAST1', 'FAST2'])
+
+    def test_board_errors_are_isolated(self):
+        transport = BoardReplayTransport({}, failing={'BAD'}, scale=3)
+        results, written, logs = self.load(transport)
+
+        failed = results[2]
+        self.assertIsInstance(failed.error, httpx.HTTPStatusError)
+        self.assertIsNone(failed.result)
+        self.assertEqual(failed.rows, 0)
+        self.assertEqual(len(logs), 1)
+        self.assertIn('Failed to load the stock/shares/BAD board', logs[0])
+        for result in results[:2] + results[3:]:
+            self.assertIsNone(result.error)
+            self.assertEqual((result.rows, result.result), (3, {'inserted': 3}))
+            self.assertGreater(result.payload_bytes, 0)
+
+    def test_boards_are_written_as_received(self):
+        transport = BoardReplayTransport({'SLOW': 0.3}, failing={'BAD'}, scale=3)
+        self.load(transport)
+
+        # The fast boards are written while the slow board is still being fetched.
+        self.assertEqual(transport.events[-2:], [('fetch', 'SLOW'), ('write', 'SLOW')])
+        for board in ('FAST', 'NEXT'):
+            self.assertLess(transport.events.index(('write', board)), transport.events.index(('fetch', 'SLOW')))
+
+
+@override_settings(CACHES=LOCAL_CACHES, ISS_REPLAY=True, ISS_REPLAY_DIR=None, ISS_REPLAY_SCALE=50,
+                   STOCKS_LOCK_REDIS_URL='', STOCKS_STREAM_REDIS_URL='')
+class StockLoaderReplayTests(TestCase):
+    """
+    Runs the stock loader against the offline ISS replay.
+    """
+
+    def test_load_available_stocks(self):
+        report = load_available_stocks.run(mode='diff')
+        self.assertEqual((report['inserted'], report['skipped']), (50, False))
+        self.assertEqual(Stock.objects.count(), 50)
+
+        report = load_available_stocks.run(mode='diff')
+        self.assertEqual((report['unchanged'], report['skipped']), (50, True))
+
+    def test_scale_recorded_fixture(self):
+        with tempfile.TemporaryDirectory() as fixtures_dir:
+            fixture = get_fixture_path(fixtures_dir, 'engines/stock/markets/shares/boards/TQBR/securities.json')
+            fixture.parent.mkdir(parents=True)
+            fixture.write_text(json.dumps(build_securities_response(generate_stocks(3, prefix='REC'))))
+
+            with override_settings(ISS_REPLAY_DIR=fixtures_dir, ISS_REPLAY_SCALE=7):
+                report = load_available_stocks.run(mode='full')
+
+        self.assertEqual(report['changed'], 7)
+        self.assertEqual(
+            sorted(Stock.objects.values_list('ticker', flat=True)),
+            ['REC0', 'REC0-1', 'REC0-2', 'REC1', 'REC1-1', 'REC2', 'REC2-1'],
+        )
+
+
+@override_settings(CACHES=LOCAL_CACHES, ISS_REPLAY=True, ISS_REPLAY_DIR=None, ISS_REPLAY_SCALE=20,
+                   METRICS_STORE='local', METRICS_TOKEN='secret', STOCKS_LOCK_REDIS_URL='', STOCKS_STREAM_REDIS_URL='')
+class MetricsTests(TestCase):
+    """
+    Checks the ingestion and the HTTP metrics rendered by the /metrics endpoint.
+    """
+
+    def setUp(self):
+        get_metrics_store().clear()
+
+    def get_metrics(self):
+        response = self.client.get('/metrics', headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        return response.content.decode()
+
+    def test_ingestion_metrics(self):
+        report = load_available_stocks.run(mode='diff')
+        self.assertEqual(set(report['stages']), {'fetch', 'parse', 'write'})
+
+        metrics = self.get_metrics()
+        task = 'task="apps.stocks_api_v1.tasks.load_available_stocks"'
+        for stage in ('fetch', 'parse', 'write'):
+            self.assertIn(f'stocks_ingestion_stage_seconds_count{{board="all",stage="{stage}",{task}}} 1', metrics)
+            self.assertIn(f'stocks_ingestion_stage_seconds_bucket{{board="all",stage="{stage}",{task},le="+Inf"}} 1',
+                          metrics)
+        self.assertIn(f'stocks_ingestion_rows_total{{board="all",result="inserted",{task}}} 20', metrics)
+        self.assertRegex(metrics, rf'stocks_ingestion_payload_bytes{{board="all",{task}}} [1-9]\d*')
+        self.assertIn(f'stocks_ingestion_retries{{{task}}} 0', metrics)
+
+    def test_http_metrics(self):
+        self.client.get('/api/v1/stocks/')
+        self.client.get('/api/v1/stocks/')
+        self.client.get('/missing/')
+
+        metrics = self.get_metrics()
+        self.assertIn('http_requests_total{method="GET",status="200",view="stock-list"} 2', metrics)
+        self.assertIn('http_requests_total{method="GET",status="404",view="unmatched"} 1', metrics)
+        self.assertIn('http_request_duration_seconds_count{method="GET",view="stock-list"} 2', metrics)
+
+    def test_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code, 403)
+        self.assertEqual(self.client.get('/metrics', headers={'Authorization': 'Bearer secret'}).status_code, 200)
+
+        # Without the token the endpoint is open only in DEBUG.
+        with override_settings(METRICS_TOKEN=None):
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+            with override_settings(DEBUG=True):
+                self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    def test_process_peak_memory(self):
+        rusage = mock.Mock(**{'getrusage.return_value.ru_maxrss': 2048})
+        with mock.patch('apps.stocks_api_v1.metrics.resource', rusage), \
+                mock.patch('apps.stocks_api_v1.metrics.MAXRSS_UNIT', 1):
+            record_ingestion_run('darwin', 0)
+        # Without the resource module, e.g. on Windows, the peak memory is not reported.
+        with mock.patch('apps.stocks_api_v1.metrics.resource', None):
+            record_ingestion_run('windows', 0)
+
+        metrics = self.get_metrics()
+        self.assertIn('stocks_ingestion_process_peak_memory_bytes{task="darwin"} 2048', metrics)
+        self.assertIn('stocks_ingestion_retries{task="windows"} 0', metrics)
+        self.assertNotIn('stocks_ingestion_process_peak_memory_bytes{task="windows"}', metrics)
+
+    @override_settings(METRICS_REDIS_RETRY_INTERVAL=30)
+    def test_redis_failure(self):
+        store = RedisMetricsStore('redis://localhost:6379/2')
+        pipeline = mock.Mock(**{'execute.side_effect': redis.ConnectionError('Connection refused')})
+        with mock.patch('core.metrics.get_metrics_store', return_value=store), \
+                mock.patch.object(store._client, 'pipeline', return_value=pipeline):
+            with self.assertLogs('stocks', 'WARNING') as logs:
+                self.assertEqual(self.client.get('/api/v1/stocks/').status_code, 200)
+            self.assertIn('Failed to update the', logs.output[0])
+            # The other update of the request and the next requests do not wait for Redis.
+            self.client.get('/api/v1/stocks/')
+            self.assertEqual(pipeline.execute.call_count, 1)
+            self.assertAlmostEqual(store._retry_at, time.monotonic() + 30, delta=5)
+
+            # Redis is tried again after the retry interval.
+            store._retry_at -= 30
+            self.client.get('/api/v1/stocks/')
+            self.assertEqual(pipeline.execute.call_count, 2)
+
+
+@override_settings(CACHES=LOCAL_CACHES, METRICS_STORE='local', METRICS_TOKEN='secret')
+class DatabaseConnectionTests(TestCase):
+    """
+    Checks the metrics of the persistent connections and that a forked process drops the inherited ones.
+    """
+
+    def setUp(self):
+        get_metrics_store().clear()
+
+    def test_connection_metrics(self):
+        db.count_opened_connection(sender=None, connection=connection)
+        self.client.get('/api/v1/stocks/')
+        self.client.get('/api/v1/stocks/')
+
+        metrics = self.client.get('/metrics', headers={'Authorization': 'Bearer secret'}).content.decode()
+        self.assertIn('db_connections_opened_total{alias="default",process="web"} 1', metrics)
+        # The connection of the test case is open before the requests, the request to /metrics reuses it too.
+        self.assertIn('db_connections_reused_total{alias="default",process="web"} 3', metrics)
+
+    def test_drop_inherited_connections(self):
+        inherited = mock.Mock(connection=mock.Mock(**{'fileno.return_value': 1000}))
+        with mock.patch.object(db.connections, 'all', return_value=[inherited]), \
+                mock.patch('core.db.os.close') as close, mock.patch('core.db._inherited_connections', []) as kept:
+            db.drop_inherited_connections()
+
+        close.assert_called_once_with(1000)
+        self.assertIsNone(inherited.connection)
+        self.assertEqual(len(kept), 1)
+
+
+@override_settings(CACHES=LOCAL_CACHES, PROFILING_ENABLED=True, PROFILING_RAISE_ON_BUDGET=True)
+class QueryBudgetTests(TestCase):
+    """
+    Requests the stocks and the auth views through the profiler, which fails the test
+    if a view makes more SQL queries than its budget in settings.PROFILING_QUERY_BUDGETS.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        StockFilterQueryPlanTests.setUpTestData()
+        Stock.objects.create(ticker='SBER', shortname='Сбербанк', secname='Сбербанк России ПАО ао')
+        cls.user = get_user_model().objects.create_user('budget', 'budget@example.com', 'budget-password-1')
+        cls.user.is_active = True
+        cls.user.save()
+        cls.token = Token.objects.create(user=cls.user)
+
+    def setUp(self):
+        # The cached responses would not make any queries.
+        cache.clear()
+
+    def assertWithinBudget(self, response, status_code=200):
+        self.assertEqual(response.status_code, status_code, response.content)
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", serializer;dur=[\d.]+, '
+                                                    r'renderer;dur=[\d.]+, total;dur=[\d.]+$')
+
+    def test_stock_views(self):
+        self.assertWithinBudget(self.client.get('/api/v1/stocks/'))
+        self.assertWithinBudget(self.client.get('/api/v1/stocks/?page_size=10&status=A'))
+        self.assertWithinBudget(self.client.get('/api/v1/stocks/S1/'))
+        self.assertWithinBudget(self.client.get('/api/v1/stocks/batch/?ticker=S1&ticker=S2&ticker=S3'))
+        self.assertWithinBudget(self.client.get('/api/v1/stocks/search/?q=сбер'))
+        self.assertWithinBudget(self.client.get('/api/v1/stocks/S1/candles/'))
+
+    def test_auth_views(self):
+        self.assertWithinBudget(self.client.post(
+            '/api/v1/auth/token/login/', {'username': 'budget', 'password': 'budget-password-1'},
+        ))
+        headers = {'Authorization': f'Token {self.token.key}'}
+        self.assertWithinBudget(self.client.get('/api/v1/auth/users/me/', headers=headers))
+        self.assertWithinBudget(self.client.get('/api/v1/auth/users/', headers=headers))
+
+    @override_settings(PROFILING_QUERY_BUDGETS={'stock-detail': 0})
+    def test_exceeded_budget(self):
+        with self.assertRaisesMessage(QueryBudgetExceeded, 'the budget is 0'):
+            self.client.get('/api/v1/stocks/S1/')
+
+
+class MarketCalendarTests(SimpleTestCase):
+    """
+    Checks the runs of the stock loader planned by the trading calendar.
+    """
+
+    moscow = ZoneInfo('Europe/Moscow')
+    intervals = {
+        'session_interval': timedelta(minutes=5),
+        'idle_interval': timedelta(hours=6),
+        'post_close_delay': timedelta(minutes=15),
+    }
+
+    def setUp(self):
+        self.calendar = MarketCalendar(
+            sessions=parse_sessions('10:00-18:50 19:05-23:50'), timezone='Europe/Moscow',
+            weekdays={0, 1, 2, 3, 4}, holidays={date(2024, 6, 12)},
+        )
+
+    def at(self, day, hour, minute=0):
+        return datetime(2024, 6, day, hour, minute, tzinfo=self.moscow)
+
+    def get_next_run(self, last_run):
+        return self.calendar.get_next_run(last_run, **self.intervals)
+
+    def test_sessions(self):
+        self.assertEqual(self.get_next_run(self.at(10, 12)), self.at(10, 12, 5))
+        # The break between the sessions
+        self.assertEqual(self.get_next_run(self.at(10, 18, 47)), self.at(10, 19, 5))
+        # The final run after the close
+        self.assertEqual(self.get_next_run(self.at(10, 23, 47)), self.at(11, 0, 5))
+        # The night and the next session
+        self.assertEqual(self.get_next_run(self.at(11, 0, 5)), self.at(11, 6, 5))
+        self.assertEqual(self.get_next_run(self.at(11, 6, 5)), self.at(11, 10))
+
+    def test_holidays_and_weekends(self):
+        self.assertFalse(self.calendar.in_session(self.at(12, 12)))
+        self.assertFalse(self.calendar.in_session(self.at(15, 12)))
+        # From the post-close run on Tuesday the 11th to the open on Thursday the 13th
+        runs = [self.at(12, 0, 5)]
+        while runs[-1] < self.at(13, 10):
+            runs.append(self.get_next_run(runs[-1]))
+        self.assertEqual(runs[-1], self.at(13, 10))
+        self.assertEqual(len(runs), 7)
+
+    def test_week(self):
+        runs, last_run = 0, self.at(10, 0)
+        while last_run < self.at(17, 0):
+            last_run = self.get_next_run(last_run)
+            runs += 1
+        every_minute = 7 * 24 * 60
+        self.assertLess(runs, every_minute * 0.1)
+        # Every 5 minutes of the 8:50 and 4:45 sessions of the 4 trading days, plus the post-close and the idle runs
+        self.assertGreaterEqual(runs, 4 * (106 + 57))
+
+    @override_settings(STOCKS_SCHEDULE_SESSION_INTERVAL=300, STOCKS_MARKET_HOLIDAYS=[],
+                       STOCKS_MARKET_SESSIONS='10:00-18:50', STOCKS_MARKET_CALENDAR_FILE=None)
+    def test_schedule(self):
+        schedule = MarketSchedule(nowfun=lambda: self.at(10, 12, 5))
+        self.assertEqual(schedule.is_due(self.at(10, 12)), (True, 300))
+        due, remaining = schedule.is_due(self.at(10, 12, 3))
+        self.assertFalse(due)
+        self.assertEqual(remaining, 180)
+
+    def test_missing_year(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = f'{directory}/calendar.json'
+            with open(path, 'w') as file:
+                json.dump({'holidays': ['2024-01-01', '2025-01-01']}, file)
+
+            new_year = datetime(2025, 12, 31, 21, tzinfo=ZoneInfo('UTC'))
+            with override_settings(STOCKS_MARKET_CALENDAR_FILE=path), \
+                    mock.patch('django.utils.timezone.now', return_value=new_year):
+                # It is 2026 in Moscow already, the year is reported once per process.
+                with self.assertLogs('stocks', 'ERROR') as logs:
+                    calendar = get_market_calendar()
+                    get_market_calendar()
+                self.assertEqual(len(logs.output), 1)
+                self.assertIn('has no holidays for 2026', logs.output[0])
+                self.assertEqual(calendar.years, {2024, 2025})
+                self.assertTrue(calendar.is_trading_day(date(2026, 1, 5)))
+
+    def test_calendar_file(self):
+        calendar = get_market_calendar()
+        for year in range(2024, 2027):
+            self.assertTrue(calendar.covers(date(year, 6, 1)), year)
+            self.assertFalse(calendar.is_trading_day(date(year, 1, 1)), year)
+
+
+@override_settings(CACHES=LOCAL_CACHES, ISS_REPLAY=True, ISS_REPLAY_DIR=None, ISS_REPLAY_SCALE=10,
+                   STOCKS_LOCK_REDIS_URL='', METRICS_STORE='local')
+class SingleFlightTests(TestCase):
+    """
+    Checks that the stock loaders do not overlap and that the triggers during a run are coalesced.
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    @override_settings(STOCKS_LOCK_REDIS_TIMEOUT=0.2)
+    def test_stalled_redis(self):
+        # The server accepts the connection and never answers, the lock fails the task instead of hanging it.
+        with socket.create_server(('127.0.0.1', 0)) as server:
+            backend = RedisLockBackend(f'redis://127.0.0.1:{server.getsockname()[1]}/0')
+            start = time.monotonic()
+            with self.assertRaises(redis.TimeoutError):
+                backend.acquire(f'{LOCK_KEY_PREFIX}:stalled', 'token', 60)
+            self.assertLess(time.monotonic() - start, 5)
+
+    def test_coalesced_triggers(self):
+        started, finish = threading.Event(), threading.Event()
+        results = []
+
+        @single_flight(INGESTION_LOCK)
+        def slow_loader(mode=None):
+            started.set()
+            finish.wait(5)
+            return {'mode': mode}
+
+        with mock.patch('apps.stocks_api_v1.utils.single_flight.current_app') as celery_app:
+            thread = threading.Thread(target=lambda: results.append(slow_loader(mode='diff')))
+            thread.start()
+            self.assertTrue(started.wait(5))
+
+            self.assertEqual(load_available_stocks.run(mode='full'), {'coalesced': True})
+            self.assertEqual(load_available_stocks.run(mode='copy'), {'coalesced': True})
+            self.assertEqual(Stock.objects.count(), 0)
+
+            finish.set()
+            thread.join()
+
+        self.assertEqual(results, [{'mode': 'diff'}])
+        # A single follow-up run with the arguments of the latest trigger
+        celery_app.send_task.assert_called_once_with(
+            'apps.stocks_api_v1.tasks.load_available_stocks', args=[], kwargs={'mode': 'copy'},
+        )
+
+    def test_follow_up_per_task(self):
+        started, finish = threading.Event(), threading.Event()
+
+        @single_flight(INGESTION_LOCK)
+        def slow_loader():
+            started.set()
+            finish.wait(5)
+
+        with mock.patch('apps.stocks_api_v1.utils.single_flight.current_app') as celery_app:
+            thread = threading.Thread(target=slow_loader)
+            thread.start()
+            self.assertTrue(started.wait(5))
+
+            self.assertEqual(load_available_stocks.run(mode='full'), {'coalesced': True})
+            self.assertEqual(load_markets.run(mode='diff', boards=['stock/shares/TQBR']), {'coalesced': True})
+
+            finish.set()
+            thread.join()
+
+        # The triggers of the tasks that share the lock do not replace each other.
+        self.assertEqual(celery_app.send_task.call_args_list, [
+            mock.call('apps.stocks_api_v1.tasks.load_available_stocks', args=[], kwargs={'mode': 'full'}),
+            mock.call('apps.stocks_api_v1.tasks.load_markets', args=[],
+                      kwargs={'mode': 'diff', 'boards': ['stock/shares/TQBR']}),
+        ])
+
+    def test_lock_released_before_pending(self):
+        backend = get_lock_backend()
+        key = f'{LOCK_KEY_PREFIX}:{INGESTION_LOCK}'
+        self.assertTrue(backend.acquire(key, 'holder', 1))
+        set_pending = backend.set_pending
+
+        def release_and_set_pending(pending_key, value):
+            # The holder finishes and takes the pending triggers just before this trigger is set.
+            backend.release(key, 'holder')
+            self.assertIsNone(backend.pop_pending(pending_key))
+            set_pending(pending_key, value)
+
+        with mock.patch.object(backend, 'set_pending', side_effect=release_and_set_pending), \
+                mock.patch('apps.stocks_api_v1.utils.single_flight.current_app') as celery_app:
+            self.assertEqual(load_available_stocks.run(mode='diff')['inserted'], 10)
+
+        # The trigger has run itself instead of waiting for a follow-up run that nobody would enqueue.
+        celery_app.send_task.assert_not_called()
+        self.assertIsNone(backend.pop_pending(f'{key}:pending:apps.stocks_api_v1.tasks.load_available_stocks'))
+
+    def test_lock_is_released(self):
+        with mock.patch('apps.stocks_api_v1.utils.single_flight.current_app') as celery_app:
+            self.assertEqual(load_available_stocks.run(mode='diff')['inserted'], 10)
+            self.assertEqual(load_available_stocks.run(mode='diff')['unchanged'], 10)
+        celery_app.send_task.assert_not_called()
+        self.assertTrue(get_lock_backend().acquire(f'{LOCK_KEY_PREFIX}:{INGESTION_LOCK}', 'test', 1))
+        get_lock_backend().release(f'{LOCK_KEY_PREFIX}:{INGESTION_LOCK}', 'test')
+
+
+@override_settings(CACHES=LOCAL_CACHES, NOTIFICATIONS_REDIS_URL='', NOTIFICATIONS_DIGEST_INTERVAL=300,
+                   EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class FailureDigestTests(TestCase):
+    """
+    Checks that the task failures are deduplicated and sent to the administrators as one digest.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        for number in range(2):
+            admin = get_user_model().objects.create_user(f'admin{number}', f'admin{number}@example.com', 'password-1')
+            admin.is_admin = True
+            admin.save()
+        get_user_model().objects.create_user('user', 'user@example.com', 'password-1')
+
+    def setUp(self):
+        cache.clear()
+        get_failure_queue().pop_all()
+
+    def fail_task(self, task, exception, task_id):
+        handle_task_failure(task_id, exception, (), {}, None, 'Traceback ...', sender=task)
+
+    def test_digest(self):
+        with self.assertNumQueries(0):
+            for attempt in range(10):
+                exception = ConnectionError(f'Timed out after {attempt}.5s')
+                self.fail_task(load_available_stocks, exception, f'id-{attempt}')
+            self.fail_task(load_available_stocks, ValueError('Unknown ingestion mode'), 'id-value')
+        self.assertEqual(mail.outbox, [])
+
+        self.assertEqual(send_failure_digest(), 2)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ['admin0@example.com', 'admin1@example.com'])
+        message = mail.outbox[0]
+        self.assertEqual(message.subject, 'Errors in Celery tasks: 11 failures of 1 tasks')
+        self.assertIn('ConnectionError: Timed out after 0.5s\n10 times from', message.body)
+        self.assertIn('the last task id id-9', message.body)
+        self.assertIn('ValueError: Unknown ingestion mode\n1 times', message.body)
+
+        # The next digest is not sent until the interval passes, the failures wait for it.
+        self.fail_task(load_available_stocks, ValueError('Unknown ingestion mode'), 'id-next')
+        self.assertEqual(send_failure_digest(), 0)
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_no_administrators(self):
+        get_user_model().objects.update(is_admin=False)
+        self.fail_task(load_available_stocks, ValueError('Unknown ingestion mode'), 'id-1')
+        self.fail_task(load_available_stocks, ValueError('Unknown ingestion mode'), 'id-2')
+        self.assertEqual(send_failure_digest(), 0)
+
+        # The failures are kept with their counters and the next digest is not delayed.
+        get_user_model().objects.filter(username='admin0').update(is_admin=True)
+        cache.delete('notifications:recipients')
+        self.fail_task(load_available_stocks, ValueError('Unknown ingestion mode'), 'id-3')
+        self.assertEqual(send_failure_digest(), 1)
+        self.assertIn('ValueError: Unknown ingestion mode\n3 times', mail.outbox[0].body)
+        self.assertIn('the last task id id-3', mail.outbox[0].body)
+
+    def test_redis_pop_all(self):
+        queue = RedisFailureQueue('redis://localhost:6379/1')
+        with mock.patch.object(queue, '_pop_all', return_value=[['task', 'load', 'count', '3'], []]) as pop_all:
+            self.assertEqual(queue.pop_all(), [{'task': 'load', 'count': '3'}])
+        # The set and the hashes of the failures are taken by one script.
+        pop_all.assert_called_once_with(keys=['notifications:failures'])
+
+    def test_admin_emails_are_cached(self):
+        self.assertEqual(sorted(get_admin_emails()), ['admin0@example.com', 'admin1@example.com'])
+        with self.assertNumQueries(0):
+            get_admin_emails()
+        get_user_model().objects.filter(username='user').update(is_admin=True)
+        get_user_model().objects.get(username='user').save()
+        self.assertEqual(len(get_admin_emails()), 3)
+
+
+class QueuedLoggingTests(SimpleTestCase):
+    """
+    Checks that the queued file handlers write JSON records once, however many times they are set up.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.logging = {
+            'formatters': {'json': {'()': 'core.logs.JsonFormatter'}},
+            'handlers': {'celery': {'filename': f'{self.directory.name}/celery.log', 'formatter': 'json'}},
+            'loggers': {'celery': {'level': 'INFO', 'propagate': True}},
+        }
+        parent, child = logging.getLogger('test-queued'), logging.getLogger('test-queued.child')
+        for logger in (parent, child):
+            self.addCleanup(setattr, logger, 'handlers', [])
+            self.addCleanup(setattr, logger, 'propagate', True)
+        self.parent, self.child = parent, child
+
+    def read_records(self, handler):
+        handler.stop()
+        self.addCleanup(handler.close)
+        with open(f'{self.directory.name}/celery.log') as file:
+            return [json.loads(line) for line in file]
+
+    def test_records(self):
+        with override_settings(LOGGING=self.logging):
+            for _ in range(3):
+                add_file_logger(self.parent)
+                add_file_logger(self.child)
+        handler = self.parent.handlers[0]
+        self.assertIsInstance(handler, QueuedRotatingFileHandler)
+        self.assertEqual(self.parent.handlers, [handler])
+        self.assertEqual(self.child.handlers, [handler])
+
+        payload = ['SBER'] * 5
+        self.child.info('Loaded %d stocks: %s', 10, payload, extra={'board': 'TQBR'})
+        self.child.debug('Dropped %s', mock.Mock(__str__=mock.Mock(side_effect=AssertionError('formatted'))))
+        payload.clear()
+        try:
+            raise ValueError('broken row')
+        except ValueError:
+            self.parent.exception('Failed')
+
+        first, second = self.read_records(handler)
+        self.assertEqual(first['message'], f'Loaded 10 stocks: {["SBER"] * 5}')
+        self.assertEqual((first['level'], first['logger'], first['board']), ('INFO', 'test-queued.child', 'TQBR'))
+        self.assertIn('ValueError: broken row', second['exception'])
+
+
+@override_settings(STOCKS_STREAM_REDIS_URL='', STOCKS_STREAM_FIELDS=['prevprice', 'status'], STOCKS_STREAM_HEARTBEAT=5)
+class PriceStreamTests(TestCase):
+    """
+    Checks that the clients of the stream receive the coalesced diffs of their tickers.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        Stock.objects.bulk_create([
+            Stock(ticker='SBER', prevprice=250, status='A'),
+            Stock(ticker='GAZP', prevprice=150, status='A'),
+        ])
+
+    def setUp(self):
+        patcher = mock.patch('apps.stocks_api_v1.utils.price_stream._broadcaster', PriceBroadcaster())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    async def publish(*stocks):
+        await sync_to_async(publish_stock_changes, thread_sensitive=False)(list(stocks))
+
+    async def test_server_sent_events(self):
+        response = await self.async_client.get('/api/v1/stocks/stream/?ticker=sber')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = aiter(response.streaming_content)
+        self.assertEqual(await anext(events), b'retry: 3000\n\n')
+        self.assertEqual(await anext(events), b'event: stocks\ndata: {"SBER": {"prevprice": 250.0, "status": "A"}}\n\n')
+
+        # The changes that the client has not taken yet are merged, the unchanged fields are not sent.
+        await self.publish({'SECID': 'SBER', 'PREVPRICE': 251, 'STATUS': 'A'}, {'SECID': 'GAZP', 'PREVPRICE': 151})
+        await self.publish({'SECID': 'SBER', 'PREVPRICE': 252, 'STATUS': 'A'})
+        self.assertEqual(await anext(events), b'event: stocks\ndata: {"SBER": {"prevprice": 252}}\n\n')
+        await events.aclose()
+
+    def test_server_sent_events_require_asgi(self):
+        self.assertEqual(self.client.get('/api/v1/stocks/stream/').status_code, 501)
+
+    async def test_websocket(self):
+        received, sent = asyncio.Queue(), asyncio.Queue()
+        await received.put({'type': 'websocket.connect'})
+        scope = {'type': 'websocket', 'path': '/api/v1/stocks/ws/', 'query_string': b'ticker=GAZP'}
+        connection = asyncio.create_task(stocks_websocket(scope, received.get, sent.put))
+
+        self.assertEqual(await sent.get(), {'type': 'websocket.accept'})
+        self.assertEqual(json.loads((await sent.get())['text']), {'GAZP': {'prevprice': 150.0, 'status': 'A'}})
+
+        await received.put({'type': 'websocket.receive', 'text': json.dumps({'subscribe': ['SBER']})})
+        await asyncio.sleep(0.01)
+        await self.publish({'SECID': 'SBER', 'PREVPRICE': 250, 'STATUS': 'S'})
+        self.assertEqual(json.loads((await sent.get())['text']), {'SBER': {'status': 'S'}})
+
+        await received.put({'type': 'websocket.disconnect'})
+        await asyncio.wait_for(connection, 1)
+
+
+@override_settings(CACHES=LOCAL_CACHES, THROTTLE_REDIS_URL='', STOCKS_STREAM_REDIS_URL='',
+                   STOCKS_STREAM_MAX_CONNECTIONS=1, STOCKS_STREAM_FIELDS=['prevprice'], REST_FRAMEWORK={
+                       **settings.REST_FRAMEWORK,
+                       'DEFAULT_THROTTLE_RATES': {'anon': '100/min', 'user': '100/min', 'stream': '2/min'},
+                   })
+class StreamAccessTests(TestCase):
+    """
+    Checks that the streams authenticate and throttle the clients and limit their open streams.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        Stock.objects.create(ticker='SBER', prevprice=250)
+        user = get_user_model().objects.create_user('streamer', 'streamer@example.com', 'password-1')
+        get_user_model().objects.filter(pk=user.pk).update(is_active=True)
+        cls.authorization = f'Token {Token.objects.create(user=user).key}'
+
+    def setUp(self):
+        for patcher in (
+            mock.patch('apps.stocks_api_v1.utils.price_stream._broadcaster', PriceBroadcaster()),
+            mock.patch('core.throttling._local_store', LocalBucketStore()),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def open_websocket(self, authorization=None, address='10.0.0.1'):
+        received, sent = asyncio.Queue(), asyncio.Queue()
+        await received.put({'type': 'websocket.connect'})
+        scope = {
+            'type': 'websocket', 'path': '/api/v1/stocks/ws/', 'query_string': b'', 'client': (address, 50000),
+            'headers': [(b'authorization', authorization.encode())] if authorization else [],
+        }
+        connection = asyncio.create_task(stocks_websocket(scope, received.get, sent.put))
+        return connection, received, await asyncio.wait_for(sent.get(), 1)
+
+    async def close_websocket(self, connection, received):
+        await received.put({'type': 'websocket.disconnect'})
+        await asyncio.wait_for(connection, 1)
+
+    async def test_websocket(self):
+        _, _, message = await self.open_websocket('Token invalid')
+        self.assertEqual(message, {'type': 'websocket.close', 'code': 1008})
+
+        connection, received, message = await self.open_websocket(self.authorization)
+        self.assertEqual(message, {'type': 'websocket.accept'})
+        # The user has an open stream already, whatever the address.
+        _, _, message = await self.open_websocket(self.authorization, address='10.0.0.2')
+        self.assertEqual(message, {'type': 'websocket.close', 'code': 1013, 'reason': 'Too many streams'})
+        await self.close_websocket(connection, received)
+
+        # The 2 connections of the user per minute have been used.
+        _, _, message = await self.open_websocket(self.authorization)
+        self.assertEqual(message, {'type': 'websocket.close', 'code': 1013, 'reason': 'Retry after 30s'})
+
+        # The anonymous clients are limited by the address.
+        connection, received, message = await self.open_websocket()
+        self.assertEqual(message, {'type': 'websocket.accept'})
+        await self.close_websocket(connection, received)
+
+    async def test_server_sent_events(self):
+        response = await self.async_client.get('/api/v1/stocks/stream/', headers={'Authorization': 'Token invalid'})
+        self.assertEqual(response.status_code, 401)
+
+        response = await self.async_client.get('/api/v1/stocks/stream/', headers={'Authorization': self.authorization})
+        self.assertEqual(response.status_code, 200)
+        events = aiter(response.streaming_content)
+        self.assertEqual(await anext(events), b'retry: 3000\n\n')
+
+        response = await self.async_client.get('/api/v1/stocks/stream/', headers={'Authorization': self.authorization})
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('At most 1 streams', response.json()['detail'])
+        await events.aclose()
+
+        response = await self.async_client.get('/api/v1/stocks/stream/', headers={'Authorization': self.authorization})
+        self.assertEqual((response.status_code, response['Retry-After']), (429, '30'))
+        self.assertEqual(response['RateLimit-Limit'], '2')
+
+
+@override_settings(CACHES=LOCAL_CACHES, STOCKS_CHANGES_LAG=5)
+class ChangesFeedTests(TestCase):
+    """
+    Checks that the changes feed returns the stocks and the removals after the token exactly once.
+    """
+
+    start = datetime(2024, 3, 1, 10, tzinfo=ZoneInfo('UTC'))
+
+    @classmethod
+    def setUpTestData(cls):
+        Stock.objects.bulk_create(Stock(ticker=ticker) for ticker in ('SBER', 'GAZP', 'LKOH'))
+        for minutes, ticker in enumerate(('SBER', 'GAZP', 'LKOH')):
+            Stock.objects.filter(ticker=ticker).update(updated=cls.start + timedelta(minutes=minutes))
+
+    def get_changes(self, now, **params):
+        with mock.patch('django.utils.timezone.now', return_value=now), self.assertNumQueries(2):
+            response = self.client.get('/api/v1/stocks/changes/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_changes(self):
+        now = self.start + timedelta(hours=1)
+        page = self.get_changes(now, limit=2)
+        self.assertEqual([stock['ticker'] for stock in page['results']], ['SBER', 'GAZP'])
+        self.assertTrue(page['has_more'])
+        page = self.get_changes(now, limit=2, since=page['next'])
+        self.assertEqual(([stock['ticker'] for stock in page['results']], page['has_more']), (['LKOH'], False))
+
+        # A change newer than the lag waits for the next request, the removal of a listed again ticker is skipped.
+        Stock.objects.filter(ticker='GAZP').update(updated=now + timedelta(seconds=1))
+        Stock.objects.get(ticker='LKOH').delete()
+        Stock.objects.get(ticker='SBER').delete()
+        Stock.objects.create(ticker='SBER')
+        StockTombstone.objects.update(removed=now + timedelta(seconds=2))
+        Stock.objects.filter(ticker='SBER').update(updated=now + timedelta(seconds=3))
+
+        token = page['next']
+        page = self.get_changes(now + timedelta(seconds=4), since=token)
+        self.assertEqual((page['results'], page['removed']), ([], []))
+        page = self.get_changes(now + timedelta(seconds=10), since=page['next'])
+        self.assertEqual([stock['ticker'] for stock in page['results']], ['GAZP', 'SBER'])
+        self.assertEqual(page['removed'], ['LKOH'])
+        page = self.get_changes(now + timedelta(seconds=20), since=page['next'])
+        self.assertEqual((page['results'], page['removed'], page['has_more']), ([], [], False))
+
+    def test_running_write(self):
+        # The rows of a write stamped with its start are committed long after the lag, the token waits for them.
+        now = self.start + timedelta(hours=1)
+        with mock.patch('django.utils.timezone.now', return_value=now), writing_stocks():
+            Stock.objects.filter(ticker='GAZP').update(updated=now)
+            page = self.get_changes(now + timedelta(minutes=10))
+            self.assertEqual([stock['ticker'] for stock in page['results']], ['SBER', 'LKOH'])
+            page = self.get_changes(now + timedelta(minutes=20), since=page['next'])
+            self.assertEqual(page['results'], [])
+        page = self.get_changes(now + timedelta(minutes=30), since=page['next'])
+        self.assertEqual([stock['ticker'] for stock in page['results']], ['GAZP'])
+
+    def test_invalid_token(self):
+        for token in ('not a token', 'bnVsbA', 'WyIyMDI0LTAzLTAxVDEwOjAwOjAwIixudWxsLCIiLCIiXQ'):
+            response = self.client.get('/api/v1/stocks/changes/', {'since': token})
+            self.assertEqual(response.status_code, 400, token)
+            self.assertEqual(response.json(), {'since': ['Invalid token.']})
+
+
+@override_settings(CACHES=LOCAL_CACHES, THROTTLE_REDIS_URL='', REST_FRAMEWORK={
+    **settings.REST_FRAMEWORK,
+    'DEFAULT_THROTTLE_RATES': {'anon': '3/min', 'user': '5/min', 'search': '2/min'},
+})
+class ThrottlingTests(TestCase):
+    """
+    Checks the token buckets of the anonymous and the authenticated clients and of the expensive endpoints.
+    """
+
+    def setUp(self):
+        patcher = mock.patch('core.throttling._local_store', LocalBucketStore())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_anonymous_clients(self):
+        for remaining in (2, 1, 0):
+            response = self.client.get('/api/v1/stocks/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual((response['RateLimit-Limit'], response['RateLimit-Remaining']), ('3', str(remaining)))
+        response = self.client.get('/api/v1/stocks/')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '20')
+        self.assertEqual(response['RateLimit-Reset'], '60')
+
+        # The buckets are kept by the IP address.
+        self.assertEqual(self.client.get('/api/v1/stocks/', REMOTE_ADDR='10.0.0.2').status_code, 200)
+
+    def test_scoped_endpoints(self):
+        user = get_user_model().objects.create_user('throttled', 'throttled@example.com', 'password-1')
+        authorization = f'Token {Token.objects.create(user=user).key}'
+        get_user_model().objects.filter(pk=user.pk).update(is_active=True)
+
+        for _ in range(2):
+            response = self.client.get('/api/v1/stocks/search/', {'q': 'sber'}, HTTP_AUTHORIZATION=authorization)
+            self.assertEqual(response.status_code, 200)
+        response = self.client.get('/api/v1/stocks/search/', {'q': 'sber'}, HTTP_AUTHORIZATION=authorization)
+        self.assertEqual((response.status_code, response['RateLimit-Limit']), (429, '2'))
+
+        # The other endpoints are limited by the user bucket only, which has 2 of 5 tokens left.
+        response = self.client.get('/api/v1/stocks/', HTTP_AUTHORIZATION=authorization)
+        self.assertEqual((response.status_code, response['RateLimit-Remaining']), (200, '1'))
+
+    @override_settings(THROTTLE_REDIS_URL='redis://127.0.0.1:1/0', THROTTLE_REDIS_TIMEOUT=0.05)
+    def test_local_fallback(self):
+        with mock.patch('core.throttling._redis_retry_at', 0.0), self.assertLogs('stocks', 'WARNING'):
+            for _ in range(3):
+                self.assertEqual(self.client.get('/api/v1/stocks/').status_code, 200)
+            self.assertEqual(self.client.get('/api/v1/stocks/').status_code, 429)
@@ -2,11 +2,12 @@ from django.urls import path, include
 
 from rest_framework import routers
 
-from .views import StockViewSet
+from .views import StockViewSet, stock_stream
 
 router = routers.SimpleRouter()
 router.register('stocks', StockViewSet)
 
 urlpatterns = [
+    path('stocks/stream/', stock_stream, name='stock-stream'),
     path('', include(router.urls)),
 ]
@@ -0,0 +1,143 @@
+import hashlib
+import logging
+import time
+import uuid
+
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+
+logger = logging.getLogger('stocks')
+
+DATASET_VERSION_KEY = 'stocks:version'
+RESPONSE_KEY_PREFIX = 'stocks:response'
+
+# The renderers whose output is cached, the browsable API is always rendered on the fly.
+CACHED_FORMATS = ('json',)
+
+
+def get_dataset_version() -> dict:
+    """
+    Returns the current version of the stocks dataset.
+
+    Returns:
+        dict: The opaque 'version' token and the 'modified' Unix timestamp of the last change.
+    """
+
+    version = cache.get(DATASET_VERSION_KEY)
+    if version is None:
+        # Nothing is known about the last change (e.g. the cache was flushed), so start a new version.
+        cache.add(DATASET_VERSION_KEY, {'version': uuid.uuid4().hex, 'modified': int(time.time())}, timeout=None)
+        version = cache.get(DATASET_VERSION_KEY)
+    if version is None:
+        # The cache does not keep anything (e.g. the dummy cache), so every request gets its own version.
+        version = {'version': uuid.uuid4().hex, 'modified': int(time.time())}
+    return version
+
+
+def get_request_identity(request) -> str:
+    """Returns the path and the query parameters of the request sorted by name, the same for the equivalent URLs."""
+
+    return f'{request.path}?{urlencode(sorted(request.query_params.lists()), doseq=True)}'
+
+
+def bump_dataset_version() -> None:
+    """Starts a new version of the stocks dataset, which invalidates all the cached responses."""
+
+    try:
+        cache.set(DATASET_VERSION_KEY, {'version': uuid.uuid4().hex, 'modified': int(time.time())}, timeout=None)
+    except Exception as error:
+        logger.error(f'Failed to bump the stocks dataset version: {error}', exc_info=True)
+
+
+class CachedResponseMixin:
+    """
+    Caches the rendered responses of a view by the version of the stocks dataset and
+    answers the conditional requests with 304 Not Modified using ETag and Last-Modified.
+    The ETag identifies the query as well, so the responses to the other queries do not match it.
+    """
+
+    def validate_query(self, request) -> None:
+        """
+        Validates the query parameters of the action, raises the errors the handler would raise.
+        It is called before the conditional request is answered, so an invalid request never gets 304.
+        """
+
+    def cached_response(self, request, handler, *args, cache_key: str | None = None, **kwargs):
+        """
+        Returns the cached response or calls the handler and caches its rendered output.
+        The conditional requests are answered for GET and HEAD only.
+
+        Parameters:
+            request (Request): The request.
+            handler (Callable): The view action that builds the response.
+            cache_key (str | None): Identifies the response in the version.
+                Defaults to the path and the sorted query parameters.
+
+        Returns:
+            HttpResponse: The 304, the cached or the fresh response.
+        """
+
+        try:
+            version = get_dataset_version()
+        except Exception as error:
+            logger.error(f'Failed to get the stocks dataset version: {error}', exc_info=True)
+            return handler(request, *args, **kwargs)
+
+        renderer_format = request.accepted_renderer.format
+        identity = cache_key or get_request_identity(request)
+        digest = hashlib.blake2b(identity.encode(), digest_size=8).hexdigest()
+        headers = HttpResponse()
+        headers['ETag'] = f'"{version["version"]}-{renderer_format}-{digest}"'
+        headers['Last-Modified'] = http_date(version['modified'])
+        patch_vary_headers(headers, ('Accept',))
+
+        if request.method in ('GET', 'HEAD'):
+            self.validate_query(request)
+            conditional = get_conditional_response(
+                request._request, etag=headers['ETag'], last_modified=version['modified'], response=headers,
+            )
+            if conditional is not headers:
+                return conditional
+
+        if renderer_format not in CACHED_FORMATS:
+            return self._with_headers(handler(request, *args, **kwargs), headers)
+
+        key = f'{RESPONSE_KEY_PREFIX}:{version["version"]}:{renderer_format}:{identity}'
+        try:
+            cached = cache.get(key)
+        except Exception as error:
+            logger.error(f'Failed to get the cached response: {error}', exc_info=True)
+            cached = None
+        if cached is not None:
+            content, content_type = cached
+            return self._with_headers(HttpResponse(content, content_type=content_type), headers)
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code != 200:
+            return response
+
+        response.accepted_renderer = request.accepted_renderer
+        response.accepted_media_type = request.accepted_media_type
+        response.renderer_context = self.get_renderer_context()
+        response.render()
+
+        try:
+            cache.set(key, (response.content, response['Content-Type']), timeout=settings.STOCKS_RESPONSE_CACHE_TIMEOUT)
+        except Exception as error:
+            logger.error(f'Failed to cache the response: {error}', exc_info=True)
+
+        return self._with_headers(response, headers)
+
+    @staticmethod
+    def _with_headers(response, headers: HttpResponse):
+        """Copies the validators and the Vary header to a successful response."""
+
+        if response.status_code == 200:
+            for header in ('ETag', 'Last-Modified', 'Vary'):
+                response[header] = headers[header]
+        return response
@@ -0,0 +1,194 @@
+from collections.abc import Iterable, Iterator
+from datetime import date, datetime
+
+from django.db import connection, transaction
+from django.utils import timezone
+from moexalgo import Share
+
+from ..models import Candle
+
+# The intervals that are range-partitioned by month on PostgreSQL, the others share one partition.
+MONTHLY_INTERVALS = (Candle.IntervalChoices.MINUTE, Candle.IntervalChoices.TEN_MINUTES, Candle.IntervalChoices.HOUR)
+
+# The `period` argument of moexalgo for each interval.
+MOEXALGO_PERIODS = {
+    Candle.IntervalChoices.MINUTE: '1m',
+    Candle.IntervalChoices.TEN_MINUTES: '10m',
+    Candle.IntervalChoices.HOUR: '1h',
+    Candle.IntervalChoices.DAY: '1D',
+    Candle.IntervalChoices.WEEK: '1W',
+    Candle.IntervalChoices.MONTH: '1M',
+    Candle.IntervalChoices.QUARTER: '1Q',
+}
+
+CANDLE_UPDATE_FIELDS = ['open', 'high', 'low', 'close', 'value', 'volume']
+
+# The partitions known to exist in this process.
+_partitions: set[str] = set()
+
+
+def _month_start(moment: date) -> date:
+    return date(moment.year, moment.month, 1)
+
+
+def _next_month(moment: date) -> date:
+    return date(moment.year + moment.month // 12, moment.month % 12 + 1, 1)
+
+
+def get_partition_name(interval: int, month: date) -> str:
+    """Returns the name of the partition that stores the candles of the interval for the month."""
+
+    return f'{Candle._meta.db_table}_i{interval}_{month:%Y%m}'
+
+
+def ensure_candle_partitions(interval: int, start: datetime, end: datetime) -> None:
+    """
+    Creates the monthly partitions for the candles of the interval between start and end inclusive.
+    Does nothing for the intervals that are not partitioned by month and for other databases.
+
+    Parameters:
+        interval (int): The candle interval.
+        start (datetime): The begin of the earliest candle.
+        end (datetime): The begin of the latest candle.
+    """
+
+    if connection.vendor != 'postgresql' or interval not in MONTHLY_INTERVALS:
+        return
+
+    quote = connection.ops.quote_name
+    parent = f'{Candle._meta.db_table}_i{interval}'
+    month = _month_start(timezone.localtime(start).date())
+    last = _month_start(timezone.localtime(end).date())
+
+    with connection.cursor() as cursor:
+        while month <= last:
+            name = get_partition_name(interval, month)
+            if name not in _partitions:
+                cursor.execute(
+                    f'CREATE TABLE IF NOT EXISTS {quote(name)} PARTITION OF {quote(parent)} '
+                    f'FOR VALUES FROM (%s) TO (%s)',
+                    [timezone.make_aware(datetime.combine(month, datetime.min.time())),
+                     timezone.make_aware(datetime.combine(_next_month(month), datetime.min.time()))],
+                )
+                transaction.on_commit(lambda name=name: _partitions.add(name))
+            month = _next_month(month)
+
+
+def drop_candle_partitions(interval: int, before: date) -> int:
+    """
+    Removes the candles of the interval that began before the month of the given date.
+    On PostgreSQL whole monthly partitions are dropped, on other databases the rows are deleted.
+
+    Parameters:
+        interval (int): The candle interval.
+        before (date): The candles of the earlier months are removed.
+
+    Returns:
+        int: The number of dropped partitions or deleted rows.
+    """
+
+    before = _month_start(before)
+
+    if connection.vendor != 'postgresql' or interval not in MONTHLY_INTERVALS:
+        boundary = timezone.make_aware(datetime.combine(before, datetime.min.time()))
+        deleted, _ = Candle.objects.filter(interval=interval, begin__lt=boundary).delete()
+        return deleted
+
+    parent = f'{Candle._meta.db_table}_i{interval}'
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT child.relname FROM pg_inherits '
+            'JOIN pg_class parent ON parent.oid = pg_inherits.inhparent '
+            'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+            'WHERE parent.relname = %s',
+            [parent],
+        )
+        expired = [name for name, in cursor.fetchall() if name < get_partition_name(interval, before)]
+        for name in expired:
+            cursor.execute(f'DROP TABLE {connection.ops.quote_name(name)}')
+            _partitions.discard(name)
+
+    return len(expired)
+
+
+def get_last_candle_begin(ticker: str, interval: int) -> datetime | None:
+    """Returns the begin of the latest stored candle of the ticker for the interval."""
+
+    return (Candle.objects
+            .filter(ticker=ticker, interval=interval)
+            .order_by('-begin')
+            .values_list('begin', flat=True)
+            .first())
+
+
+def fetch_candles(ticker: str, interval: int, start: date, till: date, page_size: int) -> Iterator[Candle]:
+    """
+    Fetches the candles of the ticker from the market page by page.
+
+    Parameters:
+        ticker (str): The ticker of the stock.
+        interval (int): The candle interval.
+        start (date): The first day to fetch.
+        till (date): The last day to fetch.
+        page_size (int): The maximum number of candles requested at once.
+
+    Yields:
+        Candle: The unsaved Candle instances.
+    """
+
+    share = Share(ticker)
+    while True:
+        page = list(share.candles(date=start, till_date=till, period=MOEXALGO_PERIODS[interval], limit=page_size))
+        for candle in page:
+            yield Candle(
+                ticker=ticker,
+                interval=interval,
+                begin=timezone.make_aware(candle.begin),
+                open=candle.open,
+                high=candle.high,
+                low=candle.low,
+                close=candle.close,
+                value=candle.value,
+                volume=candle.volume,
+            )
+
+        if len(page) < page_size:
+            return
+        # The last day may be incomplete, so it is requested again; the writes are idempotent.
+        next_start = page[-1].begin.date()
+        if next_start <= start:
+            return
+        start = next_start
+
+
+def write_candles(candles: Iterable[Candle]) -> int:
+    """
+    Writes the candles, the already stored candles are updated in place.
+
+    Parameters:
+        candles (Iterable[Candle]): The unsaved Candle instances of any tickers and intervals.
+
+    Returns:
+        int: The number of written candles.
+    """
+
+    # The pages of the market overlap, and a row cannot be upserted twice by one query.
+    candles = list({(candle.ticker, candle.interval, candle.begin): candle for candle in candles}.values())
+    if not candles:
+        return 0
+
+    by_interval: dict[int, list[datetime]] = {}
+    for candle in candles:
+        by_interval.setdefault(candle.interval, []).append(candle.begin)
+
+    with transaction.atomic():
+        for interval, moments in by_interval.items():
+            ensure_candle_partitions(interval, min(moments), max(moments))
+        Candle.objects.bulk_create(
+            candles,
+            update_conflicts=True,
+            unique_fields=['ticker', 'interval', 'begin'],
+            update_fields=CANDLE_UPDATE_FIELDS,
+        )
+
+    return len(candles)
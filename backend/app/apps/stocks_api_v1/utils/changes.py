@@ -0,0 +1,188 @@
+import base64
+import binascii
+import json
+import logging
+
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q, QuerySet
+from django.utils import timezone
+
+from ..models import Stock, StockTombstone
+
+logger = logging.getLogger('stocks')
+
+# The cache key of the start time of the write of the stock loader in progress (see writing_stocks)
+WRITING_CACHE_KEY = 'stocks:changes:writing'
+
+# The position of a client in the stocks or the tombstones: the time and the ticker of the last row it has received
+Cursor = tuple[datetime | None, str]
+
+START: Cursor = (None, '')
+
+
+class InvalidToken(ValueError):
+    """
+    The token of the changes feed is malformed.
+    """
+
+
+@dataclass
+class StockChanges:
+    """
+    A page of the changes feed.
+    """
+
+    stocks: list[Stock]
+    removed: list[str]
+    token: str
+    has_more: bool
+
+
+def encode_token(stocks_cursor: Cursor, tombstones_cursor: Cursor) -> str:
+    """Returns the opaque token of the positions of a client in the stocks and in the tombstones."""
+
+    values = [
+        moment.isoformat() if moment is not None else None
+        for moment in (stocks_cursor[0], tombstones_cursor[0])
+    ] + [stocks_cursor[1], tombstones_cursor[1]]
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_token(token: str | None) -> tuple[Cursor, Cursor]:
+    """
+    Returns the positions of the token in the stocks and in the tombstones, the empty token is the start of the feed.
+
+    Raises:
+        InvalidToken: If the token is malformed.
+    """
+
+    if not token:
+        return START, START
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        stocks_moment, tombstones_moment, stocks_ticker, tombstones_ticker = values
+        moments = [
+            datetime.fromisoformat(moment) if moment is not None else None
+            for moment in (stocks_moment, tombstones_moment)
+        ]
+        if not isinstance(stocks_ticker, str) or not isinstance(tombstones_ticker, str):
+            raise TypeError(values)
+        if any(moment is not None and moment.tzinfo is None for moment in moments):
+            raise ValueError(values)
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError) as error:
+        raise InvalidToken(token) from error
+    return (moments[0], stocks_ticker), (moments[1], tombstones_ticker)
+
+
+@contextmanager
+def writing_stocks():
+    """
+    Marks the write of the stock loader in progress until it has committed, so the changes feed does not
+    move the tokens past its start: the rows of a long transaction are stamped with the time of its start
+    and would be skipped otherwise. The loaders are serialized by the single-flight lock, so one mark is enough.
+    The mark expires after settings.STOCKS_CHANGES_WRITE_TIMEOUT seconds should the worker die.
+    If the cache fails, only settings.STOCKS_CHANGES_LAG protects the running write.
+    """
+
+    try:
+        cache.set(WRITING_CACHE_KEY, timezone.now(), timeout=settings.STOCKS_CHANGES_WRITE_TIMEOUT)
+    except Exception as error:
+        logger.warning(f'Failed to mark the stocks write in the cache: {error}')
+    try:
+        yield
+    finally:
+        try:
+            cache.delete(WRITING_CACHE_KEY)
+        except Exception as error:
+            logger.warning(f'Failed to clear the mark of the stocks write in the cache: {error}')
+
+
+def get_horizon() -> datetime:
+    """
+    Returns the time up to which the rows of the changes feed are final: settings.STOCKS_CHANGES_LAG seconds ago,
+    or before the start of the write of the stock loader in progress.
+    """
+
+    moment = timezone.now()
+    try:
+        writing = cache.get(WRITING_CACHE_KEY)
+    except Exception as error:
+        logger.warning(f'Failed to read the mark of the stocks write from the cache: {error}')
+        writing = None
+    if writing is not None:
+        moment = min(moment, writing)
+    return moment - timedelta(seconds=settings.STOCKS_CHANGES_LAG)
+
+
+def _after(queryset: QuerySet, field: str, cursor: Cursor) -> QuerySet:
+    """Returns the rows that follow the cursor in the order of the field and the ticker."""
+
+    moment, ticker = cursor
+    if moment is None:
+        return queryset
+    return queryset.filter(Q(**{f'{field}__gt': moment}) | Q(**{field: moment, 'ticker__gt': ticker}))
+
+
+def _advance(cursor: Cursor, horizon: datetime) -> Cursor:
+    """Returns the cursor moved to the horizon, unless it points at a row of that very time."""
+
+    if cursor[0] is not None and cursor[0] >= horizon:
+        return cursor
+    return horizon, ''
+
+
+def get_changes(stocks_cursor: Cursor, tombstones_cursor: Cursor, limit: int) -> StockChanges:
+    """
+    Returns the stocks inserted or changed and the tickers removed after the positions of a client,
+    at most the limit of each, with the token of the next page. Both are read with an index range scan.
+
+    The rows written after the horizon (see get_horizon) are left for the next page: a row stamped
+    with its time before a concurrent transaction commits would otherwise be skipped by the token
+    that has already moved past it. The lag covers the clock skew between the servers
+    and the writes made outside of the stock loader, e.g. in the admin.
+
+    Parameters:
+        stocks_cursor (Cursor): The position of the client in the stocks.
+        tombstones_cursor (Cursor): The position of the client in the tombstones.
+        limit (int): The maximum number of the stocks and of the removed tickers.
+
+    Returns:
+        StockChanges: The page of the changes.
+    """
+
+    horizon = get_horizon()
+    stocks = list(
+        _after(Stock.objects.filter(updated__lte=horizon), 'updated', stocks_cursor)
+        .order_by('updated', 'ticker')[:limit + 1]
+    )
+    # The tickers that have been listed again after the removal are among the changed stocks.
+    tombstones = list(
+        _after(StockTombstone.objects.filter(removed__lte=horizon), 'removed', tombstones_cursor)
+        .exclude(ticker__in=Stock.objects.values('ticker'))
+        .order_by('removed', 'ticker')[:limit + 1]
+    )
+    stocks_exhausted, tombstones_exhausted = len(stocks) <= limit, len(tombstones) <= limit
+    stocks, tombstones = stocks[:limit], tombstones[:limit]
+
+    if stocks:
+        stocks_cursor = (stocks[-1].updated, stocks[-1].ticker)
+    if tombstones:
+        tombstones_cursor = (tombstones[-1].removed, tombstones[-1].ticker)
+    # The rows up to the horizon have all been read, so the next page starts at the horizon.
+    # It keeps the scans short when nothing changes for a long time.
+    if stocks_exhausted:
+        stocks_cursor = _advance(stocks_cursor, horizon)
+    if tombstones_exhausted:
+        tombstones_cursor = _advance(tombstones_cursor, horizon)
+
+    return StockChanges(
+        stocks=stocks,
+        removed=[tombstone.ticker for tombstone in tombstones],
+        token=encode_token(stocks_cursor, tombstones_cursor),
+        has_more=not (stocks_exhausted and tombstones_exhausted),
+    )
@@ -0,0 +1,183 @@
+from decimal import ROUND_HALF_UP, Decimal
+
+import pandas as pd
+
+from django.core.exceptions import ValidationError
+from django.db import connection, models, transaction
+
+from ..models import Stock, StockTombstone
+from .ingestion import STOCK_FIELD_MAP, IngestionReport, StageTimer
+from .markets import SHARES_MARKET
+from .transliteration import SEARCH_FIELDS, build_search_document
+
+STAGING_TABLE = 'stocks_api_v1_stock_staging'
+COPY_NULL = r'\N'
+COPY_CHUNK_SIZE = 10000
+
+
+def normalize_frame(stocks: list[dict], fingerprints: dict[str, str], board: str = SHARES_MARKET) -> pd.DataFrame:
+    """
+    Converts the market payload into a DataFrame whose columns match the Stock table.
+
+    All the values are coerced column-wise as the ORM would save them: decimals are converted to Decimal
+    with the precision of the field and rounded to its scale, dates are formatted in ISO format
+    and unknown choices become nulls.
+
+    Parameters:
+        stocks (list[dict]): The stocks as returned by the market API.
+        fingerprints (dict[str, str]): The content fingerprints of the stocks keyed by ticker.
+        board (str): The market or the board the stocks have been loaded from.
+
+    Returns:
+        pd.DataFrame: The frame with a column per Stock field plus the board, the fingerprint and the search document.
+
+    Raises:
+        ValidationError: If a value cannot be converted to the type of its field.
+    """
+
+    source = pd.DataFrame.from_records(stocks)
+    frame = pd.DataFrame(index=source.index)
+
+    for field_name, key in STOCK_FIELD_MAP.items():
+        field = Stock._meta.get_field(field_name)
+        column = source[key] if key in source else pd.Series(None, index=source.index, dtype=object)
+        frame[field.column] = _coerce_column(field, column, source[STOCK_FIELD_MAP['ticker']])
+
+    frame['board'] = board
+    frame['fingerprint'] = frame['ticker'].map(fingerprints)
+    documents = frame[list(SEARCH_FIELDS)]
+    documents = documents.astype(object).where(documents.notna(), None)
+    frame['search_document'] = [build_search_document(values) for values in documents.to_dict('records')]
+    return frame.drop_duplicates(subset='ticker', keep='last')
+
+
+def _coerce_decimal(field: models.DecimalField, value) -> Decimal | None:
+    """
+    Returns the value as the ORM saves it: a Decimal with the precision of the field rounded to its scale.
+    None if the value is missing or cannot be converted.
+    """
+
+    if pd.isna(value):
+        return None
+    try:
+        value = field.to_python(value)
+    except ValidationError:
+        return None
+    return value.quantize(Decimal(1).scaleb(-field.decimal_places), rounding=ROUND_HALF_UP)
+
+
+def _coerce_column(field: models.Field, column: pd.Series, tickers: pd.Series) -> pd.Series:
+    """
+    Coerces the values of the column to the type of the model field.
+
+    Parameters:
+        field (models.Field): The Stock model field.
+        column (pd.Series): The raw values from the market payload.
+        tickers (pd.Series): The tickers of the rows, for the error messages.
+
+    Returns:
+        pd.Series: The coerced values, nulls are represented by NA.
+
+    Raises:
+        ValidationError: If a value cannot be converted to the type of the field.
+    """
+
+    if isinstance(field, models.DecimalField):
+        # The floats are not rounded through float64, which would store other digits than the ORM does.
+        coerced = column.map(lambda value: _coerce_decimal(field, value)).astype(object)
+    elif isinstance(field, models.IntegerField):
+        coerced = pd.to_numeric(column, errors='coerce').round().astype('Int64')
+    elif isinstance(field, models.DateField):
+        coerced = pd.to_datetime(column, errors='coerce', format='mixed').dt.strftime('%Y-%m-%d')
+    else:
+        coerced = column.astype('string')
+
+    # The values that could not be converted fail the load as they do in the ORM path, instead of becoming nulls.
+    invalid = column.notna() & coerced.isna()
+    if invalid.any():
+        rows = ', '.join(f'{ticker}={value!r}' for ticker, value in zip(tickers[invalid], column[invalid]))
+        raise ValidationError(f'Invalid {field.name} values: {rows}')
+
+    if field.choices:
+        coerced = coerced.where(coerced.isin([value for value, _ in field.choices]))
+
+    return coerced
+
+
+def copy_stocks(stocks: list[dict], fingerprints: dict[str, str], board: str = SHARES_MARKET,
+                remove_missing: bool = True, timer: StageTimer | None = None) -> IngestionReport:
+    """
+    Streams the stocks into a staging table with COPY and merges them into the Stock table
+    with a single INSERT ... ON CONFLICT query. Rows with an unchanged fingerprint and board are not updated.
+    The stored stocks of the board missing from the payload are deleted and their tombstones are recorded
+    in the same transaction, as the signals of the ORM path do, unless none of them has been received.
+
+    Only PostgreSQL is supported.
+
+    Parameters:
+        stocks (list[dict]): The stocks as returned by the market API.
+        fingerprints (dict[str, str]): The content fingerprints of the stocks keyed by ticker.
+        board (str): The market or the board the stocks have been loaded from.
+        remove_missing (bool): Whether to remove the stored stocks of the board missing from the payload.
+        timer (StageTimer | None): Measures the 'parse' and the 'write' stages.
+
+    Returns:
+        IngestionReport: The counters of the run.
+    """
+
+    timer = timer or StageTimer()
+    with timer.measure('parse'):
+        frame = normalize_frame(stocks, fingerprints, board)
+    table = connection.ops.quote_name(Stock._meta.db_table)
+    tombstones = connection.ops.quote_name(StockTombstone._meta.db_table)
+    staging = connection.ops.quote_name(STAGING_TABLE)
+    columns = ', '.join(connection.ops.quote_name(column) for column in frame.columns)
+    updates = ', '.join(
+        f'{name} = EXCLUDED.{name}'
+        for name in (connection.ops.quote_name(column) for column in [*frame.columns[1:], 'updated'])
+    )
+
+    with timer.measure('write'), transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE TEMPORARY TABLE {staging} ON COMMIT DROP AS SELECT {columns} FROM {table} WITH NO DATA'
+        )
+
+        with cursor.copy(f"COPY {staging} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')") as copy:
+            for start in range(0, len(frame), COPY_CHUNK_SIZE):
+                chunk = frame.iloc[start:start + COPY_CHUNK_SIZE]
+                copy.write(chunk.to_csv(index=False, header=False, na_rep=COPY_NULL))
+
+        if remove_missing:
+            # A payload without any of the stored stocks of the board is rather a failure of the market API
+            cursor.execute(
+                f'SELECT EXISTS (SELECT 1 FROM {table} JOIN {staging} USING ("ticker") WHERE {table}."board" = %s)',
+                [board],
+            )
+            remove_missing = cursor.fetchone()[0]
+
+        cursor.execute(
+            f'INSERT INTO {table} ({columns}, "updated") '
+            f'SELECT {columns}, now() FROM {staging} '
+            f'ON CONFLICT ("ticker") DO UPDATE SET {updates} '
+            f'WHERE ({table}."fingerprint", {table}."board") '
+            f'IS DISTINCT FROM (EXCLUDED."fingerprint", EXCLUDED."board") '
+            f'RETURNING "ticker", (xmax = 0)'
+        )
+        inserted = dict(cursor.fetchall())
+
+        removed = 0
+        if remove_missing:
+            cursor.execute(
+                f'WITH "removed" AS (DELETE FROM {table} WHERE {table}."board" = %s AND NOT EXISTS '
+                f'(SELECT 1 FROM {staging} WHERE {staging}."ticker" = {table}."ticker") RETURNING "ticker") '
+                f'INSERT INTO {tombstones} ("ticker", "removed") SELECT "ticker", now() FROM "removed" '
+                f'ON CONFLICT ("ticker") DO UPDATE SET "removed" = EXCLUDED."removed"',
+                [board],
+            )
+            removed = cursor.rowcount
+
+    report = IngestionReport(mode='copy', removed=removed, written_tickers=set(inserted))
+    report.inserted = sum(inserted.values())
+    report.changed = len(inserted) - report.inserted
+    report.unchanged = len(frame) - len(inserted)
+    return timer.apply(report)
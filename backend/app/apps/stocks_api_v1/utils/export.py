@@ -0,0 +1,148 @@
+import csv
+import io
+import json
+import zlib
+
+from collections.abc import Iterable, Iterator
+
+from django.db import models
+
+from .encoding import build_row_encoder
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+EXPORT_CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+def get_export_formats() -> list[str]:
+    """Returns the available export formats, Parquet needs the optional pyarrow package."""
+
+    return [name for name in EXPORT_CONTENT_TYPES if name != 'parquet' or pyarrow is not None]
+
+
+def iter_export(queryset: models.QuerySet, serializer_fields: dict, export_format: str,
+                chunk_size: int, compress: bool = False) -> Iterator[bytes]:
+    """
+    Streams the rows of the queryset in the export format.
+
+    The rows are read with QuerySet.iterator(), so the memory used does not depend on the number
+    of rows. CSV and NDJSON contain the same values as the API, Parquet keeps the database types.
+
+    Parameters:
+        queryset (QuerySet): The rows to export.
+        serializer_fields (dict): The serializer fields to export keyed by name, in the output order.
+        export_format (str): One of get_export_formats().
+        chunk_size (int): The number of rows fetched from the database and encoded at once.
+        compress (bool): Whether to gzip the output.
+
+    Returns:
+        Iterator[bytes]: The chunks of the output.
+    """
+
+    columns = list(serializer_fields)
+    rows = queryset.values_list(*columns).iterator(chunk_size=chunk_size)
+
+    if export_format == 'parquet':
+        chunks = _iter_parquet(queryset.model, columns, rows, chunk_size)
+    else:
+        encoder = build_row_encoder(serializer_fields, columns)
+        encode = _iter_csv if export_format == 'csv' else _iter_ndjson
+        chunks = encode(columns, (encoder(row) for row in rows), chunk_size)
+
+    return _iter_gzip(chunks) if compress else chunks
+
+
+def _iter_batches(items: Iterable, size: int) -> Iterator[list]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _iter_csv(columns: list[str], records: Iterable[dict], chunk_size: int) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns)
+    writer.writeheader()
+    for batch in _iter_batches(records, chunk_size):
+        writer.writerows(batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def _iter_ndjson(columns: list[str], records: Iterable[dict], chunk_size: int) -> Iterator[bytes]:
+    dumps = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+    for batch in _iter_batches(records, chunk_size):
+        yield ''.join(f'{dumps(record)}\n' for record in batch).encode()
+
+
+def _iter_gzip(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        if data := compressor.compress(chunk):
+            yield data
+    yield compressor.flush()
+
+
+class _ParquetSink(io.RawIOBase):
+    """The file object that keeps the bytes written by the Parquet writer until they are streamed."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _get_arrow_type(field: models.Field):
+    if isinstance(field, models.DecimalField):
+        return pyarrow.decimal128(field.max_digits, field.decimal_places)
+    if isinstance(field, models.IntegerField):
+        return pyarrow.int64()
+    if isinstance(field, models.DateTimeField):
+        return pyarrow.timestamp('us', tz='UTC')
+    if isinstance(field, models.DateField):
+        return pyarrow.date32()
+    return pyarrow.string()
+
+
+def _iter_parquet(model: type[models.Model], columns: list[str], rows: Iterable[tuple],
+                  chunk_size: int) -> Iterator[bytes]:
+    """Writes a row group per chunk of rows and streams the file as the row groups are written."""
+
+    schema = pyarrow.schema([(name, _get_arrow_type(model._meta.get_field(name))) for name in columns])
+    sink = _ParquetSink()
+    with pyarrow.parquet.ParquetWriter(sink, schema) as writer:
+        for batch in _iter_batches(rows, chunk_size):
+            arrays = [pyarrow.array(values, type=field.type) for values, field in zip(zip(*batch), schema)]
+            writer.write_batch(pyarrow.record_batch(arrays, schema=schema))
+            yield sink.drain()
+    yield sink.drain()
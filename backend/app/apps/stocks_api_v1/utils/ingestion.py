@@ -0,0 +1,188 @@
+import hashlib
+import tracemalloc
+
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict, field
+from time import perf_counter
+
+from django.core.cache import cache
+
+from ..models import Stock
+
+SNAPSHOT_CACHE_KEY = 'stocks:snapshot'
+
+# Mapping of the Stock model fields to the keys of the market payload.
+STOCK_FIELD_MAP = {
+    'ticker': 'SECID',
+    'shortname': 'SHORTNAME',
+    'secname': 'SECNAME',
+    'latname': 'LATNAME',
+    'prevprice': 'PREVPRICE',
+    'lotsize': 'LOTSIZE',
+    'facevalue': 'FACEVALUE',
+    'faceunit': 'FACEUNIT',
+    'status': 'STATUS',
+    'decimals': 'DECIMALS',
+    'minstep': 'MINSTEP',
+    'prevdate': 'PREVDATE',
+    'issuesize': 'ISSUESIZE',
+    'isin': 'ISIN',
+    'regnumber': 'REGNUMBER',
+    'prevlegalcloseprice': 'PREVLEGALCLOSEPRICE',
+    'currencyid': 'CURRENCYID',
+    'sectype': 'SECTYPE',
+    'listlevel': 'LISTLEVEL',
+    'settledate': 'SETTLEDATE',
+}
+
+UPDATE_FIELDS = [field for field in STOCK_FIELD_MAP if field != 'ticker'] + [
+    'board', 'fingerprint', 'search_document', 'updated',
+]
+
+
+@dataclass
+class IngestionReport:
+    """
+    The result of a single stock ingestion run.
+    """
+
+    mode: str
+    inserted: int = 0
+    changed: int = 0
+    unchanged: int = 0
+    removed: int = 0
+    skipped: bool = False
+    # The tickers of the inserted and the changed rows, only their changes are pushed to the stream
+    written_tickers: set[str] = field(default_factory=set, repr=False)
+    # The seconds spent in the stages of the run and their peak traced memory in bytes (see StageTimer)
+    stages: dict[str, float] = field(default_factory=dict)
+    peak_memory: dict[str, int] = field(default_factory=dict)
+
+    @property
+    def written(self) -> int:
+        """The number of rows sent to the database."""
+
+        return self.inserted + self.changed
+
+    def as_dict(self) -> dict:
+        values = asdict(self)
+        del values['written_tickers']
+        return values
+
+
+class StageTimer:
+    """
+    Accumulates the time spent in the stages of an ingestion run, e.g. 'parse' and 'write'.
+
+    If tracemalloc is tracing, the peak memory allocated during each stage is kept as well.
+    """
+
+    def __init__(self):
+        self.seconds: dict[str, float] = {}
+        self.peak_memory: dict[str, int] = {}
+
+    @contextmanager
+    def measure(self, stage: str):
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[stage] = self.seconds.get(stage, 0) + perf_counter() - start
+            if tracing:
+                self.peak_memory[stage] = max(self.peak_memory.get(stage, 0), tracemalloc.get_traced_memory()[1])
+
+    def apply(self, report: IngestionReport) -> IngestionReport:
+        """Adds the measured stages to the report."""
+
+        report.stages.update(self.seconds)
+        report.peak_memory.update(self.peak_memory)
+        return report
+
+
+@contextmanager
+def trace_memory(enabled: bool = True):
+    """
+    Traces the memory allocations with tracemalloc inside the block, so StageTimer keeps the peak memory
+    of the stages. Tracing slows the allocations down, so it is only used when enabled.
+    """
+
+    started = enabled and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    try:
+        yield
+    finally:
+        if started:
+            tracemalloc.stop()
+
+
+def get_fingerprint(stock: dict) -> str:
+    """
+    Calculates the content fingerprint of a stock received from the market.
+
+    Parameters:
+        stock (dict): The stock data as returned by the market API.
+
+    Returns:
+        str: The hex digest of the values of all the mapped fields.
+    """
+
+    payload = '\x1f'.join(repr(stock.get(key)) for key in STOCK_FIELD_MAP.values())
+    return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+
+def get_snapshot_digest(fingerprints: dict[str, str]) -> str:
+    """
+    Calculates the digest of the whole market snapshot.
+
+    Parameters:
+        fingerprints (dict[str, str]): The fingerprints of the stocks keyed by ticker.
+
+    Returns:
+        str: The hex digest that does not depend on the order of the stocks.
+    """
+
+    digest = hashlib.blake2b(digest_size=16)
+    for ticker in sorted(fingerprints):
+        digest.update(f'{ticker}\x1e{fingerprints[ticker]}\x1d'.encode())
+    return digest.hexdigest()
+
+
+def get_previous_snapshot(key: str = SNAPSHOT_CACHE_KEY) -> dict | None:
+    """Returns the digest and the report counters of the last applied snapshot, if any."""
+
+    return cache.get(key)
+
+
+def set_previous_snapshot(digest: str, report: IngestionReport, key: str = SNAPSHOT_CACHE_KEY) -> None:
+    """Remembers the digest of the snapshot that has just been applied to the database."""
+
+    cache.set(key, {'digest': digest, 'removed': report.removed}, timeout=None)
+
+
+def clean_stock(stock: dict) -> dict:
+    """
+    Makes the market data of any board fit the Stock table: the values that are not among
+    the choices of the field become None and the too long strings are truncated.
+
+    Parameters:
+        stock (dict): The stock data as returned by the market API.
+
+    Returns:
+        dict: The cleaned copy of the stock data.
+    """
+
+    stock = dict(stock)
+    for field_name, key in STOCK_FIELD_MAP.items():
+        value = stock.get(key)
+        if value is None:
+            continue
+        field = Stock._meta.get_field(field_name)
+        if field.choices and value not in {choice for choice, _ in field.choices}:
+            stock[key] = None
+        elif field.max_length and isinstance(value, str) and len(value) > field.max_length and not field.primary_key:
+            stock[key] = value[:field.max_length]
+    return stock
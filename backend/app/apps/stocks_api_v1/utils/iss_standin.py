@@ -0,0 +1,212 @@
+import json
+import random
+import time
+
+from datetime import date, datetime
+from pathlib import Path
+
+import anyio
+import httpx
+
+from django.conf import settings
+from moexalgo.session import Session
+
+from .synthetic import generate_stocks
+
+# The ISS metadata types of the values of the synthetic responses.
+ISS_TYPES = ((int, 'int64'), (float, 'double'), (datetime, 'datetime'), (date, 'date'))
+
+# The number of the stocks in a synthetic board when no fixture is recorded and no scale is given.
+SYNTHETIC_BOARD_SIZE = 250
+
+
+def get_fixture_path(fixtures_dir: str | Path, path: str) -> Path:
+    """
+    Returns the fixture file of the path of an ISS request,
+    e.g. engines/stock/markets/shares/boards/TQBR/securities.json under the fixtures directory.
+    """
+
+    if '/iss/' in path:
+        path = path.split('/iss/', 1)[1]
+    return Path(fixtures_dir) / path.strip('/')
+
+
+def build_section(rows: list[dict]) -> dict:
+    """Builds an ISS data section with the metadata from the dicts of typed values."""
+
+    columns = list(rows[0]) if rows else []
+    metadata = {}
+    for column in columns:
+        value = next((row[column] for row in rows if row[column] is not None), None)
+        iss_type = next((name for type_, name in ISS_TYPES if isinstance(value, type_)), 'string')
+        metadata[column] = {'type': iss_type}
+
+    def encode(value):
+        return value.isoformat() if isinstance(value, (date, datetime)) else value
+
+    return {
+        'metadata': metadata,
+        'columns': columns,
+        'data': [[encode(row[column]) for column in columns] for row in rows],
+    }
+
+
+def build_securities_response(stocks: list[dict]) -> dict:
+    """
+    Builds the response of the securities of a board in the format of ISS,
+    with the `securities` and a minimal `marketdata` sections.
+    """
+
+    marketdata = [{'SECID': stock['SECID'], 'BOARDID': stock.get('BOARDID'), 'LAST': stock.get('PREVPRICE')}
+                  for stock in stocks]
+    return {'securities': build_section(stocks), 'marketdata': build_section(marketdata)}
+
+
+def build_columns_response(securities_response: dict) -> dict:
+    """Builds the description of the columns of the securities response."""
+
+    return {
+        section: build_section([
+            {'id': number, 'name': name, 'type': metadata['type']}
+            for number, (name, metadata) in enumerate(data['metadata'].items(), start=1)
+        ])
+        for section, data in securities_response.items()
+    }
+
+
+def scale_response(data: dict, count: int) -> dict:
+    """
+    Resizes every section with the SECID column to the count of rows. The missing rows are
+    the copies of the recorded ones whose SECID is suffixed with the number of the copy.
+    """
+
+    scaled = {}
+    for name, section in data.items():
+        columns = section.get('columns', [])
+        rows = section.get('data', [])
+        if 'SECID' not in columns or not rows:
+            scaled[name] = section
+            continue
+
+        secid = columns.index('SECID')
+        result = rows[:count]
+        copy = 0
+        while len(result) < count:
+            copy += 1
+            for row in rows[:count - len(result)]:
+                row = list(row)
+                row[secid] = f'{row[secid]}-{copy}'
+                result.append(row)
+        scaled[name] = {**section, 'data': result}
+    return scaled
+
+
+class RecordingTransport(httpx.HTTPTransport):
+    """
+    Sends the requests to ISS and saves the successful JSON responses as fixtures for ReplayTransport.
+    """
+
+    def __init__(self, fixtures_dir: str | Path, **kwargs):
+        super().__init__(**kwargs)
+        self.fixtures_dir = Path(fixtures_dir)
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        response = super().handle_request(request)
+        response.read()
+        if response.is_success and response.headers.get('content-type', '').startswith('application/json'):
+            path = get_fixture_path(self.fixtures_dir, request.url.path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(response.content)
+        return response
+
+
+class ReplayTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """
+    Serves the ISS requests from the recorded fixtures without the network.
+
+    The securities of a board without a fixture are generated. The responses can be delayed,
+    fail at random with 503 Service Unavailable, and be scaled to any number of securities.
+    Works with both the sync and the async httpx clients.
+    """
+
+    def __init__(self, fixtures_dir: str | Path | None = None, latency: float = 0, error_rate: float = 0,
+                 scale: int | None = None, seed: int | None = None):
+        self.fixtures_dir = fixtures_dir
+        self.latency = latency
+        self.error_rate = error_rate
+        self.scale = scale
+        self.random = random.Random(seed)
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        if self.latency:
+            time.sleep(self.latency)
+        return self._respond(request)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if self.latency:
+            await anyio.sleep(self.latency)
+        return self._respond(request)
+
+    def _respond(self, request: httpx.Request) -> httpx.Response:
+        if self.error_rate and self.random.random() < self.error_rate:
+            return httpx.Response(503, text='Service Unavailable', request=request)
+
+        data = self._load(request.url)
+        if data is None:
+            return httpx.Response(404, text='Not Found', request=request)
+        return httpx.Response(200, json=data, request=request)
+
+    def _load(self, url: httpx.URL) -> dict | None:
+        path = url.path
+        columns = path.endswith('/securities/columns.json')
+        if columns and (data := self._read_fixture(path)) is not None:
+            return data
+
+        securities_path = path.removesuffix('/columns.json') + '.json' if columns else path
+        if not securities_path.endswith('/securities.json'):
+            return self._read_fixture(path)
+
+        data = self._read_fixture(securities_path)
+        if data is None:
+            board = securities_path.split('/')[-2]
+            data = build_securities_response(
+                generate_stocks(self.scale or SYNTHETIC_BOARD_SIZE, prefix=board)
+            )
+        elif self.scale:
+            data = scale_response(data, self.scale)
+
+        return build_columns_response(data) if columns else data
+
+    def _read_fixture(self, path: str) -> dict | None:
+        if self.fixtures_dir is None:
+            return None
+        fixture = get_fixture_path(self.fixtures_dir, path)
+        return json.loads(fixture.read_bytes()) if fixture.exists() else None
+
+
+def get_iss_session(**options) -> Session:
+    """
+    Returns the moexalgo session that uses settings.ISS_BASE_URL and the transport of get_iss_transport().
+    The options (e.g. event_hooks) are passed to the httpx client.
+    """
+
+    options['base_url'] = settings.ISS_BASE_URL.rstrip('/')
+    if (transport := get_iss_transport()) is not None:
+        options['transport'] = transport
+    return Session(**options)
+
+
+def get_iss_transport() -> ReplayTransport | None:
+    """
+    Returns the transport of the ISS clients: the ReplayTransport if settings.ISS_REPLAY is on,
+    otherwise None, which means the network.
+    """
+
+    if not settings.ISS_REPLAY:
+        return None
+    return ReplayTransport(
+        fixtures_dir=settings.ISS_REPLAY_DIR,
+        latency=settings.ISS_REPLAY_LATENCY,
+        error_rate=settings.ISS_REPLAY_ERROR_RATE,
+        scale=settings.ISS_REPLAY_SCALE or None,
+    )
@@ -0,0 +1,214 @@
+import json
+import logging
+import threading
+
+from datetime import date, datetime, time, timedelta
+from pathlib import Path
+from zoneinfo import ZoneInfo
+
+from celery.schedules import BaseSchedule, schedstate
+from django.conf import settings
+from django.utils import timezone as django_timezone
+
+logger = logging.getLogger('stocks')
+
+# The number of the days searched for the next trading day, longer than any exchange holiday
+MAX_CLOSED_DAYS = 31
+
+
+def parse_sessions(value: str) -> list[tuple[time, time]]:
+    """Parses the trading sessions as 'HH:MM-HH:MM' separated by spaces, e.g. '06:50-18:50 19:05-23:50'."""
+
+    sessions = []
+    for session in value.split():
+        start, end = session.split('-')
+        sessions.append((time.fromisoformat(start), time.fromisoformat(end)))
+    return sorted(sessions)
+
+
+class MarketCalendar:
+    """
+    The trading days and sessions of the exchange.
+
+    A day is a trading day if its weekday is one of the trading weekdays and it is not a holiday,
+    or if it is listed among the working days (e.g. a working Saturday). The holidays and the working
+    days are read from the JSON calendar file {"years": [...], "holidays": [...], "working_days": [...]}
+    of ISO dates, the years are the ones whose holidays the file lists (by default the years of the dates).
+    """
+
+    def __init__(self, sessions: list[tuple[time, time]], timezone: str, weekdays: set[int],
+                 holidays: set[date] = frozenset(), working_days: set[date] = frozenset(),
+                 years: set[int] | None = None):
+        self.sessions = sessions
+        self.timezone = ZoneInfo(timezone)
+        self.weekdays = weekdays
+        self.holidays = holidays
+        self.working_days = working_days
+        # The years covered by the calendar, None if the holidays are not known from a calendar
+        self.years = years
+
+    @classmethod
+    def from_file(cls, path: str | Path | None, **kwargs) -> 'MarketCalendar':
+        """Creates the calendar with the holidays and the working days of the calendar file, if any."""
+
+        holidays, working_days, years = set(), set(), None
+        if path:
+            years = set()
+            if Path(path).exists():
+                data = json.loads(Path(path).read_text())
+                holidays = {date.fromisoformat(day) for day in data.get('holidays', [])}
+                working_days = {date.fromisoformat(day) for day in data.get('working_days', [])}
+                years = set(data.get('years', [])) or {day.year for day in holidays | working_days}
+        return cls(holidays=holidays | kwargs.pop('holidays', set()), working_days=working_days, years=years,
+                   **kwargs)
+
+    def covers(self, day: date) -> bool:
+        """Returns whether the holidays of the year of the day are known, always True without a calendar file."""
+
+        return self.years is None or day.year in self.years
+
+    def is_trading_day(self, day: date) -> bool:
+        if day in self.working_days:
+            return True
+        return day.weekday() in self.weekdays and day not in self.holidays
+
+    def in_session(self, moment: datetime) -> bool:
+        moment = moment.astimezone(self.timezone)
+        return self.is_trading_day(moment.date()) and any(
+            start <= moment.time() < end for start, end in self.sessions
+        )
+
+    def _trading_days(self, moment: datetime):
+        """Yields the trading days starting with the day of the moment."""
+
+        day = moment.astimezone(self.timezone).date()
+        for offset in range(MAX_CLOSED_DAYS):
+            if self.is_trading_day(day + timedelta(days=offset)):
+                yield day + timedelta(days=offset)
+
+    def _at(self, day: date, moment: time) -> datetime:
+        return datetime.combine(day, moment, tzinfo=self.timezone)
+
+    def next_session_start(self, moment: datetime) -> datetime | None:
+        """Returns the start of the first session after the moment."""
+
+        for day in self._trading_days(moment):
+            for start, _ in self.sessions:
+                if (start_at := self._at(day, start)) > moment:
+                    return start_at
+        return None
+
+    def next_close(self, moment: datetime) -> datetime | None:
+        """Returns the end of the last session of the first trading day that ends after the moment."""
+
+        if not self.sessions:
+            return None
+        for day in self._trading_days(moment):
+            if (close_at := self._at(day, self.sessions[-1][1])) > moment:
+                return close_at
+        return None
+
+    def get_next_run(self, last_run: datetime, session_interval: timedelta, idle_interval: timedelta,
+                     post_close_delay: timedelta) -> datetime:
+        """
+        Returns the time of the run of the loader that follows the last one.
+
+        The loader runs every session_interval during the sessions, at the start of every session,
+        once post_close_delay after the close of the trading day, and every idle_interval otherwise.
+
+        Parameters:
+            last_run (datetime): The aware time of the last run.
+            session_interval (timedelta): The interval of the runs during the sessions.
+            idle_interval (timedelta): The interval of the runs outside the sessions.
+            post_close_delay (timedelta): The delay of the final run after the close.
+
+        Returns:
+            datetime: The aware time of the next run.
+        """
+
+        candidates = [last_run + idle_interval]
+        if self.in_session(last_run + session_interval):
+            candidates.append(last_run + session_interval)
+        if (session_start := self.next_session_start(last_run)) is not None:
+            candidates.append(session_start)
+        # The close of the day whose post-close run is still ahead
+        if (close_at := self.next_close(last_run - post_close_delay)) is not None:
+            candidates.append(close_at + post_close_delay)
+        return min(candidate for candidate in candidates if candidate > last_run)
+
+
+_calendar_cache = {}
+_calendar_lock = threading.Lock()
+# The calendar files and the years reported as missing from them, so every one is logged once per process
+_reported_years = set()
+
+
+def get_market_calendar() -> MarketCalendar:
+    """
+    Returns the calendar of the settings. It is cached in the process and read again
+    only when the settings or the modification time of the calendar file change.
+    If the calendar file does not cover the current year, the holidays of the year are unknown
+    and are taken for the trading days, which is logged as an error.
+    """
+
+    path = settings.STOCKS_MARKET_CALENDAR_FILE
+    mtime = Path(path).stat().st_mtime if path and Path(path).exists() else None
+    key = (
+        str(path), mtime, settings.STOCKS_MARKET_SESSIONS, settings.STOCKS_MARKET_TIMEZONE,
+        tuple(settings.STOCKS_MARKET_WEEKDAYS), tuple(settings.STOCKS_MARKET_HOLIDAYS),
+    )
+    with _calendar_lock:
+        if key not in _calendar_cache:
+            _calendar_cache.clear()
+            _calendar_cache[key] = MarketCalendar.from_file(
+                path,
+                sessions=parse_sessions(settings.STOCKS_MARKET_SESSIONS),
+                timezone=settings.STOCKS_MARKET_TIMEZONE,
+                weekdays=set(settings.STOCKS_MARKET_WEEKDAYS),
+                holidays={date.fromisoformat(day) for day in settings.STOCKS_MARKET_HOLIDAYS},
+            )
+        calendar = _calendar_cache[key]
+
+        today = django_timezone.now().astimezone(calendar.timezone).date()
+        if not calendar.covers(today) and (str(path), today.year) not in _reported_years:
+            _reported_years.add((str(path), today.year))
+            logger.error(f'The market calendar {path} has no holidays for {today.year}, the holidays are taken '
+                         f'for the trading days. Add the calendar of the exchange for the year to the file.')
+        return calendar
+
+
+class MarketSchedule(BaseSchedule):
+    """
+    The Celery beat schedule that follows the trading sessions of the exchange (see MarketCalendar.get_next_run).
+    The intervals are taken from the settings on every check, so they can be changed without a new schedule.
+    """
+
+    def get_next_run(self, last_run_at: datetime) -> datetime:
+        return get_market_calendar().get_next_run(
+            self.maybe_make_aware(last_run_at),
+            session_interval=timedelta(seconds=settings.STOCKS_SCHEDULE_SESSION_INTERVAL),
+            idle_interval=timedelta(seconds=settings.STOCKS_SCHEDULE_IDLE_INTERVAL),
+            post_close_delay=timedelta(seconds=settings.STOCKS_SCHEDULE_POST_CLOSE_DELAY),
+        )
+
+    def remaining_estimate(self, last_run_at: datetime) -> timedelta:
+        return self.get_next_run(last_run_at) - self.maybe_make_aware(self.now())
+
+    def is_due(self, last_run_at: datetime) -> schedstate:
+        remaining = self.remaining_estimate(last_run_at).total_seconds()
+        if remaining > 0:
+            return schedstate(is_due=False, next=remaining)
+        # The task runs now, so the next check is at the run that follows this one.
+        now = self.maybe_make_aware(self.now())
+        return schedstate(is_due=True, next=max((self.get_next_run(now) - now).total_seconds(), 1))
+
+    def __repr__(self):
+        return '<MarketSchedule: the trading sessions>'
+
+    def __reduce__(self):
+        return self.__class__, (self.nowfun,)
+
+    def __eq__(self, other):
+        if isinstance(other, MarketSchedule):
+            return self.nowfun == other.nowfun
+        return NotImplemented
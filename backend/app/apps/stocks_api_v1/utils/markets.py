@@ -0,0 +1,150 @@
+import logging
+
+from collections.abc import Callable
+from dataclasses import dataclass
+from time import perf_counter
+
+import anyio
+import httpx
+
+from django.conf import settings
+from moexalgo.utils import item_normalizer
+
+from .iss_standin import get_iss_transport
+
+logger = logging.getLogger('stocks')
+
+# The market loaded as a whole by the load_available_stocks task, the board of the stocks it writes
+SHARES_MARKET = 'stock/shares'
+
+
+@dataclass(frozen=True)
+class MarketBoard:
+    """
+    A trading board of the exchange, e.g. stock/shares/TQBR.
+    """
+
+    engine: str
+    market: str
+    board: str
+
+    @classmethod
+    def parse(cls, value: str) -> 'MarketBoard':
+        """Parses the 'engine/market/board' string."""
+
+        engine, market, board = value.strip().split('/')
+        return cls(engine, market, board)
+
+    def __str__(self):
+        return f'{self.engine}/{self.market}/{self.board}'
+
+    @property
+    def path(self) -> str:
+        """The ISS path of the securities of the board."""
+
+        return f'engines/{self.engine}/markets/{self.market}/boards/{self.board}/securities.json'
+
+
+@dataclass
+class BoardResult:
+    """
+    The outcome of loading a single board.
+    """
+
+    board: MarketBoard
+    rows: int = 0
+    payload_bytes: int = 0
+    fetch_seconds: float = 0
+    write_seconds: float = 0
+    result: dict | None = None
+    error: Exception | None = None
+
+
+def parse_securities(data: dict) -> list[dict]:
+    """
+    Converts the `securities` section of an ISS response to the dicts of typed values,
+    the same as Market.tickers() of moexalgo returns.
+
+    Parameters:
+        data (dict): The decoded ISS response with the metadata.
+
+    Returns:
+        list[dict]: The securities keyed by the ISS column names.
+    """
+
+    section = data['securities']
+    metadata, columns = section['metadata'], section['columns']
+    return [item_normalizer(metadata, dict(zip(columns, values))) for values in section['data']]
+
+
+def get_boards() -> list[MarketBoard]:
+    """Returns the boards listed in settings.STOCKS_MARKETS."""
+
+    return [MarketBoard.parse(value) for value in settings.STOCKS_MARKETS]
+
+
+async def fetch_board(client: httpx.AsyncClient, board: MarketBoard) -> tuple[list[dict], int]:
+    """Fetches the securities of the board, returns them and the size of the response."""
+
+    response = await client.get(board.path, params={'iss.only': 'securities', 'iss.meta': 'on'})
+    response.raise_for_status()
+    return parse_securities(response.json()), len(response.content)
+
+
+def load_boards(boards: list[MarketBoard], write: Callable[[MarketBoard, list[dict]], dict],
+                transport: httpx.AsyncBaseTransport | None = None) -> list[BoardResult]:
+    """
+    Fetches the boards concurrently and writes each board as soon as it is received.
+
+    At most settings.STOCKS_MARKETS_CONCURRENCY requests are in flight over a shared
+    connection pool. The writes are run one at a time in a worker thread, so the event loop
+    keeps receiving the other boards while a board is being written.
+    A failed board does not stop the others, its error is kept in the result.
+
+    Parameters:
+        boards (list[MarketBoard]): The boards to load.
+        write (Callable): Writes the securities of a board to the database and returns its counters.
+            It is called in a worker thread.
+        transport (httpx.AsyncBaseTransport | None): The transport of the HTTP client.
+            Defaults to get_iss_transport(), which is the network unless settings.ISS_REPLAY is on.
+
+    Returns:
+        list[BoardResult]: The results in the order of the boards.
+    """
+
+    return anyio.run(_load_boards, boards, write, transport)
+
+
+async def _load_boards(boards, write, transport) -> list[BoardResult]:
+    concurrency = settings.STOCKS_MARKETS_CONCURRENCY
+    results = [BoardResult(board) for board in boards]
+    writer = anyio.CapacityLimiter(1)
+
+    async def load(result: BoardResult, client: httpx.AsyncClient, limiter: anyio.CapacityLimiter):
+        try:
+            async with limiter:
+                start = perf_counter()
+                stocks, result.payload_bytes = await fetch_board(client, result.board)
+                result.fetch_seconds = perf_counter() - start
+            result.rows = len(stocks)
+
+            start = perf_counter()
+            result.result = await anyio.to_thread.run_sync(write, result.board, stocks, limiter=writer)
+            result.write_seconds = perf_counter() - start
+        except Exception as error:
+            logger.error(f'Failed to load the {result.board} board: {error}', exc_info=True)
+            result.error = error
+
+    async with httpx.AsyncClient(
+        base_url=settings.ISS_BASE_URL,
+        timeout=httpx.Timeout(settings.STOCKS_MARKETS_TIMEOUT),
+        limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+        transport=transport or get_iss_transport(),
+        follow_redirects=True,
+    ) as client:
+        limiter = anyio.CapacityLimiter(concurrency)
+        async with anyio.create_task_group() as group:
+            for result in results:
+                group.start_soon(load, result, client, limiter)
+
+    return results
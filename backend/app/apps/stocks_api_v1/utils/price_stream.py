@@ -0,0 +1,384 @@
+"""
+The real-time push of the stock changes to the clients.
+
+The stock loaders publish the stream fields (settings.STOCKS_STREAM_FIELDS) of the loaded stocks
+to the Redis channel of settings.STOCKS_STREAM_REDIS_URL after every run that wrote rows.
+Every ASGI process listens to the channel with a single PriceBroadcaster, which keeps the last known
+values of the stocks, turns the messages into per-ticker diffs and hands them to the subscriptions
+of its clients (the Server-Sent Events view and the WebSocket endpoint).
+
+The broadcaster never waits for a client: a subscription merges the diffs that its client has not
+taken yet into one diff per ticker, so a slow client receives fewer, coalesced updates and cannot
+stall the others or make the memory grow beyond a diff per ticker.
+
+Both streams authenticate and throttle the clients as the API views do (the 'stream' throttle scope
+limits the connection attempts), and a client, a user or an IP address, has at most
+settings.STOCKS_STREAM_MAX_CONNECTIONS open streams in a process.
+"""
+
+import asyncio
+import io
+import json
+import logging
+import math
+import threading
+
+from collections import Counter
+from datetime import date
+from decimal import Decimal
+from types import SimpleNamespace
+from urllib.parse import parse_qs
+
+import redis
+import redis.asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpRequest
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+from ..models import Stock
+from .ingestion import STOCK_FIELD_MAP
+
+logger = logging.getLogger('stocks')
+
+CHANNEL = 'stocks:prices'
+
+
+def normalize_value(value):
+    """Makes the values of the database and of the market comparable and JSON serializable."""
+
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def parse_tickers(values: list[str]) -> set[str] | None:
+    """
+    Returns the requested tickers, given as repeated or comma-separated values, None means all the stocks.
+
+    Raises:
+        ValueError: If more than settings.STOCKS_STREAM_MAX_TICKERS tickers are requested.
+    """
+
+    if isinstance(values, str):
+        values = [values]
+    tickers = {ticker.strip().upper() for value in values for ticker in value.split(',') if ticker.strip()}
+    if len(tickers) > settings.STOCKS_STREAM_MAX_TICKERS:
+        raise ValueError(f'At most {settings.STOCKS_STREAM_MAX_TICKERS} tickers can be subscribed to')
+    return tickers or None
+
+
+# The view of the streams for the throttles of the API
+STREAM_VIEW = SimpleNamespace(throttle_scope='stream')
+
+
+class StreamLimitExceeded(Exception):
+    """
+    The client already has settings.STOCKS_STREAM_MAX_CONNECTIONS open streams in the process.
+    """
+
+
+def check_stream_access(request: HttpRequest) -> tuple[str, float | None]:
+    """
+    Authenticates and throttles the request of a stream with the authentication and the throttle classes
+    of the API. The request is synchronous, it may query the database and the buckets in Redis.
+
+    Parameters:
+        request (HttpRequest): The request of the stream.
+
+    Returns:
+        tuple[str, float | None]: The client ('user:<pk>' or 'ip:<address>') and the seconds
+            to wait before the next attempt if the request is throttled, otherwise None.
+
+    Raises:
+        AuthenticationFailed: If the credentials of the request are invalid.
+    """
+
+    request = Request(request, authenticators=[authenticator() for authenticator in
+                                               api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    waits = []
+    for throttle in (throttle_class() for throttle_class in api_settings.DEFAULT_THROTTLE_CLASSES):
+        if not throttle.allow_request(request, STREAM_VIEW):
+            waits.append(throttle.wait() or 0)
+
+    user = request.user
+    client = f'user:{user.pk}' if user and user.is_authenticated else f'ip:{BaseThrottle().get_ident(request)}'
+    return client, max(waits) if waits else None
+
+
+def get_websocket_request(scope: dict) -> HttpRequest:
+    """Returns the request of the WebSocket handshake with the session and the user of its cookies."""
+
+    request = ASGIRequest({**scope, 'method': 'GET'}, io.BytesIO())
+    SessionMiddleware(lambda request: None).process_request(request)
+    AuthenticationMiddleware(lambda request: None).process_request(request)
+    return request
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def publish_stock_changes(stocks: list[dict]) -> None:
+    """
+    Publishes the stream fields of the stocks received from the market to the clients of all the processes.
+    It never raises, the failed push does not fail the loader.
+
+    Parameters:
+        stocks (list[dict]): The stocks as returned by the market API.
+    """
+
+    message = json.dumps({
+        'stocks': {
+            stock.get('SECID'): {
+                field: normalize_value(stock.get(STOCK_FIELD_MAP[field])) for field in settings.STOCKS_STREAM_FIELDS
+            }
+            for stock in stocks
+        },
+    }, default=str)
+
+    url = settings.STOCKS_STREAM_REDIS_URL
+    if not url:
+        # Without Redis only the clients of this process are notified, e.g. in tests and the development server.
+        get_broadcaster().dispatch(message)
+        return
+
+    with _clients_lock:
+        if url not in _clients:
+            _clients[url] = redis.Redis.from_url(url, socket_timeout=1, socket_connect_timeout=1)
+        client = _clients[url]
+    try:
+        client.publish(CHANNEL, message)
+    except redis.RedisError as error:
+        logger.warning(f'Failed to publish the stock changes: {error}')
+
+
+class Subscription:
+    """
+    The diffs waiting to be sent to a client, at most one per ticker.
+
+    The diffs are pushed from any thread and taken by the coroutine of the client on its event loop.
+    """
+
+    def __init__(self, tickers: set[str] | None, loop: asyncio.AbstractEventLoop, client: str | None = None):
+        self.tickers = tickers
+        self.loop = loop
+        self.client = client
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.event = asyncio.Event()
+
+    def push(self, diffs: dict[str, dict]) -> None:
+        """Merges the diffs of the subscribed tickers into the pending ones and wakes the client up."""
+
+        with self.lock:
+            pushed = False
+            for ticker, values in diffs.items():
+                if self.tickers is None or ticker in self.tickers:
+                    self.pending.setdefault(ticker, {}).update(values)
+                    pushed = True
+        if pushed:
+            self.loop.call_soon_threadsafe(self.event.set)
+
+    def update(self, subscribe: set[str] = frozenset(), unsubscribe: set[str] = frozenset()) -> None:
+        """Changes the subscribed tickers, the diffs of the unsubscribed ones are dropped."""
+
+        with self.lock:
+            if subscribe:
+                self.tickers = (self.tickers or set()) | subscribe
+            if unsubscribe and self.tickers is not None:
+                self.tickers -= unsubscribe
+                for ticker in unsubscribe:
+                    self.pending.pop(ticker, None)
+
+    async def get(self, timeout: float) -> dict[str, dict]:
+        """Returns the pending diffs as soon as there are any, or nothing after the timeout."""
+
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return {}
+        self.event.clear()
+        with self.lock:
+            diffs, self.pending = self.pending, {}
+        return diffs
+
+
+class PriceBroadcaster:
+    """
+    Fans the published stock changes out to the subscriptions of the process.
+    """
+
+    def __init__(self):
+        self.subscriptions = set()
+        # The last known stream values keyed by ticker, loaded from the database by the first subscription
+        self.values = None
+        # The number of the open streams by client
+        self.connections = Counter()
+        self.lock = threading.Lock()
+        self.listener = None
+
+    def can_connect(self, client: str | None) -> bool:
+        """Returns whether the client has fewer than settings.STOCKS_STREAM_MAX_CONNECTIONS open streams."""
+
+        with self.lock:
+            return client is None or self.connections[client] < settings.STOCKS_STREAM_MAX_CONNECTIONS
+
+    async def subscribe(self, tickers: set[str] | None, client: str | None = None) -> Subscription:
+        """
+        Subscribes to the changes of the tickers, None means all the stocks.
+        The current values of the tickers are the first diff of the subscription.
+
+        Raises:
+            StreamLimitExceeded: If the client has settings.STOCKS_STREAM_MAX_CONNECTIONS open streams.
+        """
+
+        if not self.can_connect(client):
+            raise StreamLimitExceeded(f'At most {settings.STOCKS_STREAM_MAX_CONNECTIONS} streams can be open')
+        if self.values is None:
+            values = await sync_to_async(self.load_values)()
+            with self.lock:
+                if self.values is None:
+                    self.values = values
+        self.start_listener()
+
+        subscription = Subscription(tickers, asyncio.get_running_loop(), client)
+        with self.lock:
+            if client is not None and self.connections[client] >= settings.STOCKS_STREAM_MAX_CONNECTIONS:
+                raise StreamLimitExceeded(f'At most {settings.STOCKS_STREAM_MAX_CONNECTIONS} streams can be open')
+            subscription.push(self.values)
+            self.subscriptions.add(subscription)
+            if client is not None:
+                self.connections[client] += 1
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self.lock:
+            if subscription in self.subscriptions and subscription.client is not None:
+                self.connections[subscription.client] -= 1
+                if not self.connections[subscription.client]:
+                    del self.connections[subscription.client]
+            self.subscriptions.discard(subscription)
+
+    @staticmethod
+    def load_values() -> dict[str, dict]:
+        fields = settings.STOCKS_STREAM_FIELDS
+        return {
+            row[0]: {field: normalize_value(value) for field, value in zip(fields, row[1:])}
+            for row in Stock.objects.values_list('ticker', *fields).iterator()
+        }
+
+    def start_listener(self) -> None:
+        """Starts listening to the Redis channel on the running loop unless it is already listened to."""
+
+        if not settings.STOCKS_STREAM_REDIS_URL:
+            return
+        loop = asyncio.get_running_loop()
+        if self.listener is None or self.listener.done() or self.listener.get_loop() is not loop:
+            self.listener = loop.create_task(self.listen(settings.STOCKS_STREAM_REDIS_URL))
+
+    async def listen(self, url: str) -> None:
+        while True:
+            try:
+                client = redis.asyncio.Redis.from_url(url)
+                async with client.pubsub() as pubsub:
+                    await pubsub.subscribe(CHANNEL)
+                    async for message in pubsub.listen():
+                        if message['type'] == 'message':
+                            self.dispatch(message['data'])
+            except redis.RedisError as error:
+                logger.warning(f'The stock changes channel is unavailable: {error}')
+                await asyncio.sleep(settings.STOCKS_STREAM_RECONNECT_DELAY)
+
+    def dispatch(self, message: str | bytes) -> None:
+        """Turns the published message into the diffs of the changed stocks and pushes them to the subscriptions."""
+
+        stocks = json.loads(message)['stocks']
+        with self.lock:
+            if self.values is None:
+                # Nobody has subscribed yet, the values are loaded from the database by the first subscription.
+                return
+            diffs = {}
+            for ticker, values in stocks.items():
+                known = self.values.setdefault(ticker, {})
+                if changed := {field: value for field, value in values.items() if known.get(field, ...) != value}:
+                    known.update(changed)
+                    diffs[ticker] = changed
+            subscriptions = list(self.subscriptions)
+        if diffs:
+            for subscription in subscriptions:
+                subscription.push(diffs)
+
+
+_broadcaster = PriceBroadcaster()
+
+
+def get_broadcaster() -> PriceBroadcaster:
+    return _broadcaster
+
+
+async def stocks_websocket(scope, receive, send) -> None:
+    """
+    The ASGI application of the WebSocket stream of the stock changes.
+
+    The tickers are subscribed to by the 'ticker' query parameters and then by the messages
+    {"subscribe": [...]} and {"unsubscribe": [...]}. Every message to the client is a JSON object
+    of the changed fields keyed by ticker, the first one has the current values of the tickers.
+    The handshake is authenticated and throttled as the API requests (see check_stream_access):
+    it is rejected with 1008 for the invalid credentials or tickers and with 1013 (try again later)
+    if the client is throttled or has too many open streams.
+    """
+
+    if (await receive())['type'] != 'websocket.connect':
+        return
+    try:
+        tickers = parse_tickers(parse_qs(scope.get('query_string', b'').decode()).get('ticker', []))
+        client, wait = await sync_to_async(check_stream_access)(get_websocket_request(scope))
+    except (ValueError, AuthenticationFailed):
+        await send({'type': 'websocket.close', 'code': 1008})
+        return
+
+    broadcaster = get_broadcaster()
+    if wait is not None or not broadcaster.can_connect(client):
+        await send({'type': 'websocket.close', 'code': 1013,
+                    'reason': f'Retry after {math.ceil(wait)}s' if wait is not None else 'Too many streams'})
+        return
+    await send({'type': 'websocket.accept'})
+    try:
+        subscription = await broadcaster.subscribe(tickers, client)
+    except StreamLimitExceeded:
+        await send({'type': 'websocket.close', 'code': 1013, 'reason': 'Too many streams'})
+        return
+
+    async def read_commands():
+        while (event := await receive())['type'] != 'websocket.disconnect':
+            try:
+                command = json.loads(event.get('text') or '{}')
+                subscription.update(
+                    subscribe=parse_tickers(command.get('subscribe', [])) or set(),
+                    unsubscribe=parse_tickers(command.get('unsubscribe', [])) or set(),
+                )
+            except (ValueError, AttributeError) as error:
+                await send({'type': 'websocket.send', 'text': json.dumps({'error': str(error)})})
+
+    reader = asyncio.create_task(read_commands())
+    try:
+        while not reader.done():
+            getter = asyncio.create_task(subscription.get(settings.STOCKS_STREAM_HEARTBEAT))
+            await asyncio.wait({reader, getter}, return_when=asyncio.FIRST_COMPLETED)
+            if not getter.done():
+                getter.cancel()
+            elif diffs := getter.result():
+                await send({'type': 'websocket.send', 'text': json.dumps(diffs)})
+    finally:
+        reader.cancel()
+        broadcaster.unsubscribe(subscription)
@@ -0,0 +1,141 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from django.conf import settings
+
+from ..models import Candle
+
+# The intervals materialized from the minute candles.
+RESAMPLED_INTERVALS = (
+    Candle.IntervalChoices.TEN_MINUTES,
+    Candle.IntervalChoices.HOUR,
+    Candle.IntervalChoices.DAY,
+    Candle.IntervalChoices.WEEK,
+)
+
+_MINUTE = 60 * 10 ** 9
+_DAY = 24 * 60 * _MINUTE
+
+# The bucket width of each interval in nanoseconds of the local time.
+BUCKET_SIZES = {
+    Candle.IntervalChoices.TEN_MINUTES: 10 * _MINUTE,
+    Candle.IntervalChoices.HOUR: 60 * _MINUTE,
+    Candle.IntervalChoices.DAY: _DAY,
+    Candle.IntervalChoices.WEEK: 7 * _DAY,
+}
+
+# 1970-01-01 was a Thursday, so the weeks starting on Monday are shifted by 4 days.
+_WEEK_OFFSET = 4 * _DAY
+
+CANDLE_COLUMNS = ('begin', 'open', 'high', 'low', 'close', 'value', 'volume')
+
+
+def _to_local_ns(moments) -> np.ndarray:
+    """Converts aware datetimes to nanoseconds since the epoch in the local time of settings.TIME_ZONE."""
+
+    index = pd.DatetimeIndex(moments)
+    index = index.tz_localize('UTC') if index.tz is None else index.tz_convert('UTC')
+    return index.tz_convert(settings.TIME_ZONE).tz_localize(None).asi8
+
+
+def _from_local_ns(values: np.ndarray) -> list[datetime]:
+    """Converts nanoseconds since the epoch in the local time to aware datetimes."""
+
+    return pd.DatetimeIndex(values).tz_localize(settings.TIME_ZONE).to_pydatetime().tolist()
+
+
+def floor_to_bucket(values: np.ndarray, interval: int) -> np.ndarray:
+    """
+    Returns the start of the bucket of the interval for each moment.
+
+    Parameters:
+        values (np.ndarray): The local time in nanoseconds since the epoch.
+        interval (int): The target candle interval.
+
+    Returns:
+        np.ndarray: The starts of the buckets in the same units.
+    """
+
+    size = BUCKET_SIZES[interval]
+    offset = _WEEK_OFFSET if interval == Candle.IntervalChoices.WEEK else 0
+    return (values - offset) // size * size + offset
+
+
+def aggregate_candles(columns: dict[str, np.ndarray], interval: int) -> dict[str, np.ndarray]:
+    """
+    Aggregates the candles ordered by begin into the candles of a longer interval.
+
+    Parameters:
+        columns (dict[str, np.ndarray]): The arrays of CANDLE_COLUMNS, begin is in local nanoseconds.
+        interval (int): The target candle interval.
+
+    Returns:
+        dict[str, np.ndarray]: The arrays of CANDLE_COLUMNS of the aggregated candles.
+    """
+
+    buckets = floor_to_bucket(columns['begin'], interval)
+    if not len(buckets):
+        return {name: values[:0] for name, values in columns.items()}
+
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(buckets)] - 1
+
+    return {
+        'begin': buckets[starts],
+        'open': columns['open'][starts],
+        'high': np.maximum.reduceat(columns['high'], starts),
+        'low': np.minimum.reduceat(columns['low'], starts),
+        'close': columns['close'][ends],
+        'value': np.add.reduceat(columns['value'], starts),
+        'volume': np.add.reduceat(columns['volume'], starts),
+    }
+
+
+def resample_ticker(ticker: str, since: datetime, intervals=RESAMPLED_INTERVALS) -> list[Candle]:
+    """
+    Recalculates the candles of the longer intervals affected by the minute candles
+    of the ticker that began at or after `since`.
+
+    The minute candles are read with a single range scan starting at the earliest affected bucket.
+
+    Parameters:
+        ticker (str): The ticker of the stock.
+        since (datetime): The begin of the earliest new minute candle.
+        intervals: The target intervals.
+
+    Returns:
+        list[Candle]: The unsaved candles of the affected buckets.
+    """
+
+    since_ns = _to_local_ns([since])
+    first_buckets = {interval: floor_to_bucket(since_ns, interval)[0] for interval in intervals}
+    start = _from_local_ns(np.array([min(first_buckets.values())]))[0]
+
+    rows = list(Candle.objects
+                .filter(ticker=ticker, interval=Candle.IntervalChoices.MINUTE, begin__gte=start)
+                .order_by('begin')
+                .values_list(*CANDLE_COLUMNS))
+    if not rows:
+        return []
+
+    begins, *values = zip(*rows)
+    columns = {'begin': _to_local_ns(begins)}
+    for name, column in zip(CANDLE_COLUMNS[1:], values):
+        columns[name] = np.asarray(column, dtype=np.int64 if name == 'volume' else np.float64)
+
+    candles = []
+    for interval in intervals:
+        aggregated = aggregate_candles(columns, interval)
+        affected = aggregated['begin'] >= first_buckets[interval]
+        aggregated = {name: array[affected] for name, array in aggregated.items()}
+
+        for begin, open_, high, low, close, value, volume in zip(
+                _from_local_ns(aggregated['begin']), *(aggregated[name].tolist() for name in CANDLE_COLUMNS[1:])):
+            candles.append(Candle(
+                ticker=ticker, interval=interval, begin=begin,
+                open=open_, high=high, low=low, close=close, value=value, volume=volume,
+            ))
+
+    return candles
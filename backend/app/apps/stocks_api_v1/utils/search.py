@@ -0,0 +1,258 @@
+import logging
+import operator
+import threading
+
+from functools import reduce
+
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.db import connection
+from django.db.models import Case, F, IntegerField, Q, Value, When
+
+from ..models import Stock
+from .caching import get_dataset_version
+from .transliteration import normalize_search_text
+
+logger = logging.getLogger('stocks')
+
+# The scores of a query word that matches a word of the search document.
+EXACT_SCORE = 3.0
+PREFIX_SCORE = 2.0
+FUZZY_SCORES = {1: 1.0, 2: 0.5}
+
+
+def get_max_distance(word: str) -> int:
+    """Returns the number of typos allowed in the query word, short words must match exactly."""
+
+    if len(word) < 4:
+        return 0
+    if len(word) < 8:
+        return 1
+    return 2
+
+
+class _TrieNode:
+    __slots__ = ('children', 'tickers')
+
+    def __init__(self):
+        self.children = {}
+        self.tickers = set()
+
+
+class SearchTrie:
+    """
+    The trie of the words of the search documents with the tickers of the stocks they belong to.
+    """
+
+    def __init__(self):
+        self.root = _TrieNode()
+        self.words = {}
+
+    def __len__(self):
+        return len(self.words)
+
+    def add(self, ticker: str, document: str) -> None:
+        """Indexes the words of the search document of the stock, replacing the previous ones."""
+
+        self.remove(ticker)
+        words = set(document.split())
+        for word in words:
+            node = self.root
+            for char in word:
+                node = node.children.setdefault(char, _TrieNode())
+            node.tickers.add(ticker)
+        self.words[ticker] = words
+
+    def remove(self, ticker: str) -> None:
+        """Removes the stock from the trie, the emptied branches are pruned."""
+
+        for word in self.words.pop(ticker, ()):
+            path = [self.root]
+            for char in word:
+                path.append(path[-1].children[char])
+            path[-1].tickers.discard(ticker)
+            for char, parent, node in zip(reversed(word), reversed(path[:-1]), reversed(path[1:])):
+                if node.tickers or node.children:
+                    break
+                del parent.children[char]
+
+    def match(self, word: str) -> dict[str, float]:
+        """
+        Finds the stocks with a word that equals the query word, starts with it,
+        or differs from it by at most get_max_distance(word) edits.
+
+        Returns:
+            dict[str, float]: The best score of the word keyed by ticker.
+        """
+
+        scores = {}
+
+        def update(tickers, score):
+            for ticker in tickers:
+                if scores.get(ticker, 0) < score:
+                    scores[ticker] = score
+
+        node = self.root
+        for char in word:
+            node = node.children.get(char)
+            if node is None:
+                break
+        else:
+            update(node.tickers, EXACT_SCORE)
+            stack = list(node.children.values())
+            while stack:
+                node = stack.pop()
+                update(node.tickers, PREFIX_SCORE)
+                stack.extend(node.children.values())
+
+        max_distance = get_max_distance(word)
+        if max_distance:
+            for ticker, distance in self._fuzzy(word, max_distance).items():
+                update((ticker,), FUZZY_SCORES.get(distance, 0))
+
+        return scores
+
+    def _fuzzy(self, word: str, max_distance: int) -> dict[str, int]:
+        """
+        Walks the trie computing a row of the Levenshtein matrix per node,
+        the branches whose row exceeds max_distance everywhere are not visited.
+        """
+
+        distances = {}
+        first_row = list(range(len(word) + 1))
+        stack = [(char, child, first_row) for char, child in self.root.children.items()]
+        while stack:
+            char, node, previous = stack.pop()
+            row = [previous[0] + 1]
+            for column in range(1, len(word) + 1):
+                row.append(min(
+                    row[column - 1] + 1,
+                    previous[column] + 1,
+                    previous[column - 1] + (word[column - 1] != char),
+                ))
+
+            if 0 < row[-1] <= max_distance:
+                for ticker in node.tickers:
+                    distances[ticker] = min(distances.get(ticker, max_distance), row[-1])
+            if min(row) <= max_distance:
+                stack.extend((next_char, child, row) for next_char, child in node.children.items())
+
+        return distances
+
+
+class SearchIndex:
+    """
+    The in-memory search index of the stocks used when the database has no trigram indexes.
+
+    The index follows the version of the stocks dataset: when it changes, only the stocks
+    updated since the last refresh are reindexed and the deleted ones are removed.
+    """
+
+    def __init__(self):
+        self.trie = SearchTrie()
+        self.version = None
+        self.updated = None
+        self.lock = threading.Lock()
+
+    def refresh(self) -> None:
+        """Brings the index up to date with the database."""
+
+        version = get_dataset_version()['version']
+        if version == self.version:
+            return
+
+        with self.lock:
+            if version == self.version:
+                return
+
+            tickers = set(Stock.objects.values_list('ticker', flat=True))
+            for ticker in self.trie.words.keys() - tickers:
+                self.trie.remove(ticker)
+
+            queryset = Stock.objects.values_list('ticker', 'search_document', 'updated')
+            rows = list(queryset if self.updated is None else queryset.filter(updated__gte=self.updated))
+            if missing := tickers - self.trie.words.keys() - {row[0] for row in rows}:
+                rows += queryset.filter(ticker__in=missing)
+            for ticker, document, updated in rows:
+                self.trie.add(ticker, document or '')
+                if self.updated is None or updated > self.updated:
+                    self.updated = updated
+
+            logger.debug(f'The search index has been refreshed: {len(rows)} stocks reindexed, '
+                         f'{len(self.trie)} stocks in total')
+            self.version = version
+
+    def search(self, words: list[str]) -> dict[str, float]:
+        """
+        Returns the scores of the stocks that match every word of the query.
+        """
+
+        self.refresh()
+        result = None
+        for word in words:
+            scores = self.trie.match(word)
+            if result is None:
+                result = scores
+            else:
+                result = {ticker: result[ticker] + score for ticker, score in scores.items() if ticker in result}
+            if not result:
+                break
+        return result or {}
+
+
+_index = SearchIndex()
+
+
+def search_stocks(query: str, limit: int | None = None) -> list[str]:
+    """
+    Finds the stocks by the ticker, the names, the ISIN or the registration number.
+
+    The query is normalized like the search documents, so the Cyrillic and the Latin
+    spelling of a name give the same results. Every word of the query must match a word
+    of the document exactly, as a prefix or with a few typos.
+
+    The stocks are ordered by the exact ticker match, the ticker prefix match and the similarity.
+    PostgreSQL uses the trigram index of the search documents, other databases use the in-memory trie.
+
+    Parameters:
+        query (str): The search query.
+        limit (int | None): The maximum number of the stocks to return.
+
+    Returns:
+        list[str]: The tickers of the found stocks.
+    """
+
+    words = normalize_search_text(query).split()
+    if not words:
+        return []
+    ticker = ''.join(words).upper()
+
+    if connection.vendor == 'postgresql':
+        return _search_postgresql(words, ticker, limit)
+
+    scores = _index.search(words)
+    tickers = sorted(scores, key=lambda key: (key != ticker, not key.startswith(ticker), -scores[key], key))
+    return tickers[:limit]
+
+
+def _search_postgresql(words: list[str], ticker: str, limit: int | None) -> list[str]:
+    """Searches the stocks with the LIKE and the word similarity operators backed by the GIN trigram index."""
+
+    condition = Q()
+    for word in words:
+        word_condition = Q(search_document__contains=word)
+        if get_max_distance(word):
+            word_condition |= Q(search_document__trigram_word_similar=word)
+        condition &= word_condition
+    similarity = reduce(operator.add, (TrigramWordSimilarity(word, 'search_document') for word in words))
+
+    queryset = Stock.objects.filter(condition).annotate(
+        ticker_rank=Case(
+            When(ticker=ticker, then=Value(0)),
+            When(ticker__startswith=ticker, then=Value(1)),
+            default=Value(2),
+            output_field=IntegerField(),
+        ),
+        similarity=similarity,
+    ).order_by('ticker_rank', F('similarity').desc(), 'ticker')
+
+    return list(queryset.values_list('ticker', flat=True)[:limit])
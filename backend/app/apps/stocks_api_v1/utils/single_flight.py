@@ -0,0 +1,201 @@
+import functools
+import json
+import logging
+import threading
+import uuid
+
+from collections import defaultdict
+
+import redis
+
+from celery import current_app
+from django.conf import settings
+
+from ..metrics import INGESTION_TRIGGERS
+
+logger = logging.getLogger('stocks')
+
+LOCK_KEY_PREFIX = 'single-flight'
+# How long a coalesced trigger is kept if the running task dies without picking it up
+PENDING_TIMEOUT = 60 * 60
+
+RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisLockBackend:
+    """
+    Keeps the locks and the coalesced triggers in Redis, so they are shared by all the workers.
+    A lock is a key with the token of its holder that expires after the lease unless it is renewed.
+    The commands time out after settings.STOCKS_LOCK_REDIS_TIMEOUT seconds, so a stalled Redis fails
+    the task instead of hanging it.
+    """
+
+    def __init__(self, url: str):
+        timeout = settings.STOCKS_LOCK_REDIS_TIMEOUT
+        self._client = redis.Redis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout)
+        self._renew = self._client.register_script(RENEW_SCRIPT)
+        self._release = self._client.register_script(RELEASE_SCRIPT)
+
+    def acquire(self, key: str, token: str, lease: float) -> bool:
+        return bool(self._client.set(key, token, nx=True, px=int(lease * 1000)))
+
+    def renew(self, key: str, token: str, lease: float) -> bool:
+        return bool(self._renew(keys=[key], args=[token, int(lease * 1000)]))
+
+    def release(self, key: str, token: str) -> bool:
+        return bool(self._release(keys=[key], args=[token]))
+
+    def set_pending(self, key: str, value: str) -> None:
+        self._client.set(key, value, ex=PENDING_TIMEOUT)
+
+    def pop_pending(self, key: str) -> str | None:
+        value = self._client.getdel(key)
+        return value.decode() if value is not None else None
+
+
+class LocalLockBackend:
+    """
+    Keeps the locks and the coalesced triggers in the process, for tests and a single worker.
+    The leases do not expire.
+    """
+
+    def __init__(self):
+        self._locks = {}
+        self._pending = {}
+        self._mutex = threading.Lock()
+
+    def acquire(self, key: str, token: str, lease: float) -> bool:
+        with self._mutex:
+            return self._locks.setdefault(key, token) == token
+
+    def renew(self, key: str, token: str, lease: float) -> bool:
+        with self._mutex:
+            return self._locks.get(key) == token
+
+    def release(self, key: str, token: str) -> bool:
+        with self._mutex:
+            if self._locks.get(key) != token:
+                return False
+            del self._locks[key]
+            return True
+
+    def set_pending(self, key: str, value: str) -> None:
+        with self._mutex:
+            self._pending[key] = value
+
+    def pop_pending(self, key: str) -> str | None:
+        with self._mutex:
+            return self._pending.pop(key, None)
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+# The names of the tasks that share each lock, the holder enqueues the follow-up runs of all of them
+_lock_tasks = defaultdict(list)
+
+
+def get_lock_backend() -> RedisLockBackend | LocalLockBackend:
+    """Returns the Redis backend of settings.STOCKS_LOCK_REDIS_URL, or the local one if it is not set."""
+
+    url = settings.STOCKS_LOCK_REDIS_URL
+    with _backends_lock:
+        if url not in _backends:
+            _backends[url] = RedisLockBackend(url) if url else LocalLockBackend()
+        return _backends[url]
+
+
+class LeaseRenewer(threading.Thread):
+    """
+    Renews the lease of the held lock every third of the lease until it is stopped.
+    """
+
+    def __init__(self, backend, key: str, token: str, lease: float):
+        super().__init__(name=f'lease-renewer:{key}', daemon=True)
+        self.backend, self.key, self.token, self.lease = backend, key, token, lease
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.lease / 3):
+            try:
+                if not self.backend.renew(self.key, self.token, self.lease):
+                    logger.error(f'The lock {self.key} has been lost, another run may be in progress')
+                    return
+            except redis.RedisError as error:
+                logger.warning(f'Failed to renew the lock {self.key}: {error}')
+
+
+def single_flight(name: str, lease: float | None = None):
+    """
+    Makes the decorated task run at most once at a time across all the workers.
+
+    A run that is triggered while another one holds the lock is not run. It is coalesced instead:
+    the holder enqueues a single follow-up run of every coalesced task with the arguments of its latest
+    trigger when it finishes, however many triggers arrived in the meantime. The lock is held with a lease
+    (settings.STOCKS_INGESTION_LOCK_LEASE seconds by default) that is renewed while the task runs,
+    so the lock of a killed worker expires on its own.
+
+    Parameters:
+        name (str): The name of the lock, the tasks with the same name exclude each other.
+        lease (float | None): The lease of the lock in seconds.
+
+    Returns:
+        Callable: The decorator. A coalesced run returns {'coalesced': True}.
+    """
+
+    def decorator(func):
+        task_name = f'{func.__module__}.{func.__name__}'
+        if task_name not in _lock_tasks[name]:
+            _lock_tasks[name].append(task_name)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            backend = get_lock_backend()
+            key = f'{LOCK_KEY_PREFIX}:{name}'
+            token = uuid.uuid4().hex
+            lease_seconds = lease or settings.STOCKS_INGESTION_LOCK_LEASE
+
+            if not backend.acquire(key, token, lease_seconds):
+                pending_key = f'{key}:pending:{task_name}'
+                trigger = json.dumps({'task': task_name, 'args': args, 'kwargs': kwargs})
+                backend.set_pending(pending_key, trigger)
+                # The holder may have released the lock and taken the pending triggers before this one was set,
+                # then nobody would run it, so the lock is tried once more.
+                if not backend.acquire(key, token, lease_seconds):
+                    logger.info(f'{task_name} has been coalesced: another run holds the {name} lock')
+                    INGESTION_TRIGGERS.inc(task=task_name, outcome='coalesced')
+                    return {'coalesced': True}
+                # This run serves its own trigger, a later one of another run is kept for the follow-up run.
+                if (pending := backend.pop_pending(pending_key)) is not None and pending != trigger:
+                    backend.set_pending(pending_key, pending)
+
+            renewer = LeaseRenewer(backend, key, token, lease_seconds)
+            renewer.start()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                renewer.stopped.set()
+                backend.release(key, token)
+                # The pending triggers are taken after the release, so a trigger that is coalesced
+                # while the lock is being released is either taken here or retries the lock itself.
+                for pending_task in _lock_tasks[name]:
+                    if (pending := backend.pop_pending(f'{key}:pending:{pending_task}')) is None:
+                        continue
+                    pending = json.loads(pending)
+                    logger.info(f'A follow-up run of {pending["task"]} has been enqueued for the coalesced triggers')
+                    current_app.send_task(pending['task'], args=pending['args'], kwargs=pending['kwargs'])
+                    INGESTION_TRIGGERS.inc(task=pending['task'], outcome='follow_up')
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,57 @@
+import random
+
+from datetime import date, timedelta
+
+from ..models import Stock
+
+STATUSES = [choice.value for choice in Stock.StatusChoices]
+SECTYPES = [choice.value for choice in Stock.SecTypeChoices]
+LISTLEVELS = [choice.value for choice in Stock.ListLevelChoices]
+
+
+def generate_stocks(count: int, seed: int = 0, prefix: str = 'S') -> list[dict]:
+    """
+    Generates synthetic stocks in the format of the market API payload.
+
+    Parameters:
+        count (int): The number of stocks to generate.
+        seed (int): The seed of the random generator, the same seed gives the same stocks.
+        prefix (str): The prefix of the generated tickers.
+
+    Returns:
+        list[dict]: The stocks as returned by Market('stocks').tickers().
+    """
+
+    rnd = random.Random(seed)
+    prevdate = date(2024, 3, 15)
+    width = max(len(str(count - 1)), 1)
+
+    stocks = []
+    for number in range(count):
+        decimals = rnd.choice((0, 1, 2, 3, 4))
+        prevprice = round(rnd.uniform(0.01, 10000), decimals)
+        stocks.append({
+            'SECID': f'{prefix}{number:0{width}d}'[:10],
+            'BOARDID': 'TQBR',
+            'SHORTNAME': f'Stock {number}',
+            'SECNAME': f'Публичное акционерное общество {number}',
+            'LATNAME': f'Public joint stock company {number}',
+            'PREVPRICE': prevprice,
+            'LOTSIZE': rnd.choice((1, 10, 100, 1000)),
+            'FACEVALUE': round(rnd.uniform(0.001, 1000), 3),
+            'FACEUNIT': 'SUR',
+            'STATUS': rnd.choice(STATUSES),
+            'DECIMALS': decimals,
+            'MINSTEP': 10 ** -decimals,
+            'PREVDATE': prevdate,
+            'ISSUESIZE': rnd.randint(10 ** 5, 10 ** 11),
+            'ISIN': f'RU000A{number:06d}'[:12],
+            'REGNUMBER': f'1-01-{number:05d}-A',
+            'PREVLEGALCLOSEPRICE': prevprice,
+            'CURRENCYID': 'SUR',
+            'SECTYPE': rnd.choice(SECTYPES),
+            'LISTLEVEL': rnd.choice(LISTLEVELS),
+            'SETTLEDATE': prevdate + timedelta(days=rnd.choice((1, 2, 3))),
+        })
+
+    return stocks
@@ -0,0 +1,46 @@
+import re
+
+# The Cyrillic to Latin transliteration close to the one used in the MOEX Latin names.
+CYRILLIC_TO_LATIN = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e', 'ж': 'zh', 'з': 'z', 'и': 'i',
+    'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't',
+    'у': 'u', 'ф': 'f', 'х': 'kh', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'sch', 'ъ': '', 'ы': 'y', 'ь': '',
+    'э': 'e', 'ю': 'yu', 'я': 'ya',
+}
+
+_TRANSLATION = str.maketrans(CYRILLIC_TO_LATIN)
+_SEPARATORS = re.compile(r'[^0-9a-z]+')
+
+# The stock fields included into the search document.
+SEARCH_FIELDS = ('ticker', 'shortname', 'secname', 'latname', 'isin', 'regnumber')
+
+
+def normalize_search_text(text: str | None) -> str:
+    """
+    Normalizes the text for the search: lower-cases it, transliterates Cyrillic to Latin
+    and replaces everything except letters and digits with single spaces.
+
+    Parameters:
+        text (str | None): The text to normalize.
+
+    Returns:
+        str: The normalized text.
+    """
+
+    if not text:
+        return ''
+    return _SEPARATORS.sub(' ', text.lower().translate(_TRANSLATION)).strip()
+
+
+def build_search_document(values: dict) -> str:
+    """
+    Builds the search document of a stock.
+
+    Parameters:
+        values (dict): The values of the stock keyed by the field name.
+
+    Returns:
+        str: The normalized values of SEARCH_FIELDS separated by spaces.
+    """
+
+    return ' '.join(filter(None, (normalize_search_text(values.get(field)) for field in SEARCH_FIELDS)))
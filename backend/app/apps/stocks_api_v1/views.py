@@ -1,11 +1,298 @@
+import hashlib
+import json
+import math
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Q
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+
 from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import AuthenticationFailed, ValidationError
+from rest_framework.response import Response
+
+from .filters import StockFilterBackend
+from .models import Candle, Stock
+from .pagination import StockCursorPagination
+from .serializers import (
+    CandleQuerySerializer, CandleSerializer, StockBatchSerializer, StockChangesSerializer, StockExportSerializer,
+    StockSearchSerializer, StockSerializer,
+)
+from .utils.caching import CachedResponseMixin
+from .utils.changes import get_changes
+from .utils.encoding import build_row_encoder, encode_rows
+from .utils.export import EXPORT_CONTENT_TYPES, iter_export
+from .utils.price_stream import StreamLimitExceeded, check_stream_access, get_broadcaster, parse_tickers
+from .utils.search import search_stocks
 
-from .models import Stock
-from .serializers import StockSerializer
 
+class StockViewSet(CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    A ViewSet for handling read-only operations on Stock instances.
+    The list and retrieve responses are cached until the stocks change.
 
-class StockViewSet(viewsets.ReadOnlyModelViewSet):
-    """A ViewSet for handling read-only operations on Stock instances."""
+    The `fields` query parameter takes a comma-separated list of the fields to return,
+    only these columns are read from the database. The list is filtered by the parameters
+    of StockFilterSerializer.
+    """
 
     queryset = Stock.objects.all()
     serializer_class = StockSerializer
+    pagination_class = StockCursorPagination
+    filter_backends = [StockFilterBackend]
+    # The bucket of core.throttling.ScopedBucketThrottle, set by the expensive actions
+    throttle_scope = None
+
+    def get_requested_fields(self) -> list[str] | None:
+        """
+        Parses the `fields` query parameter.
+
+        Returns:
+            list[str] | None: The requested fields in the order of the serializer, or None for all the fields.
+
+        Raises:
+            ValidationError: If there are unknown fields.
+        """
+
+        if not hasattr(self, '_requested_fields'):
+            value = self.request.query_params.get('fields')
+            if not value:
+                self._requested_fields = None
+            else:
+                requested = {name.strip() for name in value.split(',') if name.strip()}
+                available = list(StockSerializer().fields)
+                if unknown := requested - set(available):
+                    raise ValidationError({'fields': [f'Unknown fields: {", ".join(sorted(unknown))}.']})
+                self._requested_fields = [name for name in available if name in requested]
+        return self._requested_fields
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fields = self.get_requested_fields() if self.action in ('list', 'retrieve', 'batch', 'search', 'export') else None
+        if fields is not None:
+            # The ticker is always read, the cursor pagination and the batch lookup need it as well as the isin.
+            queryset = queryset.values(*{'ticker', 'isin', *fields})
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        if self.action in ('list', 'retrieve', 'batch', 'search', 'export'):
+            kwargs.setdefault('fields', self.get_requested_fields())
+        return super().get_serializer(*args, **kwargs)
+
+    def validate_query(self, request):
+        # The fields and the filters are validated when the lazy queryset is built, no query is run.
+        self.get_requested_fields()
+        if self.action in ('list', 'retrieve'):
+            self.filter_queryset(self.get_queryset())
+        if self.action == 'list' and self.paginator.get_page_size(request) is not None:
+            self.paginator.decode_cursor(request)
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, self._list, *args, **kwargs)
+
+    def _list(self, request, *args, **kwargs):
+        """
+        Renders the unpaginated JSON list from the tuples of values_list with a precompiled row encoder
+        instead of the serializer, the output is the same. Falls back to the serializer otherwise.
+        """
+
+        fast = (settings.STOCKS_FAST_LIST and request.accepted_renderer.format == 'json'
+                and self.paginator.get_page_size(request) is None)
+        if not fast:
+            return super().list(request, *args, **kwargs)
+
+        serializer_fields = self.get_serializer().fields
+        columns = list(serializer_fields)
+        encoder = build_row_encoder(serializer_fields, columns)
+        rows = self.filter_queryset(self.get_queryset()).values_list(*columns)
+        return Response(encode_rows(rows, encoder))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, super().retrieve, *args, **kwargs)
+
+    @action(detail=False, methods=['get', 'post'])
+    def batch(self, request):
+        """
+        Returns the stocks with the given tickers or ISINs and the keys that were not found.
+
+        The keys are taken from the `tickers` list of the POST body or from the repeated `ticker`
+        query parameters. They are upper-cased like in Stock.save() and resolved with a single query.
+        """
+
+        if request.method == 'POST':
+            data = request.data
+        else:
+            data = {'tickers': request.query_params.getlist('ticker')}
+        query = StockBatchSerializer(data=data)
+        query.is_valid(raise_exception=True)
+
+        keys = sorted({key.strip().upper() for key in query.validated_data['tickers']} - {''})
+        identity = f'{request.accepted_renderer.format}:{request.query_params.get("fields", "")}:{",".join(keys)}'
+        cache_key = f'batch:{hashlib.blake2b(identity.encode(), digest_size=16).hexdigest()}'
+        return self.cached_response(request, self._batch, keys, cache_key=cache_key)
+
+    def _batch(self, request, keys):
+        stocks = list(self.get_queryset().filter(Q(ticker__in=keys) | Q(isin__in=keys)))
+
+        found = set()
+        for stock in stocks:
+            found.update((stock['ticker'], stock['isin']) if isinstance(stock, dict) else (stock.ticker, stock.isin))
+
+        return Response({
+            'results': self.get_serializer(stocks, many=True).data,
+            'not_found': [key for key in keys if key not in found],
+        })
+
+    @action(detail=False, methods=['get'], throttle_scope='export')
+    def export(self, request):
+        """
+        Streams the filtered stocks as a CSV, NDJSON or Parquet file, optionally gzipped.
+
+        The rows are read and encoded by chunks of settings.STOCKS_EXPORT_CHUNK_SIZE,
+        so the memory used does not depend on the number of the exported stocks.
+        """
+
+        query = StockExportSerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        export_format, compress = query.validated_data['file_format'], query.validated_data['gzip']
+
+        chunks = iter_export(
+            self.filter_queryset(self.get_queryset()),
+            self.get_serializer().fields,
+            export_format,
+            chunk_size=settings.STOCKS_EXPORT_CHUNK_SIZE,
+            compress=compress,
+        )
+        filename = f'stocks.{export_format}' + ('.gz' if compress else '')
+        response = StreamingHttpResponse(
+            chunks, content_type='application/gzip' if compress else EXPORT_CONTENT_TYPES[export_format],
+        )
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    @action(detail=False, methods=['get'], throttle_scope='search')
+    def search(self, request):
+        """
+        Returns the stocks found by the `q` query, the best matches first.
+
+        The query is matched against the tickers, the names, the ISINs and the registration numbers
+        as a prefix, with typos and in both the Cyrillic and the Latin spelling.
+        """
+
+        query = StockSearchSerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        return self.cached_response(request, self._search, query.validated_data)
+
+    def _search(self, request, params):
+        tickers = search_stocks(params['q'], limit=params['limit'])
+        positions = {ticker: position for position, ticker in enumerate(tickers)}
+        stocks = sorted(
+            self.get_queryset().filter(ticker__in=tickers),
+            key=lambda stock: positions[stock['ticker'] if isinstance(stock, dict) else stock.ticker],
+        )
+        return Response(self.get_serializer(stocks, many=True).data)
+
+    @action(detail=False, methods=['get'])
+    def changes(self, request):
+        """
+        Returns the stocks inserted or changed and the tickers removed after the `since` token,
+        and the token to pass next time. Without the token the feed starts with all the stocks.
+
+        The pages hold at most `limit` stocks and `limit` removed tickers, `has_more` tells
+        whether the next page should be requested at once. The clients apply the stocks
+        before the removed tickers of the page.
+        """
+
+        query = StockChangesSerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        changes = get_changes(*query.validated_data['since'], limit=query.validated_data['limit'])
+        return Response({
+            'results': self.get_serializer(changes.stocks, many=True).data,
+            'removed': changes.removed,
+            'next': changes.token,
+            'has_more': changes.has_more,
+        })
+
+    @action(detail=True, methods=['get'])
+    def candles(self, request, pk=None):
+        """
+        Returns the candles of the stock for the interval, ordered by begin.
+
+        The candles are read with a single range scan of the (ticker, interval, begin) key.
+        Without `start` the latest settings.CANDLES_MAX_ROWS candles before `end` are returned.
+        """
+
+        query = CandleQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+
+        queryset = Candle.objects.filter(ticker=pk.upper(), interval=params['interval'])
+        if 'end' in params:
+            queryset = queryset.filter(begin__lt=params['end'])
+
+        fields = CandleSerializer.Meta.fields
+        limit = settings.CANDLES_MAX_ROWS
+        if 'start' in params:
+            candles = list(queryset.filter(begin__gte=params['start']).order_by('begin').values(*fields)[:limit])
+        else:
+            candles = list(queryset.order_by('-begin').values(*fields)[:limit])[::-1]
+
+        return Response(CandleSerializer(candles, many=True).data)
+
+
+@require_GET
+async def stock_stream(request):
+    """
+    Streams the changes of the stocks as Server-Sent Events.
+
+    The stocks are chosen by the repeated or comma-separated `ticker` query parameters, all the stocks
+    by default. The first `stocks` event has the current values of the stream fields of the stocks,
+    every next one has only the changed fields of the changed stocks. The stream is served by the ASGI
+    application only, a WSGI worker would be held by it forever. The request is authenticated and throttled
+    as the API requests, and a client has at most settings.STOCKS_STREAM_MAX_CONNECTIONS open streams.
+    """
+
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'detail': 'The stream is available through the ASGI application only.'}, status=501)
+    try:
+        tickers = parse_tickers(request.GET.getlist('ticker'))
+    except ValueError as error:
+        return JsonResponse({'ticker': [str(error)]}, status=400)
+
+    try:
+        client, wait = await sync_to_async(check_stream_access)(request)
+    except AuthenticationFailed as error:
+        return JsonResponse({'detail': str(error.detail)}, status=401)
+    broadcaster = get_broadcaster()
+    if wait is not None:
+        response = JsonResponse({'detail': 'Request was throttled.'}, status=429)
+        response['Retry-After'] = str(math.ceil(wait))
+        return response
+    if not broadcaster.can_connect(client):
+        return JsonResponse({'detail': f'At most {settings.STOCKS_STREAM_MAX_CONNECTIONS} streams can be open.'},
+                            status=429)
+
+    async def events():
+        try:
+            subscription = await broadcaster.subscribe(tickers, client)
+        except StreamLimitExceeded as error:
+            yield f'event: error\ndata: {json.dumps({"detail": str(error)})}\n\n'
+            return
+        try:
+            yield f'retry: {settings.STOCKS_STREAM_RETRY_MS}\n\n'
+            while True:
+                if diffs := await subscription.get(settings.STOCKS_STREAM_HEARTBEAT):
+                    yield f'event: stocks\ndata: {json.dumps(diffs)}\n\n'
+                else:
+                    # The comment keeps the idle connection open through the proxies.
+                    yield ': keep-alive\n\n'
+        finally:
+            broadcaster.unsubscribe(subscription)
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
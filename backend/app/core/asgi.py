@@ -2,6 +2,8 @@
 ASGI config for core project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+The WebSocket stream of the stock changes is served next to Django, it authenticates and throttles
+the clients itself (see apps.stocks_api_v1.utils.price_stream.stocks_websocket).
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
@@ -13,4 +15,23 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported after the setup of Django, it uses the models
+from apps.stocks_api_v1.utils.price_stream import stocks_websocket  # noqa: E402
+
+WEBSOCKET_ROUTES = {
+    '/api/v1/stocks/ws/': stocks_websocket,
+}
+
+
+async def application(scope, receive, send):
+    """Serves the WebSocket routes, the other requests are served by Django."""
+
+    if scope['type'] == 'websocket':
+        if (route := WEBSOCKET_ROUTES.get(scope['path'])) is None:
+            await receive()
+            await send({'type': 'websocket.close', 'code': 1000})
+            return
+        return await route(scope, receive, send)
+    return await django_application(scope, receive, send)
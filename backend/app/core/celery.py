@@ -1,17 +1,21 @@
 import os
 import logging
 
-from logging.handlers import RotatingFileHandler
+from time import perf_counter
 
 from django.conf import settings
-from django.contrib.auth import get_user_model
-from django.core.mail import send_mail
+
+# Set before the imports below, they read the settings
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
 from celery import Celery
 from celery.schedules import crontab
-from celery.signals import after_setup_logger, task_failure
+from celery.signals import after_setup_logger, task_failure, task_postrun, task_prerun, worker_init
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+from apps.stocks_api_v1.utils.market_calendar import MarketSchedule
+from core import db, notifications
+from core.logs import attach_handler, get_file_handler
+from core.metrics import CELERY_TASK_DURATION, CELERY_TASKS
 
 app = Celery('stocks', broker_connection_retry=False, broker_connection_retry_on_startup=True)
 app.config_from_object('django.conf:settings')
@@ -19,28 +23,80 @@ app.config_from_object('django.conf:settings')
 app.autodiscover_tasks()
 
 app.conf.beat_schedule = {
-    'update-available-stocks-every-day': {
-        'task': 'apps.stocks_api_v1.tasks.load_available_stocks',
-        'schedule': crontab(),
+    'update-available-stocks-during-trading-sessions': {
+        'task': 'apps.stocks_api_v1.tasks.load_markets',
+        'schedule': MarketSchedule(),
+    },
+    'load-minute-candles-every-ten-minutes': {
+        'task': 'apps.stocks_api_v1.tasks.load_candles',
+        'schedule': crontab(minute='*/10'),
+    },
+    'drop-expired-candles-every-day': {
+        'task': 'apps.stocks_api_v1.tasks.drop_expired_candles',
+        'schedule': crontab(minute=0, hour=3),
+    },
+    'send-failure-digest': {
+        'task': 'core.celery.send_failure_digest',
+        'schedule': settings.NOTIFICATIONS_DIGEST_INTERVAL,
     },
 }
 
+if settings.NOTIFICATIONS_QUEUE:
+    # The digests can be sent by a separate worker, so SMTP never takes the slots of the other tasks.
+    app.conf.task_routes = {'core.celery.send_failure_digest': {'queue': settings.NOTIFICATIONS_QUEUE}}
+
 
 @task_failure.connect
-def handle_task_failure(task_id, exception, args, kwargs, traceback, einfo, **kw):
+def handle_task_failure(task_id, exception, args, kwargs, traceback, einfo, sender=None, **kw):
     """
     The Celery task error handler.
-    Sends an error notification to the site administrators.
+    Queues the failure for the digest that is sent to the site administrators by send_failure_digest.
     """
 
-    UserModel = get_user_model()
-    admins = UserModel.objects.filter(is_admin=True)
+    notifications.enqueue_failure(sender.name if sender else 'unknown', task_id, exception, einfo)
+
+
+@app.task(ignore_result=True)
+def send_failure_digest() -> int:
+    """Sends the queued task failures to the site administrators as a single digest."""
+
+    return notifications.send_failure_digest()
+
+
+# The start time of the running tasks of the worker process keyed by the task id
+_task_started = {}
+
+
+@worker_init.connect
+def init_worker_process(**kwargs):
+    """Labels the database metrics of the worker and of its prefork children, which inherit the label."""
+
+    db.set_process('celery')
+
+
+@task_prerun.connect
+def start_task_timer(task_id, task, **kwargs):
+    """Remembers the start time of the task for the task metrics."""
+
+    _task_started[task_id] = perf_counter()
+
+
+@task_prerun.connect
+def prepare_task_connections(task, **kwargs):
+    """Closes the obsolete database connections before the task and counts the reused ones."""
+
+    if not getattr(task.request, 'is_eager', False):
+        # The eager tasks run within the request or the test, which own the connections.
+        db.prepare_task_connections()
+
 
-    subject = 'Error in Celery task'
-    message = f'An error occurred in Celery task[{task_id}]: {exception}\n\n{einfo}'
+@task_postrun.connect
+def record_task_metrics(task_id, task, state=None, **kwargs):
+    """Counts the finished task by its state (SUCCESS, FAILURE, RETRY) and reports its run time."""
 
-    for admin in admins:
-        send_mail(subject, message, None, [admin.email])
+    CELERY_TASKS.inc(task=task.name, state=state or 'UNKNOWN')
+    if (started := _task_started.pop(task_id, None)) is not None:
+        CELERY_TASK_DURATION.observe(perf_counter() - started, task=task.name)
 
 
 @after_setup_logger.connect
@@ -54,7 +110,8 @@ def after_setup_celery_logger(logger, **kwargs):
 def add_file_logger(logger: logging.RootLogger) -> logging.RootLogger:
     """
     Configures logging to a file for the logger.
-    It takes values from the LOGGING file variable settings.py.
+    It takes values from the LOGGING file variable settings.py. The handler is shared with the 'celery' logger
+    and is added only once, so the logger can be set up again without duplicating the records.
 
     Parameters:
         logger (logging.RootLogger): Root logger object to which the file handler will be added.
@@ -63,18 +120,9 @@ def add_file_logger(logger: logging.RootLogger) -> logging.RootLogger:
         logging.RootLogger: The logger object with the file handler configured.
     """
 
-    handler_settings = settings.LOGGING.get('handlers').get('celery')
-    formatter_settings = settings.LOGGING.get('formatters').get('verbose')
     logger_settings = settings.LOGGING.get('loggers').get('celery')
 
-    file_handler = RotatingFileHandler(
-        filename=handler_settings.get('filename'),
-        maxBytes=handler_settings.get('maxBytes'),
-        backupCount=handler_settings.get('backupCount'),
-    )
-    formatter = logging.Formatter(fmt=formatter_settings.get('format'), style=formatter_settings.get('style'))
-    file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
+    attach_handler(logger, get_file_handler('celery', settings.LOGGING))
 
     logger.setLevel(logger_settings.get('level'))
     logger.propagate = logger_settings.get('propagate')
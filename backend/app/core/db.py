@@ -0,0 +1,80 @@
+"""
+The persistent database connections of the web and Celery processes.
+
+Every thread keeps its connection open for settings.DB_CONN_MAX_AGE seconds (CONN_MAX_AGE of settings.DATABASES)
+and checks it before the first query of a request or a task (CONN_HEALTH_CHECKS), so the requests and the tasks
+do not pay for the connection setup and the TLS handshake every time.
+
+A forked process (a worker of the prefork Celery pool, a web worker forked after the application is loaded)
+shares the sockets of the connections of its parent. After the fork the child drops them without any network I/O,
+which would break them in the parent as well, and opens its own connections when it needs them.
+The opened and the reused connections are counted by the metrics.
+"""
+
+import os
+
+from django.core.signals import request_started
+from django.db import close_old_connections, connections
+from django.db.backends.signals import connection_created
+
+from core.metrics import DB_CONNECTIONS_OPENED, DB_CONNECTIONS_REUSED
+
+# The kind of the process in the metrics, 'celery' in the Celery workers
+_process = 'web'
+
+# The connections inherited from the parent process. They are never closed by the child,
+# and the references keep the garbage collector from closing them.
+_inherited_connections = []
+
+
+def set_process(name: str) -> None:
+    """Sets the kind of the process in the metrics, e.g. 'celery'."""
+
+    global _process
+    _process = name
+
+
+def drop_inherited_connections() -> None:
+    """
+    Drops the connections of the thread that has forked the process, so the child opens its own ones.
+    The file descriptors of the child are closed, the connections of the parent stay open.
+    """
+
+    for connection in connections.all(initialized_only=True):
+        if connection.connection is None:
+            continue
+        if (fileno := getattr(connection.connection, 'fileno', None)) is not None:
+            try:
+                os.close(fileno())
+            except OSError:
+                pass
+        _inherited_connections.append(connection.connection)
+        connection.connection = None
+
+
+def count_opened_connection(sender, connection, **kwargs) -> None:
+    DB_CONNECTIONS_OPENED.inc(alias=connection.alias, process=_process)
+
+
+def count_reused_connections(**kwargs) -> None:
+    """Counts the connections that are still open at the start of a request or a task and will be reused."""
+
+    for connection in connections.all(initialized_only=True):
+        if connection.connection is not None:
+            DB_CONNECTIONS_REUSED.inc(alias=connection.alias, process=_process)
+
+
+def prepare_task_connections() -> None:
+    """
+    Closes the connections that are broken or older than CONN_MAX_AGE before a task,
+    as Django does before a request, and counts the ones that are reused.
+    """
+
+    close_old_connections()
+    count_reused_connections()
+
+
+connection_created.connect(count_opened_connection)
+# Connected after close_old_connections of Django, so only the connections it has kept are counted.
+request_started.connect(count_reused_connections)
+os.register_at_fork(after_in_child=drop_inherited_connections)
@@ -0,0 +1,174 @@
+"""
+The non-blocking logging of the web and Celery processes.
+
+QueuedRotatingFileHandler only puts the records into an in-memory queue, a QueueListener thread
+formats them and writes them to the rotating file, so the file I/O and the rotation never block
+the caller. JsonFormatter writes a JSON object per line with the extra fields of the record.
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from django.utils.module_loading import import_string
+
+# The attributes of every LogRecord, the others are the extra fields passed by the caller
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+
+# The messages longer than this are truncated before they are queued
+MAX_MESSAGE_LENGTH = 10000
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats the record as a JSON object: the time, the level, the logger, the origin, the message,
+    the exception and the extra fields of the record.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'process': record.processName,
+            'thread': record.threadName,
+            'location': f'{record.module}.{record.funcName}:{record.lineno}',
+            'message': record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exception'] = record.exc_text
+        for name, value in vars(record).items():
+            if name not in RECORD_ATTRIBUTES and not name.startswith('_'):
+                data[name] = value
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class QueuedRotatingFileHandler(QueueHandler):
+    """
+    The rotating file handler that writes the records in a background thread.
+
+    It takes the arguments of RotatingFileHandler and is used by the file handlers of settings.LOGGING.
+    The formatter and the level set on it are applied by the file handler in the background thread.
+    A record is written once even if the handler is attached to several loggers it propagates through.
+    After a fork (e.g. the prefork Celery pool) the child process starts its own thread.
+    """
+
+    # The open handlers keyed by their files, so the same file is not written by two handlers of a process
+    instances = {}
+
+    def __init__(self, filename, mode='a', maxBytes=0, backupCount=0, encoding=None, delay=False):
+        super().__init__(queue.SimpleQueue())
+        self.file_handler = RotatingFileHandler(filename, mode, maxBytes, backupCount, encoding, delay)
+        self.listener = None
+        self.closed = False
+        self._start()
+        QueuedRotatingFileHandler.instances[os.path.abspath(filename)] = self
+        atexit.register(self.stop)
+        os.register_at_fork(after_in_child=self._restart)
+
+    def _start(self):
+        self.listener = QueueListener(self.queue, self.file_handler, respect_handler_level=True)
+        self.listener.start()
+
+    def _restart(self):
+        # The thread of the listener does not survive the fork, the records queued before it are dropped.
+        if not self.closed:
+            self.queue = queue.SimpleQueue()
+            self._start()
+
+    def stop(self):
+        """Writes the queued records and stops the background thread."""
+
+        if self.listener is not None and self.listener._thread is not None:
+            self.listener.stop()
+
+    def setFormatter(self, fmt):
+        self.file_handler.setFormatter(fmt)
+
+    def setLevel(self, level):
+        super().setLevel(level)
+        self.file_handler.setLevel(level)
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        handled = record.__dict__.setdefault('_queued_by', set())
+        if id(self) in handled:
+            return False
+        handled.add(id(self))
+        return super().handle(record)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Merges the arguments into the message, so the queued record does not refer to the objects
+        that may change before it is written. The formatting and the I/O are left to the background thread.
+        """
+
+        record = logging.makeLogRecord(vars(record))
+        message = record.getMessage()
+        if len(message) > MAX_MESSAGE_LENGTH:
+            message = f'{message[:MAX_MESSAGE_LENGTH]}... ({len(message)} characters)'
+        record.msg, record.args = message, None
+        if record.exc_info:
+            # The traceback refers to the frames of the caller, so it is rendered now.
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def close(self):
+        self.closed = True
+        self.stop()
+        self.file_handler.close()
+        super().close()
+
+
+_handlers_lock = threading.Lock()
+
+
+def get_file_handler(name: str, logging_settings: dict) -> QueuedRotatingFileHandler:
+    """
+    Returns the open handler of the file of the handler of the logging settings, or creates it.
+    So the handler that is added to a logger again and again (e.g. on every setup of the Celery logging)
+    is the same one that is configured by the settings.
+
+    Parameters:
+        name (str): The name of the handler in the logging settings.
+        logging_settings (dict): The logging settings, e.g. settings.LOGGING.
+
+    Returns:
+        QueuedRotatingFileHandler: The handler.
+    """
+
+    handler_settings = logging_settings['handlers'][name]
+    filename = os.path.abspath(handler_settings['filename'])
+    with _handlers_lock:
+        handler = QueuedRotatingFileHandler.instances.get(filename)
+        if handler is None or handler.closed:
+            handler = QueuedRotatingFileHandler(
+                filename=filename,
+                maxBytes=handler_settings.get('maxBytes', 0),
+                backupCount=handler_settings.get('backupCount', 0),
+            )
+            handler.setLevel(handler_settings.get('level', logging.NOTSET))
+            formatter_settings = logging_settings['formatters'][handler_settings['formatter']]
+            if factory := formatter_settings.get('()'):
+                handler.setFormatter(import_string(factory)() if isinstance(factory, str) else factory())
+            else:
+                handler.setFormatter(logging.Formatter(
+                    fmt=formatter_settings.get('format'), style=formatter_settings.get('style', '%'),
+                ))
+        return handler
+
+
+def attach_handler(logger: logging.Logger, handler: logging.Handler) -> logging.Logger:
+    """Adds the handler to the logger unless it is already there."""
+
+    if handler not in logger.handlers:
+        logger.addHandler(handler)
+    return logger
@@ -0,0 +1,288 @@
+"""
+Application metrics in the Prometheus text format.
+
+The values are kept in Redis (settings.METRICS_REDIS_URL) rather than in the memory of a process,
+so the counters of all the web workers and the prefork Celery workers add up and any process
+can render them on the /metrics endpoint. Every update is a single pipelined round trip.
+If Redis fails, the updates are dropped for settings.METRICS_REDIS_RETRY_INTERVAL seconds,
+so an outage of Redis does not add its timeouts to every request and task.
+The 'local' store (settings.METRICS_STORE) keeps the values in the process, for tests and runserver.
+"""
+
+import logging
+import math
+import threading
+import time
+
+from collections import defaultdict
+
+import redis
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.views.decorators.http import require_GET
+
+logger = logging.getLogger('stocks')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# The default buckets of the histograms in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+KEY_PREFIX = 'metrics:'
+
+
+class LocalMetricsStore:
+    """
+    Keeps the metrics in the memory of the process.
+    """
+
+    def __init__(self):
+        self._values = defaultdict(lambda: defaultdict(float))
+        self._lock = threading.Lock()
+
+    def update(self, name: str, increments: dict[str, float] | None = None, values: dict[str, float] | None = None):
+        with self._lock:
+            for field, amount in (increments or {}).items():
+                self._values[name][field] += amount
+            self._values[name].update(values or {})
+
+    def read(self, name: str) -> dict[str, float]:
+        with self._lock:
+            return dict(self._values.get(name, {}))
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class RedisMetricsStore:
+    """
+    Keeps the metrics in Redis hashes, one hash per metric and one field per series.
+    """
+
+    def __init__(self, url: str):
+        self._client = redis.Redis.from_url(url, socket_timeout=1, socket_connect_timeout=1)
+        # The monotonic time before which Redis is not tried again after a failure
+        self._retry_at = 0.0
+
+    def update(self, name: str, increments: dict[str, float] | None = None, values: dict[str, float] | None = None):
+        """Updates the metric. The updates are dropped for a while after Redis fails."""
+
+        if time.monotonic() < self._retry_at:
+            return
+        key = KEY_PREFIX + name
+        pipeline = self._client.pipeline(transaction=False)
+        for field, amount in (increments or {}).items():
+            if float(amount).is_integer():
+                pipeline.hincrby(key, field, int(amount))
+            else:
+                pipeline.hincrbyfloat(key, field, amount)
+        if values:
+            pipeline.hset(key, mapping=values)
+        try:
+            pipeline.execute()
+        except redis.RedisError:
+            self._retry_at = time.monotonic() + settings.METRICS_REDIS_RETRY_INTERVAL
+            raise
+
+    def read(self, name: str) -> dict[str, float]:
+        return {field.decode(): float(value) for field, value in self._client.hgetall(KEY_PREFIX + name).items()}
+
+    def clear(self):
+        for key in self._client.scan_iter(f'{KEY_PREFIX}*'):
+            self._client.delete(key)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_metrics_store() -> LocalMetricsStore | RedisMetricsStore:
+    """Returns the store of settings.METRICS_STORE, the same instance for the same settings."""
+
+    key = (settings.METRICS_STORE, settings.METRICS_REDIS_URL)
+    with _stores_lock:
+        if key not in _stores:
+            if settings.METRICS_STORE == 'local':
+                _stores[key] = LocalMetricsStore()
+            else:
+                _stores[key] = RedisMetricsStore(settings.METRICS_REDIS_URL)
+        return _stores[key]
+
+
+def format_labels(labels: dict) -> str:
+    """Formats the labels as in the exposition format, e.g. method="GET",status="200"."""
+
+    def escape(value):
+        return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+    return ','.join(f'{name}="{escape(value)}"' for name, value in sorted(labels.items()))
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(int(value)) if float(value).is_integer() else repr(value)
+
+
+class Metric:
+    """
+    The base class of the metrics. The metrics register themselves to be rendered by the endpoint.
+    """
+
+    type = None
+    registry: dict[str, 'Metric'] = {}
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        Metric.registry[name] = self
+
+    def _labels(self, labels: dict) -> str:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'The {self.name} metric expects the labels {self.labelnames}, got {tuple(labels)}')
+        return format_labels(labels)
+
+    def _update(self, increments: dict | None = None, values: dict | None = None) -> None:
+        if not settings.METRICS_ENABLED:
+            return
+        try:
+            get_metrics_store().update(self.name, increments, values)
+        except redis.RedisError as error:
+            # The metrics must never break the request or the task that reports them.
+            logger.warning(f'Failed to update the {self.name} metric, the metrics are not updated for '
+                           f'{settings.METRICS_REDIS_RETRY_INTERVAL}s: {error}')
+
+    def collect(self) -> list[str]:
+        """Returns the lines of the metric in the exposition format."""
+
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        for labels, value in sorted(get_metrics_store().read(self.name).items()):
+            lines.append(f'{self.name}{{{labels}}} {format_value(value)}' if labels
+                         else f'{self.name} {format_value(value)}')
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        self._update(increments={self._labels(labels): amount})
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value: float, **labels) -> None:
+        self._update(values={self._labels(labels): value})
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = (*sorted(buckets), math.inf)
+
+    def observe(self, value: float, **labels) -> None:
+        series = self._labels(labels)
+        # Only the bucket of the value is incremented, the cumulative counts are calculated by collect().
+        bucket = next(bucket for bucket in self.buckets if value <= bucket)
+        self._update(increments={
+            f'{series}|{format_value(bucket)}': 1,
+            f'{series}|sum': value,
+            f'{series}|count': 1,
+        })
+
+    def collect(self) -> list[str]:
+        series = defaultdict(dict)
+        for field, value in get_metrics_store().read(self.name).items():
+            labels, _, suffix = field.rpartition('|')
+            series[labels][suffix] = value
+
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        for labels, values in sorted(series.items()):
+            prefix = f'{labels},' if labels else ''
+            cumulative = 0
+            for bucket in self.buckets:
+                cumulative += values.get(format_value(bucket), 0)
+                lines.append(f'{self.name}_bucket{{{prefix}le="{format_value(bucket)}"}} {format_value(cumulative)}')
+            suffix = f'{{{labels}}}' if labels else ''
+            lines.append(f'{self.name}_sum{suffix} {format_value(values.get("sum", 0))}')
+            lines.append(f'{self.name}_count{suffix} {format_value(values.get("count", 0))}')
+        return lines
+
+
+def render_metrics() -> str:
+    """Returns all the registered metrics in the Prometheus text format."""
+
+    lines = []
+    for metric in Metric.registry.values():
+        lines.extend(metric.collect())
+    return '\n'.join(lines) + '\n'
+
+
+HTTP_REQUESTS = Counter(
+    'http_requests_total', 'The number of the HTTP requests.', ('method', 'view', 'status'),
+)
+HTTP_REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'The time of handling the HTTP requests.', ('method', 'view'),
+)
+CELERY_TASKS = Counter(
+    'celery_tasks_total', 'The number of the finished Celery tasks by their state.', ('task', 'state'),
+)
+CELERY_TASK_DURATION = Histogram(
+    'celery_task_duration_seconds', 'The run time of the Celery tasks.', ('task',),
+)
+DB_CONNECTIONS_OPENED = Counter(
+    'db_connections_opened_total', 'The number of the database connections opened.', ('alias', 'process'),
+)
+DB_CONNECTIONS_REUSED = Counter(
+    'db_connections_reused_total', 'The number of the requests and the tasks that have reused an open database '
+    'connection.', ('alias', 'process'),
+)
+
+
+class MetricsMiddleware:
+    """
+    Counts the HTTP requests and measures their duration by the method and the URL name of the view.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        # The URL names instead of the paths keep the number of the series bounded.
+        match = request.resolver_match
+        view = match.view_name if match and match.view_name else 'unmatched'
+        HTTP_REQUESTS.inc(method=request.method, view=view, status=response.status_code)
+        HTTP_REQUEST_DURATION.observe(duration, method=request.method, view=view)
+        return response
+
+
+@require_GET
+def metrics_view(request):
+    """
+    Renders the metrics for Prometheus. The request must have the 'Authorization: Bearer <token>' header
+    with settings.METRICS_TOKEN. Without the token the endpoint is open only in DEBUG.
+    """
+
+    if settings.METRICS_TOKEN:
+        if request.headers.get('Authorization') != f'Bearer {settings.METRICS_TOKEN}':
+            return HttpResponseForbidden()
+    elif not settings.DEBUG:
+        return HttpResponseForbidden()
+
+    try:
+        content = render_metrics()
+    except redis.RedisError as error:
+        logger.error(f'Failed to read the metrics: {error}')
+        return HttpResponse(status=503)
+    return HttpResponse(content, content_type=CONTENT_TYPE)
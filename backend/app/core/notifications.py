@@ -0,0 +1,224 @@
+"""
+The failure notifications of the Celery tasks.
+
+A failing task only records its failure in a queue shared by the workers (settings.NOTIFICATIONS_REDIS_URL),
+the failures with the same task and exception signature are merged into one entry with a counter.
+The send_failure_digest task sends the queued failures to the site administrators as a single digest
+through one SMTP connection, at most once per settings.NOTIFICATIONS_DIGEST_INTERVAL seconds.
+"""
+
+import hashlib
+import logging
+import re
+import threading
+import time
+
+from collections import defaultdict
+
+import redis
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.mail import send_mass_mail
+from django.db.models.signals import post_delete, post_save
+
+logger = logging.getLogger('celery')
+
+QUEUE_KEY = 'notifications:failures'
+RECIPIENTS_CACHE_KEY = 'notifications:recipients'
+DIGEST_LOCK_KEY = 'notifications:digest-sent'
+
+# Takes all the queued failures at once, so a failure added meanwhile is either taken with its count or left queued
+POP_ALL_SCRIPT = """
+local failures = {}
+for _, signature in ipairs(redis.call('smembers', KEYS[1])) do
+    local key = KEYS[1] .. ':' .. signature
+    table.insert(failures, redis.call('hgetall', key))
+    redis.call('del', key)
+end
+redis.call('del', KEYS[1])
+return failures
+"""
+
+# The numbers and the hex ids in the exception messages, which differ between the occurrences of the same failure
+VARIABLE_PARTS = re.compile(r'0x[0-9a-f]+|[0-9a-f]{16,}|\d+(\.\d+)?', re.IGNORECASE)
+
+
+def get_failure_signature(task_name: str, exception: BaseException) -> str:
+    """Returns the signature of the failure: the digest of the task, the exception type and its normalized message."""
+
+    message = VARIABLE_PARTS.sub('#', str(exception))[:500]
+    payload = f'{task_name}\x1f{type(exception).__module__}.{type(exception).__qualname__}\x1f{message}'
+    return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+
+class RedisFailureQueue:
+    """
+    Keeps the failures in Redis: a hash per signature and the set of the queued signatures.
+    """
+
+    def __init__(self, url: str):
+        self._client = redis.Redis.from_url(url, socket_timeout=1, socket_connect_timeout=1, decode_responses=True)
+        self._pop_all = self._client.register_script(POP_ALL_SCRIPT)
+
+    def add(self, failure: dict, count: int = 1) -> None:
+        key = f'{QUEUE_KEY}:{failure["signature"]}'
+        pipeline = self._client.pipeline()
+        for field in ('signature', 'task', 'exception', 'traceback', 'first_seen'):
+            pipeline.hsetnx(key, field, failure[field])
+        pipeline.hset(key, mapping={'last_seen': failure['last_seen'], 'last_task_id': failure['last_task_id']})
+        pipeline.hincrby(key, 'count', count)
+        pipeline.sadd(QUEUE_KEY, failure['signature'])
+        pipeline.execute()
+
+    def pop_all(self) -> list[dict]:
+        failures = []
+        for fields in self._pop_all(keys=[QUEUE_KEY]):
+            if fields:
+                failures.append(dict(zip(fields[::2], fields[1::2])))
+        return failures
+
+
+class LocalFailureQueue:
+    """
+    Keeps the failures in the process, for tests and a single worker.
+    """
+
+    def __init__(self):
+        self._failures = {}
+        self._lock = threading.Lock()
+
+    def add(self, failure: dict, count: int = 1) -> None:
+        with self._lock:
+            stored = self._failures.setdefault(failure['signature'], {**failure, 'count': 0})
+            stored.update(last_seen=failure['last_seen'], last_task_id=failure['last_task_id'])
+            stored['count'] += count
+
+    def pop_all(self) -> list[dict]:
+        with self._lock:
+            failures, self._failures = list(self._failures.values()), {}
+        return failures
+
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+
+def get_failure_queue() -> RedisFailureQueue | LocalFailureQueue:
+    """Returns the queue of settings.NOTIFICATIONS_REDIS_URL, or the local one if it is not set."""
+
+    url = settings.NOTIFICATIONS_REDIS_URL
+    with _queues_lock:
+        if url not in _queues:
+            _queues[url] = RedisFailureQueue(url) if url else LocalFailureQueue()
+        return _queues[url]
+
+
+def enqueue_failure(task_name: str, task_id: str, exception: BaseException, traceback: str) -> None:
+    """
+    Queues the failure of the task for the next digest. It is cheap and never raises,
+    so the failing worker goes back to its tasks at once.
+    """
+
+    now = time.time()
+    failure = {
+        'signature': get_failure_signature(task_name, exception),
+        'task': task_name,
+        'exception': f'{type(exception).__name__}: {exception}'[:1000],
+        'traceback': str(traceback)[-5000:],
+        'first_seen': now,
+        'last_seen': now,
+        'last_task_id': task_id,
+    }
+    try:
+        get_failure_queue().add(failure)
+    except redis.RedisError as error:
+        logger.error(f'Failed to queue the failure of the task {task_name}[{task_id}]: {error}')
+
+
+def get_admin_emails() -> list[str]:
+    """Returns the emails of the site administrators, cached for settings.NOTIFICATIONS_RECIPIENTS_CACHE_TIMEOUT."""
+
+    emails = cache.get(RECIPIENTS_CACHE_KEY)
+    if emails is None:
+        emails = list(get_user_model().objects.filter(is_admin=True).exclude(email='').values_list('email', flat=True))
+        cache.set(RECIPIENTS_CACHE_KEY, emails, timeout=settings.NOTIFICATIONS_RECIPIENTS_CACHE_TIMEOUT)
+    return emails
+
+
+def invalidate_admin_emails(sender, **kwargs):
+    """Drops the cached administrators when a user is changed."""
+
+    cache.delete(RECIPIENTS_CACHE_KEY)
+
+
+post_save.connect(invalidate_admin_emails, sender=settings.AUTH_USER_MODEL)
+post_delete.connect(invalidate_admin_emails, sender=settings.AUTH_USER_MODEL)
+
+
+def format_digest(failures: list[dict]) -> tuple[str, str]:
+    """Returns the subject and the message of the digest of the failures."""
+
+    total = sum(int(failure['count']) for failure in failures)
+    by_task = defaultdict(list)
+    for failure in failures:
+        by_task[failure['task']].append(failure)
+
+    subject = f'Errors in Celery tasks: {total} failures of {len(by_task)} tasks'
+    sections = []
+    for task, task_failures in sorted(by_task.items()):
+        for failure in sorted(task_failures, key=lambda failure: -int(failure['count'])):
+            first_seen = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(float(failure['first_seen'])))
+            last_seen = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(float(failure['last_seen'])))
+            sections.append(
+                f'{task}: {failure["exception"]}\n'
+                f'{failure["count"]} times from {first_seen} to {last_seen}, '
+                f'the last task id {failure["last_task_id"]}\n\n'
+                f'{failure["traceback"]}'
+            )
+    return subject, f'\n\n{"-" * 70}\n\n'.join(sections)
+
+
+def send_failure_digest() -> int:
+    """
+    Sends the queued failures to the site administrators as one digest through one connection.
+    The digests are sent at most once per settings.NOTIFICATIONS_DIGEST_INTERVAL, the failures
+    that arrive in the meantime wait for the next digest.
+
+    Returns:
+        int: The number of the sent emails.
+    """
+
+    # The lock key lets only one digest be sent per interval by all the workers. It expires a bit earlier
+    # than the interval, so the next periodic run is not skipped because of the delays of the scheduler.
+    if not cache.add(DIGEST_LOCK_KEY, True, timeout=max(settings.NOTIFICATIONS_DIGEST_INTERVAL * 0.9, 1)):
+        return 0
+
+    failures = get_failure_queue().pop_all()
+    if not failures:
+        cache.delete(DIGEST_LOCK_KEY)
+        return 0
+
+    recipients = get_admin_emails()
+    if not recipients:
+        logger.warning(f'{len(failures)} task failures have not been sent, there are no administrators')
+        _requeue_failures(failures)
+        return 0
+
+    subject, message = format_digest(failures)
+    try:
+        # One message per administrator, so the addresses are not disclosed to each other.
+        return send_mass_mail([(subject, message, None, [email]) for email in recipients])
+    except Exception:
+        _requeue_failures(failures)
+        raise
+
+
+def _requeue_failures(failures: list[dict]) -> None:
+    """Puts the failures back with their counters to be sent with the next digest, which may be sent at once."""
+
+    queue = get_failure_queue()
+    for failure in failures:
+        queue.add(failure, count=int(failure['count']))
+    cache.delete(DIGEST_LOCK_KEY)
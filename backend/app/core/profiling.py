@@ -0,0 +1,159 @@
+"""
+The opt-in request profiler for development (settings.PROFILING_ENABLED).
+
+Every response gets the Server-Timing header with the SQL query count and time, the time spent in the
+DRF serializers and renderers and the total time, so they are shown by the network tab of the browser.
+The requests slower than settings.PROFILING_SLOW_REQUEST_MS are sampled into the 'profiling' log
+with their queries, and the views that make more queries than their budget are reported or,
+with settings.PROFILING_RAISE_ON_BUDGET (e.g. in tests), fail with QueryBudgetExceeded.
+"""
+
+import contextvars
+import logging
+import random
+import threading
+
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from time import perf_counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from rest_framework.response import Response
+from rest_framework.serializers import BaseSerializer
+
+logger = logging.getLogger('profiling')
+
+_current_profile = contextvars.ContextVar('request_profile', default=None)
+_install_lock = threading.Lock()
+_installed = False
+
+
+class QueryBudgetExceeded(Exception):
+    """
+    The view made more SQL queries than its budget in settings.PROFILING_QUERY_BUDGETS.
+    """
+
+
+@dataclass
+class RequestProfile:
+    """
+    The timings of a single request in seconds and its SQL queries.
+    """
+
+    queries: list[tuple[str, float]] = field(default_factory=list)
+    query_count: int = 0
+    db: float = 0
+    serializer: float = 0
+    renderer: float = 0
+    # The nesting of the measured spans, so a serializer inside a serializer is not counted twice
+    depth: dict[str, int] = field(default_factory=dict)
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        """The database execute wrapper that counts the queries and their time."""
+
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = perf_counter() - start
+            self.db += duration
+            self.query_count += 1
+            if len(self.queries) < settings.PROFILING_MAX_LOGGED_QUERIES:
+                self.queries.append((sql, duration))
+
+
+def _timed_property(cls: type, name: str, span: str) -> None:
+    """Replaces the property of the class with the one that adds its time to the span of the current profile."""
+
+    original = getattr(cls, name)
+
+    def getter(self):
+        profile = _current_profile.get()
+        if profile is None or profile.depth.get(span):
+            return original.fget(self)
+
+        profile.depth[span] = 1
+        start = perf_counter()
+        try:
+            return original.fget(self)
+        finally:
+            setattr(profile, span, getattr(profile, span) + perf_counter() - start)
+            profile.depth[span] = 0
+
+    setattr(cls, name, property(getter, doc=original.__doc__))
+
+
+def _install_timers() -> None:
+    """Measures the serializers (BaseSerializer.data) and the renderers (Response.rendered_content) once."""
+
+    global _installed
+    with _install_lock:
+        if not _installed:
+            _timed_property(BaseSerializer, 'data', 'serializer')
+            _timed_property(Response, 'rendered_content', 'renderer')
+            _installed = True
+
+
+def get_query_budget(view_name: str | None) -> int | None:
+    """Returns the maximum number of the SQL queries of the view, None means unlimited."""
+
+    return settings.PROFILING_QUERY_BUDGETS.get(view_name, settings.PROFILING_DEFAULT_QUERY_BUDGET)
+
+
+class ProfilingMiddleware:
+    """
+    Profiles the requests when settings.PROFILING_ENABLED is on, otherwise it is not used at all.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed()
+        _install_timers()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+        start = perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(profile.execute_wrapper))
+                # The streaming responses are generated while they are sent, only their start is measured.
+                response = self.get_response(request)
+        finally:
+            _current_profile.reset(token)
+        total = perf_counter() - start
+
+        match = request.resolver_match
+        view_name = match.view_name if match else None
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={profile.db * 1000:.2f};desc="{profile.query_count} queries"',
+            f'serializer;dur={profile.serializer * 1000:.2f}',
+            f'renderer;dur={profile.renderer * 1000:.2f}',
+            f'total;dur={total * 1000:.2f}',
+        ])
+
+        if total * 1000 >= settings.PROFILING_SLOW_REQUEST_MS and random.random() < settings.PROFILING_SAMPLE_RATE:
+            self.log_slow_request(request, view_name, profile, total)
+
+        budget = get_query_budget(view_name)
+        if budget is not None and profile.query_count > budget:
+            message = (f'{request.method} {request.path} ({view_name}) made {profile.query_count} SQL queries, '
+                       f'the budget is {budget}')
+            if settings.PROFILING_RAISE_ON_BUDGET:
+                raise QueryBudgetExceeded(message + ':\n' + '\n'.join(sql for sql, _ in profile.queries))
+            logger.warning(message)
+
+        return response
+
+    @staticmethod
+    def log_slow_request(request, view_name: str | None, profile: RequestProfile, total: float) -> None:
+        queries = '\n'.join(f'  {duration * 1000:.2f}ms {sql}' for sql, duration in profile.queries)
+        logger.warning(
+            f'Slow request {request.method} {request.get_full_path()} ({view_name}): {total * 1000:.2f}ms, '
+            f'{profile.query_count} queries in {profile.db * 1000:.2f}ms, '
+            f'serializer {profile.serializer * 1000:.2f}ms, renderer {profile.renderer * 1000:.2f}ms\n{queries}'
+        )
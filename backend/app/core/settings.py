@@ -40,6 +40,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'django_extensions',
 
@@ -52,6 +53,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.metrics.MetricsMiddleware',
+    'core.profiling.ProfilingMiddleware',
+    'core.throttling.RateLimitMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -84,6 +88,12 @@ WSGI_APPLICATION = 'core.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
+# The persistent connections (see core.db): the seconds a connection is kept open by a thread of the web
+# and Celery processes, 0 closes it after every request and task (e.g. under ASGI, which runs the requests
+# in threads of their own), and whether it is checked before it is reused
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', 60))
+DB_CONN_HEALTH_CHECKS = str(os.getenv('DB_CONN_HEALTH_CHECKS', 'True')) == 'True'
+
 DATABASES = {
     'default': {
         'ENGINE': str(os.getenv('DB_ENGINE')),
@@ -92,6 +102,8 @@ DATABASES = {
         'PASSWORD': str(os.getenv('DB_PASSWORD')),
         'HOST': str(os.getenv('DB_HOST')),
         'PORT': str(os.getenv('DB_PORT')),
+        'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': DB_CONN_HEALTH_CHECKS,
     }
 }
 
@@ -145,12 +157,31 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.AllowAny'
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
-        'rest_framework.authentication.BasicAuthentication',
+        'apps.accounts_api_v1.authentication.CachedTokenAuthentication',
+        'apps.accounts_api_v1.authentication.CachedBasicAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
+    # The token buckets of core.throttling, a rate is the capacity of the bucket per period (s, min, hour, day)
+    'DEFAULT_THROTTLE_CLASSES': [
+        'core.throttling.AnonBucketThrottle',
+        'core.throttling.UserBucketThrottle',
+        'core.throttling.ScopedBucketThrottle',
+    ],
+    'DEFAULT_THROTTLE_RATES': {
+        'anon': os.getenv('THROTTLE_RATE_ANON', '120/min'),
+        'user': os.getenv('THROTTLE_RATE_USER', '1200/min'),
+        'export': os.getenv('THROTTLE_RATE_EXPORT', '10/min'),
+        'search': os.getenv('THROTTLE_RATE_SEARCH', '300/min'),
+        'stream': os.getenv('THROTTLE_RATE_STREAM', '30/min'),
+    },
 }
 
+# The cached authentication (see apps.accounts_api_v1.authentication): the seconds the tokens and the verified
+# Basic credentials are kept in the shared cache, and in the process, which delays their revocation in the others
+AUTH_TOKEN_CACHE_TIMEOUT = int(os.getenv('AUTH_TOKEN_CACHE_TIMEOUT', 5 * 60))
+AUTH_BASIC_CACHE_TIMEOUT = int(os.getenv('AUTH_BASIC_CACHE_TIMEOUT', 60))
+AUTH_LOCAL_CACHE_TIMEOUT = float(os.getenv('AUTH_LOCAL_CACHE_TIMEOUT', 5))
+
 DJOSER = {
     'PASSWORD_RESET_CONFIRM_URL': '#/password/reset/confirm/{uid}/{token}',
     'USERNAME_RESET_CONFIRM_URL': '#/username/reset/confirm/{uid}/{token}',
@@ -177,10 +208,156 @@ BROKER_TRANSPORT_OPTIONS = {'visibility_timeout': 3600}
 CELERY_RESULT_BACKEND = 'redis://' + REDIS_HOST + ':' + REDIS_PORT + '/0'
 CELERY_TIMEZONE = TIME_ZONE
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://' + REDIS_HOST + ':' + REDIS_PORT + '/1',
+    }
+}
+
+# The throttling of the API (see core.throttling): the Redis server of the buckets shared by the workers
+# (the buckets of the process are used if it is empty), its timeout and the seconds the process buckets are used
+# after it fails
+THROTTLE_ENABLED = str(os.getenv('THROTTLE_ENABLED', 'True')) == 'True'
+THROTTLE_REDIS_URL = str(os.getenv('THROTTLE_REDIS_URL', 'redis://' + REDIS_HOST + ':' + REDIS_PORT + '/1'))
+THROTTLE_REDIS_TIMEOUT = float(os.getenv('THROTTLE_REDIS_TIMEOUT', 0.1))
+THROTTLE_REDIS_RETRY_INTERVAL = float(os.getenv('THROTTLE_REDIS_RETRY_INTERVAL', 30))
+
+# The failure notifications of the Celery tasks (see core.notifications): the queue of the failures shared by the
+# workers (the in-process queue is used if it is empty), the minimum interval between the digests in seconds,
+# the time the administrators are cached and the Celery queue of the digest task (the default queue if empty)
+NOTIFICATIONS_REDIS_URL = str(os.getenv('NOTIFICATIONS_REDIS_URL', 'redis://' + REDIS_HOST + ':' + REDIS_PORT + '/1'))
+NOTIFICATIONS_DIGEST_INTERVAL = int(os.getenv('NOTIFICATIONS_DIGEST_INTERVAL', 5 * 60))
+NOTIFICATIONS_RECIPIENTS_CACHE_TIMEOUT = int(os.getenv('NOTIFICATIONS_RECIPIENTS_CACHE_TIMEOUT', 10 * 60))
+NOTIFICATIONS_QUEUE = os.getenv('NOTIFICATIONS_QUEUE')
+
+# The Prometheus metrics (see core.metrics): the store shared by the processes ('redis' or 'local' for one process),
+# the seconds the updates are dropped after Redis fails and the token required by the /metrics endpoint
+# (without it the endpoint is open only in DEBUG)
+METRICS_ENABLED = str(os.getenv('METRICS_ENABLED', 'True')) == 'True'
+METRICS_STORE = str(os.getenv('METRICS_STORE', 'redis'))
+METRICS_REDIS_URL = str(os.getenv('METRICS_REDIS_URL', 'redis://' + REDIS_HOST + ':' + REDIS_PORT + '/2'))
+METRICS_REDIS_RETRY_INTERVAL = float(os.getenv('METRICS_REDIS_RETRY_INTERVAL', 30))
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+# The request profiler for development (see core.profiling): the Server-Timing header, the log of the requests
+# slower than PROFILING_SLOW_REQUEST_MS (the sampled share of them) and the query budgets of the views by URL name
+PROFILING_ENABLED = str(os.getenv('PROFILING_ENABLED', 'False')) == 'True'
+PROFILING_SLOW_REQUEST_MS = float(os.getenv('PROFILING_SLOW_REQUEST_MS', 500))
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', 1))
+PROFILING_MAX_LOGGED_QUERIES = int(os.getenv('PROFILING_MAX_LOGGED_QUERIES', 100))
+# Raise QueryBudgetExceeded instead of logging a warning when a view exceeds its budget
+PROFILING_RAISE_ON_BUDGET = str(os.getenv('PROFILING_RAISE_ON_BUDGET', 'False')) == 'True'
+PROFILING_DEFAULT_QUERY_BUDGET = None
+PROFILING_QUERY_BUDGETS = {
+    'stock-list': 2,
+    'stock-detail': 2,
+    'stock-batch': 2,
+    'stock-search': 3,
+    'stock-export': 2,
+    'stock-candles': 3,
+    'stock-changes': 3,
+    'login': 4,
+    'logout': 3,
+    'user-me': 3,
+    'user-list': 4,
+}
+
+# The cached API responses are invalidated by the stock loader, the timeout only evicts the stale versions
+STOCKS_RESPONSE_CACHE_TIMEOUT = int(os.getenv('STOCKS_RESPONSE_CACHE_TIMEOUT', 60 * 60))
+
+# Render the JSON list of the stocks without the serializer, the output is the same
+STOCKS_FAST_LIST = str(os.getenv('STOCKS_FAST_LIST', 'True')) == 'True'
+
+# The maximum number of tickers or ISINs in one batch lookup
+STOCKS_BATCH_MAX_SIZE = int(os.getenv('STOCKS_BATCH_MAX_SIZE', 500))
+
+# The number of rows read from the database and encoded at once by the stock export
+STOCKS_EXPORT_CHUNK_SIZE = int(os.getenv('STOCKS_EXPORT_CHUNK_SIZE', 2000))
+
+# The default and the maximum number of the stocks found by the search
+STOCKS_SEARCH_LIMIT = int(os.getenv('STOCKS_SEARCH_LIMIT', 20))
+STOCKS_SEARCH_MAX_LIMIT = int(os.getenv('STOCKS_SEARCH_MAX_LIMIT', 100))
+
+# The stock loader mode: 'diff' writes only the changed rows, 'full' rewrites every row
+STOCKS_INGESTION_MODE = str(os.getenv('STOCKS_INGESTION_MODE', 'diff'))
+# The lock that lets only one stock loader run at a time (see utils.single_flight): the Redis server,
+# the in-process lock is used if it is empty, the timeout in seconds of its commands,
+# and the lease in seconds that is renewed while a loader runs
+STOCKS_LOCK_REDIS_URL = str(os.getenv('STOCKS_LOCK_REDIS_URL', 'redis://' + REDIS_HOST + ':' + REDIS_PORT + '/1'))
+STOCKS_LOCK_REDIS_TIMEOUT = float(os.getenv('STOCKS_LOCK_REDIS_TIMEOUT', 1))
+STOCKS_INGESTION_LOCK_LEASE = int(os.getenv('STOCKS_INGESTION_LOCK_LEASE', 60))
+# Trace the peak memory of the stages of the stock loader with tracemalloc, which slows the allocations down
+STOCKS_INGESTION_TRACE_MEMORY = str(os.getenv('STOCKS_INGESTION_TRACE_MEMORY', 'False')) == 'True'
+
+# The default and the maximum number of the stocks and of the removed tickers of a page of the changes feed,
+# the age in seconds of the newest rows it returns, which covers the clock skew and the writes outside of
+# the stock loader, and the expiry in seconds of the mark of a loader write, whose start the tokens never pass
+STOCKS_CHANGES_LIMIT = int(os.getenv('STOCKS_CHANGES_LIMIT', 500))
+STOCKS_CHANGES_MAX_LIMIT = int(os.getenv('STOCKS_CHANGES_MAX_LIMIT', 5000))
+STOCKS_CHANGES_LAG = float(os.getenv('STOCKS_CHANGES_LAG', 5))
+STOCKS_CHANGES_WRITE_TIMEOUT = int(os.getenv('STOCKS_CHANGES_WRITE_TIMEOUT', 30 * 60))
+
+# The real-time push of the stock changes (see utils.price_stream): the Redis server of the channel shared
+# by the processes, the in-process channel is used if it is empty, and the pushed fields of the stocks
+STOCKS_STREAM_REDIS_URL = str(os.getenv('STOCKS_STREAM_REDIS_URL', 'redis://' + REDIS_HOST + ':' + REDIS_PORT + '/3'))
+STOCKS_STREAM_FIELDS = str(os.getenv('STOCKS_STREAM_FIELDS', 'prevprice prevlegalcloseprice prevdate status')).split()
+# The maximum number of the tickers of a client and of the open streams of a client (a user or an IP address)
+# in a process, the seconds between the keep-alive messages of an idle stream,
+# the reconnection delay of the clients in milliseconds and of the Redis listener in seconds
+STOCKS_STREAM_MAX_TICKERS = int(os.getenv('STOCKS_STREAM_MAX_TICKERS', 200))
+STOCKS_STREAM_MAX_CONNECTIONS = int(os.getenv('STOCKS_STREAM_MAX_CONNECTIONS', 5))
+STOCKS_STREAM_HEARTBEAT = float(os.getenv('STOCKS_STREAM_HEARTBEAT', 15))
+STOCKS_STREAM_RETRY_MS = int(os.getenv('STOCKS_STREAM_RETRY_MS', 3000))
+STOCKS_STREAM_RECONNECT_DELAY = float(os.getenv('STOCKS_STREAM_RECONNECT_DELAY', 1))
+
+# The boards loaded by the load_markets task as 'engine/market/board'
+STOCKS_MARKETS = str(os.getenv(
+    'STOCKS_MARKETS',
+    'stock/shares/TQBR stock/bonds/TQOB stock/bonds/TQCB currency/selt/CETS futures/forts/RFUD',
+)).split()
+# The trading calendar of the exchange (see utils.market_calendar): the sessions in the market time zone,
+# the trading weekdays (Monday is 0), the holidays in addition to the calendar file
+STOCKS_MARKET_TIMEZONE = str(os.getenv('STOCKS_MARKET_TIMEZONE', 'Europe/Moscow'))
+STOCKS_MARKET_SESSIONS = str(os.getenv('STOCKS_MARKET_SESSIONS', '06:50-18:50 19:05-23:50'))
+STOCKS_MARKET_WEEKDAYS = [int(day) for day in str(os.getenv('STOCKS_MARKET_WEEKDAYS', '0 1 2 3 4')).split()]
+STOCKS_MARKET_HOLIDAYS = str(os.getenv('STOCKS_MARKET_HOLIDAYS', '')).split()
+STOCKS_MARKET_CALENDAR_FILE = os.getenv(
+    'STOCKS_MARKET_CALENDAR_FILE', BASE_DIR / 'apps/stocks_api_v1/fixtures/market_calendar.json',
+)
+# The intervals of the stock loader in seconds: during the sessions, outside them and the final run after the close
+STOCKS_SCHEDULE_SESSION_INTERVAL = int(os.getenv('STOCKS_SCHEDULE_SESSION_INTERVAL', 60))
+STOCKS_SCHEDULE_IDLE_INTERVAL = int(os.getenv('STOCKS_SCHEDULE_IDLE_INTERVAL', 6 * 60 * 60))
+STOCKS_SCHEDULE_POST_CLOSE_DELAY = int(os.getenv('STOCKS_SCHEDULE_POST_CLOSE_DELAY', 15 * 60))
+# The ISS API: the base URL, the maximum number of concurrent requests and the request timeout in seconds
+ISS_BASE_URL = str(os.getenv('ISS_BASE_URL', 'https://iss.moex.com/iss/'))
+STOCKS_MARKETS_CONCURRENCY = int(os.getenv('STOCKS_MARKETS_CONCURRENCY', 4))
+STOCKS_MARKETS_TIMEOUT = float(os.getenv('STOCKS_MARKETS_TIMEOUT', 30))
+# Serve the ISS requests from the recorded fixtures (see utils.iss_standin) instead of the network
+ISS_REPLAY = str(os.getenv('ISS_REPLAY', 'False')) == 'True'
+ISS_REPLAY_DIR = os.getenv('ISS_REPLAY_DIR', BASE_DIR / 'apps/stocks_api_v1/fixtures/iss')
+ISS_REPLAY_LATENCY = float(os.getenv('ISS_REPLAY_LATENCY', 0))
+ISS_REPLAY_ERROR_RATE = float(os.getenv('ISS_REPLAY_ERROR_RATE', 0))
+# The number of the securities per board served by the replay, 0 serves them as recorded
+ISS_REPLAY_SCALE = int(os.getenv('ISS_REPLAY_SCALE', 0))
+
+# The candle loader: the history loaded for a new ticker, the sizes of the market pages and of the DB writes
+CANDLES_HISTORY_DAYS = int(os.getenv('CANDLES_HISTORY_DAYS', 30))
+CANDLES_PAGE_SIZE = int(os.getenv('CANDLES_PAGE_SIZE', 50000))
+CANDLES_BATCH_SIZE = int(os.getenv('CANDLES_BATCH_SIZE', 10000))
+# The intraday candles older than this number of months are dropped, 0 keeps them forever
+CANDLES_RETENTION_MONTHS = int(os.getenv('CANDLES_RETENTION_MONTHS', 0))
+# The maximum number of candles returned by the API at once
+CANDLES_MAX_ROWS = int(os.getenv('CANDLES_MAX_ROWS', 5000))
+
 LOGGING_DIR = BASE_DIR / '../logs'
 if not os.path.exists(LOGGING_DIR):
     os.makedirs(LOGGING_DIR)
 
+# The formatter of the log files: 'json' writes a JSON object per record, 'verbose' writes plain text
+LOGGING_FORMATTER = os.getenv('LOGGING_FORMATTER', 'json')
+
+# The file handlers only queue the records, they are written by a background thread (see core.logs)
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': True,
@@ -193,21 +370,32 @@ LOGGING = {
             'format': '[{asctime}] [{levelname}] -> {message}',
             'style': '{',
         },
+        'json': {
+            '()': 'core.logs.JsonFormatter',
+        },
     },
     'handlers': {
         'celery': {
             'level': 'DEBUG',
-            'class': 'logging.handlers.RotatingFileHandler',
+            'class': 'core.logs.QueuedRotatingFileHandler',
             'filename': LOGGING_DIR / 'celery.log',
-            'formatter': 'verbose',
+            'formatter': LOGGING_FORMATTER,
             'maxBytes': 1024 * 1024 * 10,
             'backupCount': 5,
         },
         'stocks': {
             'level': 'INFO',
-            'class': 'logging.handlers.RotatingFileHandler',
+            'class': 'core.logs.QueuedRotatingFileHandler',
             'filename': LOGGING_DIR / 'stocks.log',
-            'formatter': 'verbose',
+            'formatter': LOGGING_FORMATTER,
+            'maxBytes': 1024 * 1024 * 10,
+            'backupCount': 5,
+        },
+        'profiling': {
+            'level': 'INFO',
+            'class': 'core.logs.QueuedRotatingFileHandler',
+            'filename': LOGGING_DIR / 'profiling.log',
+            'formatter': LOGGING_FORMATTER,
             'maxBytes': 1024 * 1024 * 10,
             'backupCount': 5,
         },
@@ -228,5 +416,10 @@ LOGGING = {
             'level': 'INFO',
             'propagate': False,
         },
+        'profiling': {
+            'handlers': ['profiling', 'console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     }
 }
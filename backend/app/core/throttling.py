@@ -0,0 +1,270 @@
+"""
+The token bucket throttling of the API.
+
+Every client has a bucket per scope that holds up to the number of the requests of its rate and is refilled
+at that rate, so a client can make a burst of requests and then as many as the rate allows. The buckets
+of the anonymous clients are keyed by the IP address, of the authenticated ones by the user, and the
+expensive endpoints (the views with throttle_scope, e.g. the export and the search) have buckets of their own.
+The rates are the DEFAULT_THROTTLE_RATES of settings.REST_FRAMEWORK.
+
+The buckets are kept in Redis (settings.THROTTLE_REDIS_URL) and updated atomically by a Lua script
+with the clock of the Redis server, so the limits are shared by all the workers. While Redis is unavailable
+the buckets are kept in the process, so each worker enforces the limits on its own.
+The responses get the RateLimit-Limit, RateLimit-Remaining and RateLimit-Reset headers of the most
+exhausted bucket of the request, the throttled ones get Retry-After from DRF as well.
+"""
+
+import logging
+import math
+import threading
+import time
+
+from dataclasses import dataclass
+
+import redis
+
+from django.conf import settings
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+logger = logging.getLogger('stocks')
+
+KEY_PREFIX = 'throttle'
+
+# The units of the throttle rates, e.g. '100/min'
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+# The maximum number of the buckets kept in the process
+LOCAL_MAX_BUCKETS = 100000
+
+# Takes a token from the bucket KEYS[1] of the capacity ARGV[1] refilled with ARGV[2] tokens per second.
+# Returns whether the token has been taken and the tokens left.
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', string.format('%.6f', tokens), 'updated', string.format('%.6f', now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate * 1000) + 1000)
+return {allowed, string.format('%.6f', tokens)}
+"""
+
+
+@dataclass
+class BucketState:
+    """
+    The state of a bucket after a request.
+    """
+
+    allowed: bool
+    capacity: int
+    rate: float
+    tokens: float
+
+    @property
+    def remaining(self) -> int:
+        return math.floor(self.tokens)
+
+    @property
+    def retry_after(self) -> float:
+        """The seconds until a token is available."""
+
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    @property
+    def reset(self) -> float:
+        """The seconds until the bucket is full again."""
+
+        return (self.capacity - self.tokens) / self.rate
+
+
+class RedisBucketStore:
+    """
+    Keeps the buckets in Redis, shared by all the workers.
+    """
+
+    def __init__(self, url: str):
+        timeout = settings.THROTTLE_REDIS_TIMEOUT
+        self._client = redis.Redis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout)
+        self._take = self._client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def take(self, key: str, capacity: int, rate: float) -> BucketState:
+        allowed, tokens = self._take(keys=[key], args=[capacity, rate])
+        return BucketState(allowed=bool(allowed), capacity=capacity, rate=rate, tokens=float(tokens))
+
+
+class LocalBucketStore:
+    """
+    Keeps the buckets in the process, for tests and while Redis is unavailable.
+    """
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key: str, capacity: int, rate: float) -> BucketState:
+        now = time.monotonic()
+        with self._lock:
+            if len(self._buckets) >= LOCAL_MAX_BUCKETS:
+                # The full buckets are the same as the missing ones.
+                self._buckets = {
+                    key: (tokens, updated) for key, (tokens, updated) in self._buckets.items()
+                    if tokens + (now - updated) * rate < capacity
+                }
+                if len(self._buckets) >= LOCAL_MAX_BUCKETS:
+                    self._buckets.clear()
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+        return BucketState(allowed=allowed, capacity=capacity, rate=rate, tokens=tokens)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+_local_store = LocalBucketStore()
+# The monotonic time before which Redis is not tried again after a failure
+_redis_retry_at = 0.0
+
+
+def take_token(key: str, capacity: int, rate: float) -> BucketState:
+    """
+    Takes a token from the bucket in Redis, or in the process if settings.THROTTLE_REDIS_URL is empty
+    or Redis has failed within the last settings.THROTTLE_REDIS_RETRY_INTERVAL seconds.
+
+    Parameters:
+        key (str): The key of the bucket.
+        capacity (int): The maximum number of the tokens of the bucket.
+        rate (float): The tokens added to the bucket per second.
+
+    Returns:
+        BucketState: The state of the bucket after the request.
+    """
+
+    global _redis_retry_at
+
+    url = settings.THROTTLE_REDIS_URL
+    if url and time.monotonic() >= _redis_retry_at:
+        with _stores_lock:
+            if url not in _stores:
+                _stores[url] = RedisBucketStore(url)
+            store = _stores[url]
+        try:
+            return store.take(key, capacity, rate)
+        except redis.RedisError as error:
+            logger.warning(f'The throttling falls back to the process buckets, Redis is unavailable: {error}')
+            _redis_retry_at = time.monotonic() + settings.THROTTLE_REDIS_RETRY_INTERVAL
+    return _local_store.take(key, capacity, rate)
+
+
+def parse_rate(rate: str) -> tuple[int, float]:
+    """Returns the capacity and the tokens per second of the rate 'requests/period', e.g. '100/min'."""
+
+    requests, period = rate.split('/')
+    return int(requests), int(requests) / PERIODS[period[0]]
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    The base of the token bucket throttles. The subclasses define the scope and the identity of the client.
+    """
+
+    scope = None
+
+    def get_scope(self, view) -> str | None:
+        return self.scope
+
+    def get_identity(self, request) -> str | None:
+        """Returns the identity of the client that owns the bucket, None if the throttle does not apply."""
+
+        raise NotImplementedError
+
+    def allow_request(self, request, view) -> bool:
+        if not settings.THROTTLE_ENABLED:
+            return True
+        scope = self.get_scope(view)
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(scope)
+        if rate is None or (identity := self.get_identity(request)) is None:
+            return True
+
+        capacity, tokens_per_second = parse_rate(rate)
+        self.state = take_token(f'{KEY_PREFIX}:{scope}:{identity}', capacity, tokens_per_second)
+
+        # The headers of the most exhausted bucket are added by RateLimitMiddleware, which sees the Django request.
+        http_request = getattr(request, '_request', request)
+        current = getattr(http_request, 'rate_limit', None)
+        if current is None or (self.state.allowed, self.state.tokens) < (current.allowed, current.tokens):
+            http_request.rate_limit = self.state
+        return self.state.allowed
+
+    def wait(self) -> float | None:
+        return self.state.retry_after
+
+
+class AnonBucketThrottle(TokenBucketThrottle):
+    """
+    Throttles the anonymous clients by the IP address.
+    """
+
+    scope = 'anon'
+
+    def get_identity(self, request) -> str | None:
+        if request.user and request.user.is_authenticated:
+            return None
+        return self.get_ident(request)
+
+
+class UserBucketThrottle(TokenBucketThrottle):
+    """
+    Throttles the authenticated clients by the user, whatever token or credentials they use.
+    """
+
+    scope = 'user'
+
+    def get_identity(self, request) -> str | None:
+        if request.user and request.user.is_authenticated:
+            return str(request.user.pk)
+        return None
+
+
+class ScopedBucketThrottle(TokenBucketThrottle):
+    """
+    Throttles the requests to the views with throttle_scope (e.g. set by @action) by the user or the IP address,
+    in addition to the anonymous and the user throttles.
+    """
+
+    def get_scope(self, view) -> str | None:
+        return getattr(view, 'throttle_scope', None)
+
+    def get_identity(self, request) -> str | None:
+        if request.user and request.user.is_authenticated:
+            return f'user:{request.user.pk}'
+        return f'ip:{self.get_ident(request)}'
+
+
+class RateLimitMiddleware:
+    """
+    Adds the rate limit headers of the throttled API requests to their responses.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if (state := getattr(request, 'rate_limit', None)) is not None:
+            response['RateLimit-Limit'] = str(state.capacity)
+            response['RateLimit-Remaining'] = str(state.remaining)
+            response['RateLimit-Reset'] = str(math.ceil(state.reset))
+        return response
@@ -17,6 +17,8 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from core.metrics import metrics_view
+
 urlpatterns_api_v1 = [
     path('', include('apps.stocks_api_v1.urls')),
     path('auth/', include('apps.accounts_api_v1.urls')),
@@ -25,4 +27,5 @@ urlpatterns_api_v1 = [
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/v1/', include(urlpatterns_api_v1)),
+    path('metrics', metrics_view, name='metrics'),
 ]